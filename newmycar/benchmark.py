@@ -0,0 +1,738 @@
+#!/usr/bin/env python3
+"""
+Micro benchmarks for the parts and the data bus of the factory vehicle.
+
+Usage:
+    benchmark.py databus [--seconds=<s>] [--hz=<hz>]
+    benchmark.py frames [--frames=<n>]
+    benchmark.py schedule [--seconds=<s>] [--hz=<hz>] [--parts=<n>] [--policy=<p>]
+    benchmark.py groups [--seconds=<s>] [--hz=<hz>] [--parts=<n>]
+    benchmark.py tub [--frames=<n>] [--hz=<hz>] [--policy=<p>]
+    benchmark.py tubformat [--frames=<n>]
+    benchmark.py tubindex [--records=<n>]
+    benchmark.py tubread [--frames=<n>]
+    benchmark.py framecache [--frames=<n>]
+    benchmark.py joystick [--seconds=<s>] [--hz=<hz>]
+    benchmark.py pygame [--seconds=<s>] [--hz=<hz>]
+    benchmark.py zmqjoystick [--seconds=<s>] [--hz=<hz>]
+    benchmark.py delayline [--frames=<n>] [--hz=<hz>]
+
+Options:
+    -h --help               Show this screen.
+    --seconds=<s>           Duration of each run in seconds. [default: 2]
+    --hz=<hz>               Loop rate of each simulated part. [default: 100]
+    --frames=<n>            Number of frames to write per run. [default: 500]
+    --parts=<n>             Number of simulated parts. [default: 8]
+    --records=<n>           Number of records in the tub. [default: 1000000]
+    --policy=<p>            Overrun policy skip|catchup|shift, for tub the
+                            tub writer policy block|drop_oldest|drop_newest.
+                            [default: skip]
+"""
+
+import os
+import time
+import glob
+import types
+import ctypes
+import random
+import shutil
+import tempfile
+import resource
+import statistics
+import tracemalloc
+from threading import Thread
+from docopt import docopt
+import numpy as np
+
+from donkeycar.vehiclepartsfactory.databus import DataBus, SeqLockDataBus
+from donkeycar.vehiclepartsfactory.scheduler import DeadlineTimer
+import donkeycar.vehiclepartsfactory.partfactory as factory
+from donkeycar.vehiclepartsfactory.tub_v2 import Tub, TubPipeline
+from donkeycar.vehiclepartsfactory.tub_columnar import ColumnarTub
+from donkeycar.vehiclepartsfactory.tubindex import DeletedRuns
+from donkeycar.vehiclepartsfactory.tubreader import TubReader
+from donkeycar.vehiclepartsfactory.framecache import FrameCache
+from donkeycar.vehiclepartsfactory.jscontroller import JoystickReader, JS_EVENT, JS_EVENT_AXIS
+from PIL import Image
+
+
+def percentile(values, p):
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+#__________________________________ DATABUS _____________________________________
+
+def bench_databus(seconds, hz):
+    """
+    Run n simulated parts, each reading a few keys and writing two keys at
+    the given rate, and report the cost of the bus calls per loop.
+    """
+    reads = ['user/mode', 'user/angle', 'user/throttle', 'pilot/angle']
+    print(f'{"bus":<16}{"parts":>6}{"mean us":>10}{"p99 us":>10}{"late %":>8}')
+    for bus_class in (DataBus, SeqLockDataBus):
+        for num_parts in (1, 2, 4, 8, 16):
+            bus = bus_class()
+            for key in reads:
+                bus.write(key, float, 0.)
+            costs = []
+            late = [0, 0]
+            stop = time.perf_counter() + seconds
+
+            def part(index):
+                period = 1. / hz
+                next_time = time.perf_counter()
+                out_angle, out_throttle = f'out{index}/angle', f'out{index}/throttle'
+                while time.perf_counter() < stop:
+                    start = time.perf_counter_ns()
+                    for key in reads:
+                        bus.read(key)
+                    bus.readlist(reads)
+                    with bus.write_section():
+                        bus.write(out_angle, float, float(index))
+                        bus.write(out_throttle, float, float(index))
+                    costs.append(time.perf_counter_ns() - start)
+                    next_time += period
+                    delay = next_time - time.perf_counter()
+                    late[1] += 1
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        late[0] += 1
+
+            threads = [Thread(target=part, args=(i,)) for i in range(num_parts)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            print(f'{bus_class.__name__:<16}{num_parts:>6}'
+                  f'{statistics.mean(costs) / 1000:>10.2f}'
+                  f'{percentile(costs, 0.99) / 1000:>10.2f}'
+                  f'{100 * late[0] / max(1, late[1]):>8.1f}')
+
+
+#__________________________________ FRAMES ______________________________________
+
+def bench_frames(num_frames):
+    """
+    Write camera frames to the bus while a consumer holds on to the last frame
+    it read, as AI_Pilot and TubWriter do, and report the memory allocated per
+    frame in steady state. 'copy' is the plain bus getting a new array per
+    frame, 'ring' copies into the frame ring, 'in place' fills the next ring
+    slot directly.
+    """
+    key = 'cam/image_array'
+    print(f'{"shape":<14}{"mode":<10}{"alloc/frame KiB":>16}{"growth KiB":>12}{"us/frame":>10}')
+    for shape in ((120, 160, 3), (480, 640, 3)):
+        camera = np.zeros(shape, dtype=np.uint8)
+        for mode in ('copy', 'ring', 'in place'):
+            bus = DataBus()
+            if mode != 'copy':
+                bus.add_frame_ring(key, shape)
+            held = []
+
+            def step(i):
+                camera[0, 0, 0] = i % 255
+                if mode == 'copy':
+                    bus.write(key, np.ndarray, camera.copy())
+                elif mode == 'ring':
+                    bus.write(key, np.ndarray, camera)
+                else:
+                    slot = bus.frame_slot(key)
+                    slot[...] = camera
+                    bus.publish_frame(key)
+                # the consumer keeps its last frame alive until the next read
+                held[:] = [bus.read(key)]
+
+            for i in range(10):
+                step(i)
+            tracemalloc.start()
+            start_memory, _ = tracemalloc.get_traced_memory()
+            allocated = 0
+            start = time.perf_counter()
+            for i in range(num_frames):
+                current, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                step(i)
+                _, peak = tracemalloc.get_traced_memory()
+                allocated += peak - current
+            duration = time.perf_counter() - start
+            end_memory, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f'{"x".join(map(str, shape)):<14}{mode:<10}'
+                  f'{allocated / num_frames / 1024:>16.2f}'
+                  f'{(end_memory - start_memory) / 1024:>12.2f}'
+                  f'{duration / num_frames * 1e6:>10.1f}')
+
+
+#__________________________________ SCHEDULE ____________________________________
+
+def bench_schedule(seconds, hz, num_parts, policy):
+    """
+    Run n loops on staggered DeadlineTimers, each doing a little work, and
+    report how far the loop starts are from their deadlines.
+    """
+    period = 1. / hz
+    epoch_ns = time.monotonic_ns()
+    stop = time.monotonic() + seconds
+    results = []
+
+    def part(index):
+        timer = DeadlineTimer(period, offset=period * index / num_parts, policy=policy)
+        timer.start(epoch_ns)
+        lateness = []
+        while time.monotonic() < stop:
+            lateness.append(timer.wait())
+            sum(range(2000))
+        results.append((index, timer, lateness))
+
+    threads = [Thread(target=part, args=(i,)) for i in range(num_parts)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    print(f'{"part":>4}{"avg period ms":>15}{"p50 us":>9}{"p99 us":>9}{"max us":>9}  timer')
+    for index, timer, lateness in sorted(results, key=lambda r: r[0]):
+        print(f'{index:>4}{timer.average_period() * 1000:>15.3f}'
+              f'{percentile(lateness, 0.5) / 1000:>9.0f}'
+              f'{percentile(lateness, 0.99) / 1000:>9.0f}'
+              f'{max(lateness) / 1000:>9.0f}  {timer.report()}')
+
+
+#__________________________________ GROUPS ______________________________________
+
+class RelayPart(factory.Part):
+    """ Light part copying one bus key to the next, like DriveMode or AiLaunch """
+    def __init__(self, loop_time, index):
+        super().__init__(loop_time)
+        self.in_key, self.out_key = f'relay/{index}', f'relay/{index + 1}'
+        self.run_part = True
+
+    def read_from_bus(self):
+        self.value = self.data_bus.read(self.in_key)
+
+    def operate(self):
+        pass
+
+    def write_to_bus(self):
+        if self.value is not None:
+            self.data_bus.write(self.out_key, float, self.value)
+
+
+def bench_groups(seconds, hz, num_parts):
+    """
+    Relay a time stamp through a chain of light parts, once with a thread per
+    part and once in a PartGroup, and report context switches and the time
+    the value needs to reach the end of the chain.
+    """
+    print(f'{"mode":<10}{"ctx switches/s":>16}{"latency ms":>12}')
+    for mode in ('threads', 'group'):
+        bus = SeqLockDataBus()
+        parts = [RelayPart(1. / hz, i) for i in range(num_parts)]
+        if mode == 'group':
+            parts = [factory.PartGroup('light', parts)]
+        for part in parts:
+            part.set_data_bus(bus)
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.perf_counter()
+        for part in parts:
+            part.start()
+        latencies = []
+        while time.perf_counter() - start < seconds:
+            sent = time.perf_counter()
+            bus.write('relay/0', float, sent)
+            while bus.read(f'relay/{num_parts}') != sent:
+                time.sleep(0.001)
+            latencies.append(time.perf_counter() - sent)
+        for part in parts:
+            part.on = False
+        end_usage = resource.getrusage(resource.RUSAGE_SELF)
+        switches = (end_usage.ru_nvcsw - usage.ru_nvcsw) + (end_usage.ru_nivcsw - usage.ru_nivcsw)
+        print(f'{mode:<10}{switches / seconds:>16.0f}'
+              f'{statistics.mean(latencies) * 1000:>12.2f}')
+
+
+#__________________________________ TUB _________________________________________
+
+def bench_tub(num_frames, hz, policy):
+    """
+    Record 640x480 frames at the given rate, once writing inline as the
+    TubWriter loop used to and once through a TubPipeline with thread and
+    process encoders, and report the time the loop spends per record and how
+    many loop deadlines were missed.
+    """
+    if policy not in TubPipeline.POLICIES:
+        policy = 'block'
+    frame = np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)
+    print(f'{"mode":<10}{"mean ms":>9}{"p99 ms":>9}{"late starts":>13}  pipeline')
+    for mode in ('inline', 'thread', 'process'):
+        path = tempfile.mkdtemp()
+        tub = Tub(path, ['cam/image_array', 'user/angle'], ['image_array', 'float'])
+        pipeline = None
+        if mode != 'inline':
+            pipeline = TubPipeline(tub, policy=policy, executor=mode)
+        timer = DeadlineTimer(1. / hz)
+        timer.start()
+        costs = []
+        for i in range(num_frames):
+            timer.wait()
+            start = time.perf_counter_ns()
+            record = {'cam/image_array': frame, 'user/angle': float(i)}
+            if pipeline is not None:
+                pipeline.put(record)
+            else:
+                tub.write_record(record)
+            costs.append(time.perf_counter_ns() - start)
+        if pipeline is not None:
+            pipeline.close()
+        tub.close()
+        shutil.rmtree(path)
+        print(f'{mode:<10}{statistics.mean(costs) / 1e6:>9.2f}'
+              f'{percentile(costs, 0.99) / 1e6:>9.2f}{timer.late_starts:>13}  '
+              f'{pipeline.report() if pipeline else ""}')
+
+
+#__________________________________ TUB FORMAT __________________________________
+
+def disk_usage(path):
+    files = [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+    return len(files), sum(os.path.getsize(f) for f in files)
+
+
+def bench_tub_format(num_frames):
+    """
+    Write 160x120 records to a json tub and to columnar tubs with jpeg and
+    raw frames, then read all angles and images back as training does, and
+    report the times, the number of files and the disk usage.
+    """
+    inputs = ['cam/image_array', 'user/angle', 'user/throttle', 'user/mode']
+    types = ['image_array', 'float', 'float', 'str']
+    frame = np.random.randint(0, 255, (120, 160, 3), dtype=np.uint8)
+    print(f'{"format":<16}{"write s":>9}{"read s":>9}{"files":>8}{"disk MiB":>10}')
+    for name in ('json', 'columnar jpeg', 'columnar raw'):
+        path = tempfile.mkdtemp()
+        if name == 'json':
+            tub = Tub(path, inputs, types)
+        else:
+            tub = ColumnarTub(path, inputs, types, frame_format=name.split()[1])
+        start = time.perf_counter()
+        for i in range(num_frames):
+            tub.write_record({'cam/image_array': frame, 'user/angle': i / num_frames,
+                              'user/throttle': 0.5, 'user/mode': 'user'})
+        tub.close()
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if name == 'json':
+            tub = Tub(path, inputs, types, read_only=True)
+            angles = []
+            for record in tub:
+                angles.append(record['user/angle'])
+                image_path = os.path.join(tub.images_base_path, record['cam/image_array'])
+                np.asarray(Image.open(image_path))
+        else:
+            tub = ColumnarTub(path, read_only=True)
+            angles = tub.column('user/angle')[tub.alive_indexes()]
+            for i in tub.alive_indexes():
+                tub.read_frame('cam/image_array', i)
+        read_time = time.perf_counter() - start
+        files, size = disk_usage(path)
+        shutil.rmtree(path)
+        print(f'{name:<16}{write_time:>9.2f}{read_time:>9.2f}{files:>8}{size / 2**20:>10.2f}')
+
+
+#__________________________________ TUB INDEX ___________________________________
+
+def bench_tub_index(num_records):
+    """
+    Delete the last 20 alive records of a tub, as the joystick erase button
+    does, restore them and count the alive records, once with the set of
+    deleted indexes Tub used to sort and once with DeletedRuns. 1 % of the
+    tub is already deleted in runs of 20.
+    """
+    deleted = set()
+    for start in range(0, num_records, 2000):
+        deleted.update(range(start, min(start + 20, num_records)))
+    runs = DeletedRuns(deleted)
+
+    def with_set():
+        alive = sorted(set(range(num_records)) - deleted)
+        last = alive[-20:]
+        deleted.update(last)
+        deleted.difference_update(last)
+        return num_records - len(deleted)
+
+    def with_runs():
+        last = runs.last_alive(20, num_records)
+        runs.add(last)
+        runs.remove(last)
+        return num_records - len(runs)
+
+    print(f'{"index":<10}{"records":>10}{"deleted":>9}{"ms per erase":>14}')
+    for name, erase in (('set', with_set), ('runs', with_runs)):
+        repeats = 3 if name == 'set' else 1000
+        assert erase() == num_records - len(deleted)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            erase()
+        duration = (time.perf_counter() - start) / repeats
+        print(f'{name:<10}{num_records:>10}{len(deleted):>9}{duration * 1000:>14.3f}')
+
+
+#__________________________________ TUB READ ____________________________________
+
+def make_tub(num_frames):
+    """ json tub of 160x120 frames which compress like camera frames """
+    inputs = ['cam/image_array', 'user/angle', 'user/throttle']
+    types = ['image_array', 'float', 'float']
+    path = tempfile.mkdtemp()
+    tub = Tub(path, inputs, types)
+    frame = np.tile(np.linspace(0, 255, 160, dtype=np.uint8)[None, :, None], (120, 1, 3))
+    for i in range(num_frames):
+        tub.write_record({'cam/image_array': frame, 'user/angle': 0., 'user/throttle': 0.})
+    tub.close()
+    return Tub(path, inputs, types, read_only=True)
+
+
+def bench_tub_read(num_frames):
+    """
+    Read a json tub of 160x120 images once record by record, decoding each
+    image in the loop, and once through TubReader with 1, 2 and 4 decoder
+    threads, and report the records read per second.
+    """
+    tub = make_tub(num_frames)
+    print(f'{"reader":<16}{"records/s":>11}')
+    start = time.perf_counter()
+    for record in tub:
+        np.asarray(Image.open(os.path.join(tub.images_base_path, record['cam/image_array'])))
+    print(f'{"serial":<16}{num_frames / (time.perf_counter() - start):>11.0f}')
+    for workers in (1, 2, 4):
+        reader = TubReader(tub, workers=workers, shuffle=True)
+        start = time.perf_counter()
+        for batch in reader:
+            pass
+        duration = time.perf_counter() - start
+        reader.close()
+        print(f'{"TubReader " + str(workers):<16}{num_frames / duration:>11.0f}')
+    shutil.rmtree(tub.base_path)
+
+
+def bench_frame_cache(num_frames):
+    """
+    Run three shuffled epochs over a tub through TubReader with a FrameCache
+    cropping 45 rows, the first one fills the cache, and report the time per
+    epoch against an epoch without cache.
+    """
+    tub = make_tub(num_frames)
+    print(f'{"epoch":<16}{"seconds":>9}')
+    reader = TubReader(tub, shuffle=True)
+    start = time.perf_counter()
+    for batch in reader:
+        pass
+    print(f'{"no cache":<16}{time.perf_counter() - start:>9.3f}')
+    reader.close()
+    reader = TubReader(tub, shuffle=True, cache=FrameCache(tub, crop=(45, 0, 0, 0)))
+    for epoch in range(3):
+        start = time.perf_counter()
+        for batch in reader:
+            pass
+        print(f'{"cache " + str(epoch + 1):<16}{time.perf_counter() - start:>9.3f}')
+    reader.close()
+    shutil.rmtree(tub.base_path)
+
+
+#__________________________________ JOYSTICK ____________________________________
+
+def bench_joystick(seconds, hz):
+    """
+    Feed steering axis events at 1 kHz into a pipe standing in for
+    /dev/input/js0 and read them in a loop at hz, one 8 byte read per loop as
+    Joystick.poll() did or all pending events with JoystickReader. Reports
+    the events handled and how far the steering lags behind the stick.
+    """
+    print(f'{"reader":<16}{"events/s":>10}{"lag p50 ms":>12}{"lag max ms":>12}')
+    for mode in ('poll', 'reader'):
+        read_fd, write_fd = os.pipe()
+        reader = JoystickReader(read_fd, ['x'], [])
+        on = True
+
+        def feed():
+            # the event time field carries the send time in ms
+            while on:
+                now_ms = int(time.monotonic() * 1000) & 0xffffffff
+                try:
+                    os.write(write_fd, JS_EVENT.pack(now_ms, 0, JS_EVENT_AXIS, 0))
+                except OSError:
+                    break
+                time.sleep(0.001)
+
+        feeder = Thread(target=feed, daemon=True)
+        feeder.start()
+        lags = []
+        handled = 0
+        start = time.monotonic()
+        while time.monotonic() - start < seconds:
+            if mode == 'poll':
+                try:
+                    data = os.read(read_fd, JS_EVENT.size)
+                except BlockingIOError:
+                    data = b''
+                events = [JS_EVENT.unpack(data)] if data else []
+            else:
+                events = list(JS_EVENT.iter_unpack(reader.drain()))
+            handled += len(events)
+            if events:
+                # the steering value set in this loop is the last event's
+                lags.append((int(time.monotonic() * 1000) - events[-1][0]) & 0xffffffff)
+            time.sleep(1. / hz)
+        on = False
+        os.close(write_fd)
+        feeder.join()
+        reader.close()
+        os.close(read_fd)
+        print(f'{mode:<16}{handled / seconds:>10.0f}{percentile(lags, .5):>12.1f}'
+              f'{max(lags, default=0):>12.1f}')
+
+
+#__________________________________ PYGAME ______________________________________
+
+def virtual_joystick(num_axes=6, num_buttons=13):
+    """
+    Attach an SDL virtual joystick (SDL >= 2.0.14) through the SDL library
+    of pygame, returns a function setting one of its axes
+    """
+    import pygame
+    sdl_path = glob.glob(os.path.join(os.path.dirname(pygame.__file__), '..',
+                                      'pygame.libs', 'libSDL2-*'))
+    sdl = ctypes.CDLL(sdl_path[0] if sdl_path else 'libSDL2-2.0.so.0')
+    sdl.SDL_JoystickOpen.restype = ctypes.c_void_p
+    sdl.SDL_JoystickSetVirtualAxis.argtypes = [ctypes.c_void_p, ctypes.c_int,
+                                               ctypes.c_int16]
+    index = sdl.SDL_JoystickAttachVirtual(1, num_axes, num_buttons, 0)
+    joystick = sdl.SDL_JoystickOpen(index)
+    return lambda axis, value: sdl.SDL_JoystickSetVirtualAxis(joystick, axis, value)
+
+
+class LatencyBus(DataBus):
+    """ DataBus noting when each new user/angle value is first written """
+    def __init__(self, sent):
+        super().__init__()
+        self.sent = sent
+        self.latencies = []
+
+    def write(self, data_name, data_type, data):
+        if data_name == 'user/angle' and data in self.sent:
+            self.latencies.append((time.monotonic() - self.sent.pop(data)) * 1000)
+        super().write(data_name, data_type, data)
+
+
+def bench_pygame(seconds, hz):
+    """
+    Move the steering and throttle sticks of an SDL virtual joystick at
+    random every 20 to 40 ms with the dummy SDL video driver, run
+    PyGamePS4JoystickController at hz with the main thread pumping pygame
+    events, and report the latency from a stick move to its user/angle on the
+    bus: one change per poll() with events pumped at 5 Hz against poll_all()
+    with events pumped at hz.
+    """
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    # the dummy window never has the focus
+    os.environ['SDL_JOYSTICK_ALLOW_BACKGROUND_EVENTS'] = '1'
+    import pygame
+    from donkeycar.vehiclepartsfactory.pygameps4_joystick import PyGamePS4JoystickController
+    pygame.init()
+    set_axis = virtual_joystick()
+    cfg = types.SimpleNamespace(JOYSTICK_THROTTLE_DIR=-1., JOYSTICK_THROTTLE_SCALE=1.,
+                                JOYSTICK_STEERING_SCALE=1., AUTO_RECORD_ON_THROTTLE=False,
+                                AI_THROTTLE_MULT=1., DRIVE_LOOP_HZ=hz, JOYSTICK_DEADZONE=0.,
+                                MAINTHREAD_PYGAME_HZ=hz)
+    print(f'{"mode":<16}{"moves":>7}{"seen":>6}{"p50 ms":>9}{"p99 ms":>9}{"max ms":>9}')
+    for mode, pump_hz in (('poll 5 Hz', 5.), (f'poll_all {hz:.0f} Hz', hz)):
+        sent = {}
+        part = PyGamePS4JoystickController(cfg)
+        if mode.startswith('poll '):
+            part.js.poll_all = None
+        bus = LatencyBus(sent)
+        part.set_data_bus(bus)
+        part.start()
+        moves = 0
+        start = next_move = next_pump = time.monotonic()
+        while time.monotonic() - start < seconds:
+            now = time.monotonic()
+            if now >= next_move:
+                # steering and throttle move together
+                value = random.randint(-32767, 32767)
+                set_axis(3, random.randint(-32767, 32767))
+                sent[value / 32768.] = now
+                set_axis(0, value)
+                moves += 1
+                next_move = now + random.uniform(.02, .04)
+            if now >= next_pump:
+                part.mainthread()
+                next_pump += 1. / pump_hz
+            time.sleep(.001)
+        part.stop()
+        part.t.join()
+        latencies = bus.latencies
+        print(f'{mode:<16}{moves:>7}{len(latencies):>6}{percentile(latencies, .5):>9.1f}'
+              f'{percentile(latencies, .99):>9.1f}{max(latencies, default=0):>9.1f}')
+
+
+#__________________________________ ZMQ JOYSTICK ________________________________
+
+class LatencySub(object):
+    """ Wraps the receive methods of a JoyStickSub to time its messages """
+    def __init__(self, sub):
+        self.axis_latencies = []
+        self.button_latencies = []
+        receive_axes, receive_buttons = sub.receive_axes, sub.receive_buttons
+
+        def timed_axes(message):
+            self.axis_latencies.append(latency_ms(message))
+            receive_axes(message)
+
+        def timed_buttons(message):
+            self.button_latencies.append(latency_ms(message))
+            receive_buttons(message)
+        sub.receive_axes, sub.receive_buttons = timed_axes, timed_buttons
+
+
+def latency_ms(message):
+    from donkeycar.vehiclepartsfactory.jscontroller import JS_WIRE_HEADER
+    return (time.time_ns() - JS_WIRE_HEADER.unpack_from(message)[1]) / 1e6
+
+
+def bench_zmq_joystick(seconds, hz):
+    """
+    A JoyStickPub sends stick moves at hz, with a button press or release
+    every tenth move, to a JoyStickSub over inproc:// and ipc://, the
+    consumer takes poll_all() at 20 Hz like the drive loop. Reports the axis
+    messages received (the rest conflated), the button edges received of
+    those sent and the latencies sender to receiving thread.
+    """
+    import zmq
+    from threading import Thread
+    from donkeycar.vehiclepartsfactory.jscontroller import JoyStickPub, JoyStickSub
+    idle = types.SimpleNamespace(poll_all=lambda timeout: [])
+    tmp_dir = tempfile.mkdtemp()
+    print(f'{"transport":<10}{"axes sent":>10}{"recv":>7}{"p50 ms":>8}{"p99 ms":>8}'
+          f'{"edges sent":>11}{"recv":>7}{"p50 ms":>8}{"p99 ms":>8}')
+    for transport, address in (('inproc', 'inproc://joystick'),
+                               ('ipc', f'ipc://{tmp_dir}/joystick')):
+        context = zmq.Context()
+        pub = JoyStickPub(address=address, context=context, js=idle)
+        sub = JoyStickSub(None, address=address, context=context)
+        timing = LatencySub(sub)
+        thread = Thread(target=sub.update, daemon=True)
+        thread.start()
+        # let the subscription reach the publisher
+        time.sleep(.2)
+        moves = edges = received_edges = 0
+        start = next_move = next_poll = time.monotonic()
+        while time.monotonic() - start < seconds:
+            now = time.monotonic()
+            if now >= next_move:
+                events = [(None, None, 'x', random.uniform(-1., 1.))]
+                if moves % 10 == 0:
+                    events.append(('circle', edges % 2 ^ 1, None, None))
+                    edges += 1
+                pub.publish(events)
+                moves += 1
+                next_move += 1. / hz
+            if now >= next_poll:
+                received_edges += sum(1 for event in sub.poll_all() if event[0])
+                next_poll += 1. / 20
+            time.sleep(max(0., min(next_move, next_poll) - time.monotonic()))
+        time.sleep(.2)
+        received_edges += sum(1 for event in sub.poll_all() if event[0])
+        sub.shutdown()
+        thread.join()
+        pub.shutdown()
+        context.term()
+        axes, buttons = timing.axis_latencies, timing.button_latencies
+        print(f'{transport:<10}{pub.axis_seq:>10}{len(axes):>7}{percentile(axes, .5):>8.2f}'
+              f'{percentile(axes, .99):>8.2f}{edges:>11}{received_edges:>7}'
+              f'{percentile(buttons, .5):>8.2f}{percentile(buttons, .99):>8.2f}')
+    shutil.rmtree(tmp_dir)
+
+
+#__________________________________ DELAY LINE __________________________________
+
+class ListDelay(object):
+    """ The list delay buffer DonkeyGymEnv used before DelayLine """
+    def __init__(self, delay, initial):
+        self.delay = delay
+        self.buffer = []
+        self.current = initial
+
+    def push(self, sample, now):
+        self.buffer.append((now, sample))
+        num_to_remove = 0
+        for buf in self.buffer:
+            if now - buf[0] >= self.delay:
+                num_to_remove += 1
+                self.current = buf[1]
+            else:
+                break
+        del self.buffer[:num_to_remove]
+        return self.current
+
+
+def bench_delay_line(frames, hz):
+    """
+    Push frames (frame, info) samples on a simulated clock stepping at hz
+    through the old list buffer and the DelayLine of DonkeyGymEnv, for
+    SIM_ARTIFICIAL_LATENCY 100 and 400 ms, in microseconds per step.
+    """
+    from donkeycar.vehiclepartsfactory.delayline import DelayLine
+    frame = np.zeros((120, 160, 3), dtype=np.uint8)
+    info = {'pos': (0., 0., 0.), 'speed': 0., 'cte': 0.}
+    step_ns = int(1e9 / hz)
+    print(f'{"delay ms":>8}{"buffered":>10}{"list us":>9}{"deque us":>10}')
+    for delay_ms in (100, 400):
+        times = []
+        for line in (ListDelay(delay_ms / 1000, None),
+                     DelayLine(delay_ms / 1000, None)):
+            now = 0
+            # the list buffer compares seconds, the delay line nanoseconds
+            scale = 1e-9 if isinstance(line, ListDelay) else 1
+            start = time.perf_counter()
+            for i in range(frames):
+                line.push((frame, info), now * scale)
+                now += step_ns
+            times.append((time.perf_counter() - start) / frames * 1e6)
+        print(f'{delay_ms:>8}{len(line):>10}{times[0]:>9.2f}{times[1]:>10.2f}')
+
+
+#__________________________________ MAIN _________________________________________
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    if args['databus']:
+        bench_databus(float(args['--seconds']), float(args['--hz']))
+    elif args['frames']:
+        bench_frames(int(args['--frames']))
+    elif args['schedule']:
+        bench_schedule(float(args['--seconds']), float(args['--hz']),
+                       int(args['--parts']), args['--policy'])
+    elif args['groups']:
+        bench_groups(float(args['--seconds']), float(args['--hz']), int(args['--parts']))
+    elif args['tub']:
+        bench_tub(int(args['--frames']), float(args['--hz']), args['--policy'])
+    elif args['tubformat']:
+        bench_tub_format(int(args['--frames']))
+    elif args['tubindex']:
+        bench_tub_index(int(args['--records']))
+    elif args['tubread']:
+        bench_tub_read(int(args['--frames']))
+    elif args['framecache']:
+        bench_frame_cache(int(args['--frames']))
+    elif args['joystick']:
+        bench_joystick(float(args['--seconds']), float(args['--hz']))
+    elif args['pygame']:
+        bench_pygame(float(args['--seconds']), float(args['--hz']))
+    elif args['zmqjoystick']:
+        bench_zmq_joystick(float(args['--seconds']), float(args['--hz']))
+    elif args['delayline']:
+        bench_delay_line(int(args['--frames']), float(args['--hz']))
@@ -24,6 +24,61 @@ MODELS_PATH = os.path.join(CAR_PATH, 'models')
 DRIVE_LOOP_HZ = 20      # the vehicle loop will pause if faster than this speed.
 MAX_LOOPS = None        # the vehicle loop can abort after this many iterations, when given a positive integer.
 
+#DATABUS (vehicle.py, Method 2)
+DATABUS_TYPE = 'seqlock'    # (dict|seqlock|shared) seqlock gives lock free reads and consistent multi-key snapshots, shared is required for parts with 'process: true' in parts.yml
+# keys and types held in shared memory when DATABUS_TYPE = 'shared', images are IMAGE_H x IMAGE_W x IMAGE_DEPTH
+SHARED_BUS_KEYS = {'cam/image_array': 'image_array',
+                   'user/angle': 'float', 'user/throttle': 'float', 'user/mode': 'str',
+                   'recording': 'boolean', 'AImultiplier': 'float', 'command': 'int',
+                   'run_pilot': 'boolean', 'pilot/angle': 'float', 'pilot/throttle': 'float',
+                   'angle': 'float', 'throttle': 'float', 'brake': 'float',
+                   'tub/num_records': 'int', 'pilot/latency_ms': 'float',
+                   'pilot/frames_dropped': 'int', 'pilot/output_age_ms': 'float',
+                   'sim/delay_ms': 'float'}
+SHARED_BUS_STR_LEN = 32     # bytes reserved for 'str' keys in shared memory
+BUS_FRAME_KEYS = ['cam/image_array']   # image keys kept in a preallocated frame ring (dict|seqlock bus), readers get read only views
+BUS_FRAME_RING_DEPTH = 4    # frames in the ring, a consumer must be done with a frame before this many newer frames are written
+
+#PART SCHEDULING (vehicle.py, Method 2)
+PART_OVERRUN_POLICY = 'skip'    # (skip|catchup|shift) after a part loop overran its deadline: drop missed loops, run them back to back or shift the phase. parts.yml option 'overrun' overrides it
+PART_PHASE_STAGGER = True       # spread the loop start of the parts over one period so they don't all wake at once. parts.yml option 'offset_ms' overrides it
+PART_SPIN_MS = 0                # sleep until this close to a loop deadline, then yield-spin for sub-millisecond timing, e.g. 0.5. Every part thread busy-waits while spinning, 0 to only sleep
+PART_LATE_TOLERANCE_MS = 1.0    # a loop starting later than this after its deadline counts as a late start
+VEHICLE_RUNTIME = 'threads'     # (threads|async) threads: one thread per part, async: all parts are coroutines on one asyncio event loop
+MAINTHREAD_PYGAME_HZ = 60       # rate the main thread pumps the pygame events of the PyGame joystick parts, the joystick state is only as fresh as the last pump
+ASYNC_EXECUTOR_WORKERS = 4      # threads for the operate() of blocking parts (AI_Pilot, DonkeyGymEnv, TubWriter) in the async runtime
+
+#PROFILING (vehicle.py, Method 2)
+PROFILE_HTTP_PORT = None        # serve p50/p99/p999 of the part phases on http://127.0.0.1:<port>/ (json) and /text, e.g. 8887
+PROFILE_SOCKET_PATH = None      # serve the same on a Unix socket instead, e.g. '/tmp/donkey-profile.sock'
+PROFILE_DUMP_PATH = None        # write the part profiles as json to this file when the car stops
+
+#TUB WRITER (vehicle.py, Method 2)
+TUB_FORMAT = 'json'             # (json|columnar) json: manifest lines and a jpeg file per image, columnar: typed column files and one frame file per image key, read with np.memmap
+TUB_FRAME_FORMAT = 'jpeg'       # (jpeg|raw) frames of a columnar tub, raw frames take more disk but need no decoding
+TUB_WRITER_WORKERS = 2          # jpeg encoder workers writing the tub in the background, 0 to write inline in the TubWriter loop
+TUB_WRITER_EXECUTOR = 'thread'  # (thread|process) encode in threads or in worker processes, which do not share the GIL with the car
+TUB_WRITER_QUEUE_SIZE = 16      # records in flight before the policy kicks in
+TUB_WRITER_POLICY = 'block'     # (block|drop_oldest|drop_newest) when the queue is full wait, drop the oldest queued record or drop the new one
+
+#TRACING (driver.py and vehicle.py)
+TRACE_PATH = None               # record part and data bus events and write them as Chrome trace json (chrome://tracing, ui.perfetto.dev) to this file on stop or kill -USR1, e.g. 'trace.json'
+TRACE_CAPACITY = 200000         # number of most recent events kept in memory
+
+#DATAFLOW (driver.py and vehicle.py)
+PARTS_ORDER = 'yaml'            # (yaml|dataflow) run the parts in parts.yml order or in the order derived from their inputs and outputs
+PARTS_PRUNE_DEAD = False        # leave out parts whose outputs nobody reads (parts like TubWriter which write to disk or drive the car are kept)
+PARTS_ASSEMBLY = 'serial'       # (serial|parallel) parallel: import the part modules and create the parts in a thread pool, they are still added in parts.yml order
+PARTS_ASSEMBLY_WORKERS = 4      # threads creating parts in parallel assembly
+PARTS_MAIN_THREAD = ['PyGamePS4JoystickController']  # class names created in the main thread during parallel assembly, e.g. parts opening a window (pygame)
+PARTS_MANIFEST_PATH = os.path.expanduser('~/.cache/donkeycar/parts_manifest.json')    # cache of the part classes of every part module, rewritten only when a part source changed. parts.yml is checked against it before anything is imported (None to scan the sources every start)
+PARTS_IMPORT_REPORT = 3         # number of packages listed per part with their import time (like python -X importtime) in the assembly report
+
+#AI PILOT (driver.py and vehicle.py)
+AI_PILOT_WARMUP_RUNS = 3        # inferences on a zero IMAGE_H x IMAGE_W x IMAGE_DEPTH frame when the pilot is created, the first one pays for graph tracing and allocation
+MODEL_CACHE = None              # (None|tflite) tflite: convert a linear Keras MODEL_PATH to TFLite once and load the conversion on later starts
+MODEL_CACHE_DIR = os.path.join(MODELS_PATH, 'cache')    # converted models, named after the model file and its sha256
+
 #CAMERA
 CAMERA_TYPE = "PICAM"   # (PICAM|WEBCAM|CVCAM|CSIC|V4L|D435|MOCK|IMAGE_LIST)
 IMAGE_W = 160
@@ -14,10 +14,14 @@ Options:
 import os
 import time
 import logging
-import importlib
+from functools import partial
 from docopt import docopt
 import donkeycar as dk
 import yaml
+from donkeycar.vehiclepartsfactory.assembly import PartBuild, build_parts
+from donkeycar.vehiclepartsfactory.registry import PartManifest
+from donkeycar.vehiclepartsfactory.dataflow import compile_dataflow
+from donkeycar.vehiclepartsfactory.tracing import tracer, start_tracing, TracedPart
 
 
 logger = logging.getLogger(__name__)
@@ -26,6 +30,13 @@ logging.basicConfig(level=logging.INFO)
 
 #__________________________________ ASSEMBLE THE VEHICLE________________________
 
+def create_part(cfg, class_name, module):
+    #create part object from <class_name>
+    part_class = getattr(module, class_name)
+    part = part_class(cfg)
+    logger.info(f'    {class_name} part created from {module.__name__}')
+    return part
+
 def assemble(cfg):
     #Initialize car
     V = dk.vehicle.Vehicle()
@@ -42,16 +53,30 @@ def assemble(cfg):
         logger.error("parts.yml is missing the parts key")
         raise Exception()
         
+    # check the class names before any part module is imported
+    manifest = PartManifest(cfg.PARTS_MANIFEST_PATH)
     for mod_name, class_name in parts.items():
-        #import module <mod_name>
-        module = importlib.import_module(mod_name)
-        logger.info(f'{module.__name__} imported.')
-        
-        #create part object from <class_name>
-        part_class = getattr(module, class_name)
-        part = part_class(cfg)
-        logger.info(f'    {class_name} part created')
-        
+        manifest.check(mod_name, class_name)
+
+    builds = [PartBuild(mod_name, class_name, partial(create_part, cfg, class_name))
+              for mod_name, class_name in parts.items()]
+    # import and create the parts, concurrently with PARTS_ASSEMBLY = 'parallel'
+    created = build_parts(builds, cfg)
+
+    # check the wiring of the parts and find their execution order
+    plan = compile_dataflow(created)
+    logger.info(plan.report())
+    if cfg.PARTS_ORDER == 'dataflow':
+        created = plan.ordered_parts(prune=cfg.PARTS_PRUNE_DEAD)
+    elif cfg.PARTS_PRUNE_DEAD:
+        created = [part for i, part in enumerate(created) if i not in plan.dead]
+
+    tracing = start_tracing(cfg)
+    for part in created:
+        class_name = type(part).__name__
+        if tracing:
+            # record a span for every run of the part
+            part = TracedPart(part)
         #add part to vehicle
         V.add(part, inputs=part.inputs, outputs=part.outputs, threaded=part.threaded, run_condition=part.run_condition)
         logger.info(f'    {class_name} part added to vehicle')
@@ -72,7 +97,11 @@ if __name__ == '__main__':
 
     # start the vehicle
     logger.info('Start your engines...')
-    vehicle.start(rate_hz=configuration.DRIVE_LOOP_HZ, max_loop_count=configuration.MAX_LOOPS)
+    try:
+        vehicle.start(rate_hz=configuration.DRIVE_LOOP_HZ, max_loop_count=configuration.MAX_LOOPS)
+    finally:
+        if tracer.enabled:
+            tracer.write()
 
     logger.info('Vehicle end.\n')
     
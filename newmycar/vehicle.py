@@ -13,72 +13,34 @@ Options:
 
 import math
 import time
-import collections
+import json
 import yaml
 import logging
-import importlib
+from functools import partial
 from docopt import docopt
 import donkeycar as dk
 import donkeycar.vehiclepartsfactory.partfactory as factory
+from donkeycar.vehiclepartsfactory.databus import make_data_bus
+from donkeycar.vehiclepartsfactory.processpart import ProcessPart
+from donkeycar.vehiclepartsfactory.asyncengine import AsyncEngine
+from donkeycar.vehiclepartsfactory.mainthread import MainThreadScheduler
+from donkeycar.vehiclepartsfactory.assembly import PartBuild, build_parts
+from donkeycar.vehiclepartsfactory.registry import PartManifest
+from donkeycar.vehiclepartsfactory.dataflow import compile_dataflow
+from donkeycar.vehiclepartsfactory.profiling import ProfileServer, part_profiles
+from donkeycar.vehiclepartsfactory.tracing import tracer, start_tracing
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-# Not really needed, but a structure to combine data, its type and a timestamp
-DataStruct = collections.namedtuple('DataStruct', 'data_type data time_stamp')
-
-class DataBus:
-    """ Single object in the car that shares all data between parts"""
-    def __init__(self):
-        self.data_store = {}
-
-    def write(self, data_name, data_type, data):
-        if data is not None:
-            """ Write data into the bus"""
-            d = DataStruct(data_type=data_type, data=data, time_stamp=time.time())
-
-            # here we check types but could check more like types don't change, etc
-            assert type(data) is data_type, f'{type(data).__name__} does not ' \
-                                            f'match {data_type.__name__}'
-
-            # we just replace data, don't keep history, but we could also keep
-            # the last n entries and tag it with an additional counter which gets
-            # cycled
-            self.data_store[data_name] = d
-
-    def read(self, data_name):
-        """ Return current data entry, return None when nothing found but don't throw """
-        d = self.data_store.get(data_name)
-        if d is not None:
-            return d.data
-        else:
-            return None
-
-    def readlist(self, data_names):
-        """ Return list of data entries, return None when nothing found but don't throw """
-        datalist = []
-        for i in range(len(data_names)):
-            d = self.data_store.get(data_names[i])
-#             if data_names[i] != 'cam/image_array':
-#                 print (f'{data_names[i]}:{d}')
-            if d is None:
-                datalist = None
-                break
-            else:
-                datalist.append(d.data)
-        return datalist
-    
-    def dump(self):
-        """ Print out the DataBus """
-        for k, d in self.data_store.items():  
-            print(f'{k}:{d.data} ', end = '')
-        print()
-
 class Vehicle:
     def __init__(self, cfg):
+        self.cfg = cfg
         self.parts = []
         # the vehicle owns the data bus
-        self.data_bus = DataBus()
+        self.data_bus = make_data_bus(cfg)
+        self.profile_server = None
+        self.mainthread = None
         self.assemble_parts(cfg)
 
     def add_part(self, part):
@@ -88,53 +50,199 @@ class Vehicle:
         self.parts.append(part)
 
     def start(self):
+        # one common epoch, the loop deadlines of all parts are phased to it
+        epoch_ns = time.monotonic_ns()
+        if self.cfg.PROFILE_HTTP_PORT or self.cfg.PROFILE_SOCKET_PATH:
+            self.profile_server = ProfileServer(self.parts, port=self.cfg.PROFILE_HTTP_PORT,
+                                                socket_path=self.cfg.PROFILE_SOCKET_PATH)
+            self.profile_server.start()
+        start_tracing(self.cfg)
+        # main thread work of the parts (pygame events), each at its own rate
+        self.mainthread = MainThreadScheduler()
+        self.mainthread.register_parts(self.parts)
+        if self.cfg.VEHICLE_RUNTIME == 'async':
+            self.start_async(epoch_ns)
+            return
         for part in self.parts:
-            part.start()
+            part.start(epoch_ns)
+        self.mainthread.start(epoch_ns)
         try:
             while True:
-                time.sleep(.2)
-                for part in self.parts:
-                    part.mainthread()
-                pass
+                self.mainthread.run_once()
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            print(e)
+        finally:
+            print(f'Stopped car.')
+            self.stop()
+
+    def start_async(self, epoch_ns):
+        # all parts are coroutines on one event loop in the main thread
+        engine = AsyncEngine(self.parts, executor_workers=self.cfg.ASYNC_EXECUTOR_WORKERS,
+                             mainthread=self.mainthread)
+        try:
+            engine.run(epoch_ns)
         except KeyboardInterrupt:
             pass
         except Exception as e:
             print(e)
         finally:
+            engine.stop()
             print(f'Stopped car.')
             self.stop()
 
     def stop(self):
         for part in self.parts:
             part.stop()
+        if self.mainthread is not None and self.mainthread.tasks:
+            print(self.mainthread.report())
+        if self.profile_server is not None:
+            self.profile_server.stop()
+        if tracer.enabled:
+            tracer.write()
+        if self.cfg.PROFILE_DUMP_PATH:
+            # the same json as served by the profile server
+            with open(self.cfg.PROFILE_DUMP_PATH, 'w') as file:
+                json.dump({name: profile.summary() for name, profile
+                           in part_profiles(self.parts).items()}, file, indent=1)
+            print('Part profiles written to', self.cfg.PROFILE_DUMP_PATH)
+        # part.stop() joined the part threads and processes, nothing uses
+        # the bus any more
+        if hasattr(self.data_bus, 'close'):
+            self.data_bus.close()
     
     def assemble_parts(self, cfg):
         # Load the YAML file specifying the parts
         with open(cfg.PARTS_PATH) as file:
             try:
-                dict = yaml.safe_load(file)
+                parts_yml = yaml.safe_load(file)
             except yaml.YAMLError as exception:
                 logger.error(exception)
     
-        parts = dict.get("parts")
+        parts = parts_yml.get("parts")
         if parts is None:
             logger.error("parts.yml is missing the parts key")
             raise Exception()
-        
-        for mod_name, class_name in parts.items():
-            #import module <mod_name>
-            module = importlib.import_module(mod_name)
-            logger.info(f'{module.__name__} imported.')
-        
-            #create part object from <class_name>
-#             part_class = getattr(module, class_name)
-            part = factory.PartFactory.make(class_name, {'cfg': cfg})
-#             part = part_class(cfg)
-            logger.info(f'    {class_name} part created')
-        
+
+        # class names of the part modules, from the sources, nothing imported
+        manifest = PartManifest(cfg.PARTS_MANIFEST_PATH)
+
+        # class names and options in YAML order
+        entries = []
+        builds = []
+        for mod_name, entry in parts.items():
+            # an entry is either the class name or a dictionary with the
+            # class name and part options
+            if isinstance(entry, dict):
+                class_name = entry['class']
+                options = entry
+            else:
+                class_name = entry
+                options = {}
+            manifest.check(mod_name, class_name)
+            entries.append((class_name, options))
+            if options.get('process', False):
+                # module is imported and part is created in the child process
+                create = partial(self.process_part, cfg, mod_name, class_name, options)
+                builds.append(PartBuild(None, class_name, create))
+            else:
+                create = partial(self.create_part, cfg, class_name, options)
+                builds.append(PartBuild(mod_name, class_name, create))
+
+        # import and create the parts, concurrently with PARTS_ASSEMBLY = 'parallel'
+        created = [(part, class_name, options) for part, (class_name, options)
+                   in zip(build_parts(builds, cfg), entries)]
+
+        # check the wiring of the parts and find their execution order
+        plan = compile_dataflow([part for part, _, _ in created],
+                                [class_name for _, class_name, _ in created])
+        logger.info(plan.report())
+        order = plan.order if cfg.PARTS_ORDER == 'dataflow' else range(len(created))
+        if cfg.PARTS_PRUNE_DEAD:
+            for i in plan.dead:
+                logger.info(f'    {created[i][1]} part pruned, none of its outputs is read')
+        created = [created[i] for i in order
+                   if not (cfg.PARTS_PRUNE_DEAD and i in plan.dead)]
+
+        # light parts can share one thread, see factory.PartGroup
+        groups = parts_yml.get("groups") or {}
+        group_of = {class_name: group_name
+                    for group_name, members in groups.items()
+                    for class_name in members}
+        group_members = {group_name: [] for group_name in groups}
+
+        # parts and group names with their options in execution order
+        vehicle_parts = []
+        for part, class_name, options in created:
+            group_name = group_of.get(class_name)
+            if group_name is None:
+                vehicle_parts.append((part, options))
+                continue
+            if isinstance(part, ProcessPart) or 'triggers' in options:
+                logger.error(f'{class_name} in group {group_name} can not run '
+                             f'in its own process or have triggers')
+                raise Exception()
+            # the group takes the place of its first member
+            if not group_members[group_name]:
+                vehicle_parts.append((group_name, {}))
+            group_members[group_name].append(part)
+            logger.info(f'    {class_name} part added to group {group_name}')
+
+        part_options = []
+        for part, options in vehicle_parts:
+            if isinstance(part, str):
+                part = factory.PartGroup(part, group_members[part])
             #add part to vehicle
             self.add_part(part)
-            logger.info(f'    {class_name} part added to vehicle')
+            part_options.append(options)
+            logger.info(f'    {type(part).__name__} part added to vehicle')
+
+        self.schedule_parts(cfg, part_options)
+
+    def create_part(self, cfg, class_name, options, module):
+        #create part object from <class_name>
+#         part_class = getattr(module, class_name)
+        part = factory.PartFactory.make(class_name, {'cfg': cfg})
+#         part = part_class(cfg)
+        logger.info(f'    {class_name} part created from {module.__name__}')
+
+        # run the part when its trigger keys are written
+        if 'triggers' in options:
+            part.subscribe(options['triggers'], options.get('max_hz'))
+            logger.info(f'    {class_name} triggered by {options["triggers"]}')
+        return part
+
+    def process_part(self, cfg, mod_name, class_name, options, module=None):
+        part = ProcessPart(mod_name, class_name, cfg)
+        # the part is not created here, its bus keys come from the yml
+        part.inputs = options.get('inputs', [])
+        part.outputs = options.get('outputs', [])
+        part.sink = options.get('sink', False)
+        logger.info(f'    {class_name} part will run in its own process')
+        if 'triggers' in options:
+            logger.warning(f'    {class_name} triggers are ignored, '
+                           f'parts in their own process poll the bus')
+        return part
+
+    def schedule_parts(self, cfg, part_options):
+        """
+        Set the loop phase and overrun policy of every part. Unless a part
+        has an offset_ms option, the parts are spread evenly over one drive
+        loop period so they don't all wake up at the same instant.
+        """
+        period = 1. / cfg.DRIVE_LOOP_HZ
+        for index, (part, options) in enumerate(zip(self.parts, part_options)):
+            if 'offset_ms' in options:
+                offset = options['offset_ms'] / 1000.
+            elif cfg.PART_PHASE_STAGGER:
+                offset = period * index / len(self.parts)
+            else:
+                offset = 0.
+            part.set_schedule(offset=offset,
+                              policy=options.get('overrun', cfg.PART_OVERRUN_POLICY),
+                              spin=cfg.PART_SPIN_MS / 1000.,
+                              tolerance=cfg.PART_LATE_TOLERANCE_MS / 1000.)
 
  
 #__________________________________ MAIN _________________________________________
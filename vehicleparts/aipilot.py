@@ -1,21 +1,70 @@
 
 # Note: Does not handle parameter: other_array in keras.py
-import donkeycar as dk
+import time
+
+from donkeycar.vehiclepartsfactory.inference import InferenceEngine
+from donkeycar.vehiclepartsfactory.modelloader import load_pilot
 
 class AI_Pilot:
     def __init__(self, cfg):   
-        self.kl = dk.utils.get_model_by_type(None, cfg)
-        self.kl.load(cfg.MODEL_PATH)
+        self.kl = load_pilot(cfg)
+        self.last_seq = None
+        self.last_outputs = None, None
         
         # vehicle parameters       
-        self.inputs = ['cam/image_array']
+        self.inputs = ['cam/image_array', 'cam/frame_seq']
         self.outputs = ['pilot/angle', 'pilot/throttle']
         self.threaded = False
         self.run_condition = 'run_pilot'
 
-    def run(self,image):
+    def run(self, image, seq=None):
     # Note: Does not handle parameter: other_array in keras.py
-        return self.kl.run(image)
+        # keep the outputs of a frame instead of inferring it again, cameras
+        # without a cam/frame_seq are inferred every loop
+        if image is not None and (seq is None or seq != self.last_seq):
+            self.last_outputs = self.kl.run(image)
+            self.last_seq = seq
+        return self.last_outputs
+
+    def shutdown(self):
+        self.kl.shutdown()
+
+
+class AI_PilotEngine:
+    """
+    AI_Pilot with the model in the part thread (update) of an InferenceEngine,
+    run_threaded() only hands over the frame and returns the newest outputs
+    plus inference latency, frames dropped and output age
+    """
+    def __init__(self, cfg):
+        self.kl = load_pilot(cfg)
+        self.engine = InferenceEngine(self.kl, name='AI_PilotEngine inference')
+        self.last_seq = None
+
+        # vehicle parameters
+        self.inputs = ['cam/image_array', 'cam/frame_seq']
+        self.outputs = ['pilot/angle', 'pilot/throttle', 'pilot/latency_ms',
+                        'pilot/frames_dropped', 'pilot/output_age_ms']
+        self.threaded = True
+        self.run_condition = 'run_pilot'
+
+    def update(self):
+        self.engine.on = True
+        self.engine.run()
+
+    def run_threaded(self, image, seq=None):
+        # submit new frames only, or every frame without a cam/frame_seq
+        if image is not None and (seq is None or seq != self.last_seq):
+            self.engine.submit(image)
+            self.last_seq = seq
+        result = self.engine.latest()
+        if result is None:
+            return None, None, None, self.engine.dropped, None
+        (angle, throttle), time_stamp, latency_ms = result
+        return (angle, throttle, latency_ms, self.engine.dropped,
+                (time.time() - time_stamp) * 1000.)
 
     def shutdown(self):
+        self.engine.stop()
+        print(self.engine.report())
         self.kl.shutdown()
@@ -1,7 +1,7 @@
 import os
 import time
-import gym
-import gym_donkeycar
+
+from donkeycar.vehiclepartsfactory.delayline import DelayLine
 
 
 def is_exe(fpath):
@@ -24,6 +24,10 @@ class DonkeyGymEnv_Original(object):
         conf["port"] = port
         conf["guid"] = 0
         conf["frame_skip"] = 1
+        # imported when the part is created, gym and the sim client are slow
+        # to import
+        import gym
+        import gym_donkeycar     # registers the donkey environments
         self.env = gym.make(env_name, conf=conf)
         self.frame = self.env.reset()
         self.action = [0.0, 0.0, 0.0]
@@ -33,39 +37,31 @@ class DonkeyGymEnv_Original(object):
                      'cte': 0,
                      'gyro': (0., 0., 0.),
                      'accel': (0., 0., 0.),
-                     'vel': (0., 0., 0.)}
+                     'vel': (0., 0., 0.),
+                     'lidar': []}
         self.delay = float(delay) / 1000
         self.record_location = record_location
         self.record_gyroaccel = record_gyroaccel
         self.record_velocity = record_velocity
         self.record_lidar = record_lidar
 
-        self.buffer = []
-
-    def delay_buffer(self, frame, info):
-        now = time.time()
-        buffer_tuple = (now, frame, info)
-        self.buffer.append(buffer_tuple)
-
-        # go through the buffer
-        num_to_remove = 0
-        for buf in self.buffer:
-            if now - buf[0] >= self.delay:
-                num_to_remove += 1
-                self.frame = buf[1]
-            else:
-                break
+        # number of the sim step of self.frame, the pilot infers a frame once
+        self.frame_seq = 0
+        self.steps = 0
+        self.delay_line = DelayLine(self.delay, (self.frame, self.info, 0))
 
-        # clear the buffer
-        del self.buffer[:num_to_remove]
+    def delay_buffer(self, frame, info, seq):
+        # the frame and info of the step delay old, or the ones after reset
+        self.frame, self.info, self.frame_seq = self.delay_line.push((frame, info, seq))
 
     def update(self):
         while self.running:
+            current_frame, _, _, current_info = self.env.step(self.action)
+            self.steps += 1
             if self.delay > 0.0:
-                current_frame, _, _, current_info = self.env.step(self.action)
-                self.delay_buffer(current_frame, current_info)
+                self.delay_buffer(current_frame, current_info, self.steps)
             else:
-                self.frame, _, _, self.info = self.env.step(self.action)
+                self.frame, self.info, self.frame_seq = current_frame, current_info, self.steps
 
     def run_threaded(self, steering, throttle, brake=None):
         if steering is None or throttle is None:
@@ -76,8 +72,10 @@ class DonkeyGymEnv_Original(object):
 
         self.action = [steering, throttle, brake]
 
-        # Output Sim-car position information if configured
-        outputs = [self.frame]
+        # Output Sim-car position information if configured, the step number
+        # is read first, it is never newer than the frame
+        frame_seq = self.frame_seq
+        outputs = [self.frame, frame_seq]
         if self.record_location:
             outputs += self.info['pos'][0],  self.info['pos'][1],  self.info['pos'][2],  self.info['speed'], self.info['cte']
         if self.record_gyroaccel:
@@ -85,11 +83,8 @@ class DonkeyGymEnv_Original(object):
         if self.record_velocity:
             outputs += self.info['vel'][0],  self.info['vel'][1],  self.info['vel'][2]
         if self.record_lidar:
-            outputs += self.info['lidar']
-        if len(outputs) == 1:
-            return self.frame
-        else:
-            return outputs
+            outputs.append(self.info['lidar'])
+        return outputs
 
     def shutdown(self):
         self.running = False
@@ -98,11 +93,22 @@ class DonkeyGymEnv_Original(object):
 
 class DonkeyGymEnv(DonkeyGymEnv_Original):
     def __init__(self, cfg):
-       super(DonkeyGymEnv, self).__init__(cfg.DONKEY_SIM_PATH, host=cfg.SIM_HOST, env_name=cfg.DONKEY_GYM_ENV_NAME, conf=cfg.GYM_CONF, delay=cfg.SIM_ARTIFICIAL_LATENCY)
+       super(DonkeyGymEnv, self).__init__(cfg.DONKEY_SIM_PATH, host=cfg.SIM_HOST, env_name=cfg.DONKEY_GYM_ENV_NAME, conf=cfg.GYM_CONF, delay=cfg.SIM_ARTIFICIAL_LATENCY,
+            record_location=cfg.SIM_RECORD_LOCATION, record_gyroaccel=cfg.SIM_RECORD_GYROACCEL,
+            record_velocity=cfg.SIM_RECORD_VELOCITY, record_lidar=cfg.SIM_RECORD_LIDAR)
        
        # vehicle parameters       
        self.inputs  = ['angle', 'throttle', 'brake']
-       self.outputs = ['cam/image_array']
+       self.outputs = ['cam/image_array', 'cam/frame_seq']
+       if self.record_location:
+           self.outputs += ['pos/pos_x', 'pos/pos_y', 'pos/pos_z', 'pos/speed', 'pos/cte']
+       if self.record_gyroaccel:
+           self.outputs += ['gyro/gyro_x', 'gyro/gyro_y', 'gyro/gyro_z', 'accel/accel_x', 'accel/accel_y', 'accel/accel_z']
+       if self.record_velocity:
+           self.outputs += ['vel/vel_x', 'vel/vel_y', 'vel/vel_z']
+       if self.record_lidar:
+           self.outputs += ['lidar/dist_array']
        self.threaded = True
        self.run_condition = None
+       self.sink = True    # drives the simulated car
 
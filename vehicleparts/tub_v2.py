@@ -121,6 +121,7 @@ class TubWriter(object):
         self.outputs = ['tub/num_records']
         self.threaded = False
         self.run_condition = 'recording'
+        self.sink = True    # writes the tub to disk
 
     def run(self, *args):
         assert len(self.tub.inputs) == len(args), \
@@ -1,24 +1,44 @@
 
 # Note: Does not handle parameter: other_array in keras.py
-import donkeycar as dk
+import time
+
 import donkeycar.vehiclepartsfactory.partfactory as factory
+from donkeycar.vehiclepartsfactory.inference import InferenceEngine
+from donkeycar.vehiclepartsfactory.modelloader import load_pilot
 
 class AI_Pilot(factory.Part):
+    blocking = True
+
     def __init__(self, cfg):   
         super().__init__(loop_time = 1/cfg.DRIVE_LOOP_HZ)
-        self.kl = dk.utils.get_model_by_type(None, cfg)
-        self.kl.load(cfg.MODEL_PATH)
+        self.kl = load_pilot(cfg)
         self.run_part = False
+        self.image = None
+        # write count of the last inferred frame, the bus keeps the outputs
+        # of a frame until the next one is inferred
+        self.seq = 0
+        self.skipped = 0
+        self.angle = None
+        self.throttle = None
+        self.inputs = ['run_pilot', 'cam/image_array']
+        self.outputs = ['pilot/angle', 'pilot/throttle']
           
     def read_from_bus(self):
         self.run_part = self.data_bus.read('run_pilot')
-        if self.run_part is not None:
-            if self.run_part:
-                self.image = self.data_bus.read('cam/image_array')
+        self.image = None
+        if self.run_part:
+            stamped = self.data_bus.read_stamped('cam/image_array')
+            if stamped is not None:
+                if stamped.seq == self.seq:
+                    self.skipped += 1
+                else:
+                    self.image, self.seq = stamped.data, stamped.seq
 
     def write_to_bus(self):
-        self.data_bus.write('pilot/angle', float, float(self.angle))
-        self.data_bus.write('pilot/throttle', float, float(self.throttle))
+        # every loop, AiLaunch overwrites pilot/throttle on the bus
+        if self.angle is not None:
+            self.data_bus.write('pilot/angle', float, float(self.angle))
+            self.data_bus.write('pilot/throttle', float, float(self.throttle))
         
     def operate(self):
     # Note: Does not handle parameter: other_array in keras.py
@@ -27,6 +47,63 @@ class AI_Pilot(factory.Part):
         
     def stop(self):
         self.kl.shutdown()
+        print(f'AI_Pilot skipped {self.skipped} loops without a new frame')
         super().stop()
 
 
+class AI_PilotEngine(factory.Part):
+    """
+    AI_Pilot with the model in an InferenceEngine thread. operate() only
+    preprocesses the newest camera frame and collects the newest result, so
+    the part never holds the bus for an inference. Besides the pilot outputs
+    it writes the inference latency, the number of frames dropped and the age
+    of the output (time since its frame was taken).
+    """
+    def __init__(self, cfg):
+        super().__init__(loop_time = 1/cfg.DRIVE_LOOP_HZ)
+        self.kl = load_pilot(cfg)
+        self.engine = InferenceEngine(self.kl, name='AI_PilotEngine inference')
+        self.engine.start()
+        self.run_part = False
+        self.image = None
+        self.seq = 0
+        self.skipped = 0
+        self.time_stamp = None
+        self.result = None
+        self.inputs = ['run_pilot', 'cam/image_array']
+        self.outputs = ['pilot/angle', 'pilot/throttle', 'pilot/latency_ms',
+                        'pilot/frames_dropped', 'pilot/output_age_ms']
+
+    def read_from_bus(self):
+        self.run_part = self.data_bus.read('run_pilot')
+        self.image = None
+        if not self.run_part:
+            return
+        # the write count tells which frames are new and which were missed
+        stamped = self.data_bus.read_stamped('cam/image_array')
+        if stamped is not None and stamped.seq != self.seq:
+            self.skipped = max(0, stamped.seq - self.seq - 1) if self.seq else 0
+            self.image, self.seq, self.time_stamp = stamped
+
+    def operate(self):
+        if self.image is not None:
+            self.engine.submit(self.image, self.time_stamp, self.skipped)
+            self.image = None
+        self.result = self.engine.latest()
+
+    def write_to_bus(self):
+        if self.result is None:
+            return
+        (angle, throttle), time_stamp, latency_ms = self.result
+        self.data_bus.write('pilot/angle', float, float(angle))
+        self.data_bus.write('pilot/throttle', float, float(throttle))
+        self.data_bus.write('pilot/latency_ms', float, latency_ms)
+        self.data_bus.write('pilot/frames_dropped', int, self.engine.dropped)
+        self.data_bus.write('pilot/output_age_ms', float,
+                            (time.time() - time_stamp) * 1000.)
+
+    def stop(self):
+        self.engine.stop()
+        print(self.engine.report())
+        self.kl.shutdown()
+        super().stop()
@@ -0,0 +1,111 @@
+"""
+Construction of the parts of a vehicle (driver.py and vehicle.py).
+Importing a part's module and creating the part can take seconds (gym,
+TensorFlow and the model, pygame and the joystick wait). The constructors of
+the parts only depend on the configuration, so with PARTS_ASSEMBLY =
+'parallel' they run in a thread pool and the slow ones overlap. The parts are
+returned in parts.yml order either way, together with their import and
+creation times and the packages which took longest to import.
+"""
+
+import time
+import logging
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+
+from donkeycar.vehiclepartsfactory.registry import ImportTimer, heaviest_packages
+
+logger = logging.getLogger(__name__)
+
+
+class PartBuild(object):
+    """ Import of the module and creation of one part, with their times """
+    def __init__(self, mod_name, class_name, create):
+        """
+        :param mod_name: module to import, None to import nothing
+        :param create: function(module) returning the part
+        """
+        self.mod_name = mod_name
+        self.class_name = class_name
+        self.create = create
+        self.part = None
+        self.error = None
+        self.import_time = 0.
+        self.create_time = 0.
+        # (module, self ns, cumulative ns) of the modules imported by the
+        # part's module and constructor
+        self.imports = []
+        self.import_timer = None
+
+    def __call__(self):
+        try:
+            start = time.monotonic()
+            module = importlib.import_module(self.mod_name) if self.mod_name else None
+            self.import_time = time.monotonic() - start
+            start = time.monotonic()
+            self.part = self.create(module)
+            self.create_time = time.monotonic() - start
+        except Exception as e:
+            self.error = e
+        if self.import_timer is not None:
+            self.imports = self.import_timer.take()
+        return self
+
+
+def build_parts(builds, cfg):
+    """
+    Run the PartBuilds, in a thread pool if cfg.PARTS_ASSEMBLY is parallel,
+    returns the parts in the order of builds. Parts in cfg.PARTS_MAIN_THREAD
+    are always created in the calling thread. The first failed build is
+    raised, serial assembly stops at it.
+    """
+    mode = cfg.PARTS_ASSEMBLY
+    if mode not in ('serial', 'parallel'):
+        logger.error(f'Unknown PARTS_ASSEMBLY {mode}, use serial|parallel')
+        raise Exception()
+    # time the imports of every part, modules imported by one part are
+    # already loaded for the next ones
+    import_timer = ImportTimer()
+    for build in builds:
+        build.import_timer = import_timer
+    import_timer.install()
+    start = time.monotonic()
+    if mode == 'parallel':
+        with ThreadPoolExecutor(max_workers=cfg.PARTS_ASSEMBLY_WORKERS,
+                                thread_name_prefix='assembly') as executor:
+            futures = [executor.submit(build) for build in builds
+                       if build.class_name not in cfg.PARTS_MAIN_THREAD]
+            for build in builds:
+                if build.class_name in cfg.PARTS_MAIN_THREAD:
+                    build()
+            for future in futures:
+                future.result()
+    else:
+        # stop at the first failure, don't connect the sim or open the
+        # joystick for a car which will not start
+        for build in builds:
+            if build().error is not None:
+                break
+    elapsed = time.monotonic() - start
+    import_timer.remove()
+    logger.info(assembly_report(builds, mode, elapsed, cfg.PARTS_IMPORT_REPORT))
+    for build in builds:
+        if build.error is not None:
+            logger.error(f'{build.class_name} from {build.mod_name} could not '
+                         f'be created: {build.error}')
+            raise build.error
+    return [build.part for build in builds]
+
+
+def assembly_report(builds, mode, elapsed, packages=3):
+    """ Table of the part times, with the packages heaviest to import """
+    total = sum(build.import_time + build.create_time for build in builds)
+    lines = [f'Parts assembled ({mode}) in {elapsed:.2f} s, '
+             f'sum of the part times {total:.2f} s',
+             f'    {"part":24s} {"import s":>9s} {"create s":>9s}  heaviest imports']
+    for build in builds:
+        heaviest = ', '.join(f'{name} {seconds:.2f}' for name, seconds
+                             in heaviest_packages(build.imports, packages))
+        lines.append(f'    {build.class_name:24s} {build.import_time:9.2f} '
+                     f'{build.create_time:9.2f}  {heaviest}')
+    return '\n'.join(lines)
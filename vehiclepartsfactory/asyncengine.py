@@ -0,0 +1,165 @@
+"""
+asyncio runtime for factory parts.
+Instead of one thread per part, the AsyncEngine runs every part as a
+coroutine on one event loop. A part loop waits for its next deadline with
+loop.call_at, runs read_from_bus, operate and write_to_bus and goes back to
+sleep. Parts doing blocking work (keras inference, stepping the gym, saving
+images) set blocking = True and their operate() runs in a thread pool
+executor. A part may also implement 'async def operate_async()' for I/O it
+can await directly, it is then used instead of operate().
+"""
+
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import donkeycar.vehiclepartsfactory.partfactory as factory
+from donkeycar.vehiclepartsfactory.mainthread import MainThreadScheduler
+from donkeycar.vehiclepartsfactory.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+
+class LoopEvent(object):
+    """
+    Stand-in for the threading.Event a part subscribes to the data bus, it
+    wakes the part's coroutine. Bus writes may come from any thread.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.event = asyncio.Event()
+
+    def set(self):
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.event.set)
+
+
+async def sleep_until(loop, deadline):
+    """ Sleep until loop.time() reaches deadline, timed by loop.call_at """
+    future = loop.create_future()
+    handle = loop.call_at(deadline, _set_done, future)
+    try:
+        await future
+    finally:
+        handle.cancel()
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AsyncEngine(object):
+    def __init__(self, parts, executor_workers=4, mainthread=None):
+        """
+        :param mainthread: MainThreadScheduler of the main thread work of
+                           the parts, default one with the parts registered
+        """
+        self.parts = parts
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers,
+                                           thread_name_prefix='part-executor')
+        if mainthread is None:
+            mainthread = MainThreadScheduler()
+            mainthread.register_parts(parts)
+        self.mainthread = mainthread
+        self.loop = None
+        self.on = False
+
+    def run(self, epoch_ns=None):
+        """ Run all parts until stop() or ctrl-c """
+        asyncio.run(self.main(epoch_ns))
+
+    def stop(self):
+        self.on = False
+        for part in self.parts:
+            part.on = False
+
+    async def main(self, epoch_ns):
+        self.loop = asyncio.get_running_loop()
+        # the default loop clock is time.monotonic, deadlines are comparable
+        if epoch_ns is None:
+            epoch_ns = time.monotonic_ns()
+        self.on = True
+        tasks = []
+        for part in self.parts:
+            if isinstance(part, factory.Part):
+                tasks.append(asyncio.create_task(self.run_part(part, epoch_ns)))
+            else:
+                # e.g. a ProcessPart, it brings its own process
+                part.start(epoch_ns)
+        tasks.append(asyncio.create_task(self.run_mainthread(epoch_ns)))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.executor.shutdown(wait=False)
+
+    async def run_mainthread(self, epoch_ns):
+        # the event loop runs in the main thread, serve the main thread work
+        # of the parts here
+        self.mainthread.start(epoch_ns)
+        while self.on:
+            await asyncio.sleep(self.mainthread.delay())
+            self.mainthread.service()
+
+    async def run_part(self, part, epoch_ns):
+        assert part.data_bus, "Need to set data bus first"
+        timer = part.timer
+        timer.start(epoch_ns)
+        if part.trigger_keys:
+            part.trigger = LoopEvent(self.loop)
+            part.data_bus.subscribe(part.trigger_keys, part.trigger)
+        part.on = True
+        sleep_start = time.monotonic_ns()
+        while part.on:
+            if part.trigger_keys:
+                try:
+                    await asyncio.wait_for(part.trigger.event.wait(), timeout=.1)
+                except asyncio.TimeoutError:
+                    continue
+                hold = part.last_ns / 1e9 + part.min_trigger_time
+                if part.loop_count and hold > self.loop.time():
+                    await sleep_until(self.loop, hold)
+                part.trigger.event.clear()
+            else:
+                overrun = timer.next_ns < time.monotonic_ns() - timer.tolerance_ns
+                await sleep_until(self.loop, timer.next_ns / 1e9)
+                timer.tick(time.monotonic_ns(), overrun)
+            part.profile.record('sleep', time.monotonic_ns() - sleep_start)
+
+            part.count_loop()
+            try:
+                await self.step(part)
+            except Exception:
+                logger.exception(f'{type(part).__name__} stopped')
+                return
+            sleep_start = time.monotonic_ns()
+
+    async def step(self, part):
+        """ One pass of the part, blocking work goes to the executor """
+        if not (part.blocking or hasattr(part, 'operate_async')):
+            part.step()
+            return
+        profile = part.profile
+        start = time.monotonic_ns()
+        part.read_from_bus()
+        end = time.monotonic_ns()
+        profile.record('read', end - start)
+        if tracer.enabled:
+            tracer.span(profile.name + ' read', 'part', start, end)
+        if part.run_part:
+            if hasattr(part, 'operate_async'):
+                await part.operate_async()
+            else:
+                await self.loop.run_in_executor(self.executor, part.operate)
+            start = time.monotonic_ns()
+            profile.record('operate', start - end)
+            with part.data_bus.write_section():
+                locked = time.monotonic_ns()
+                part.write_to_bus()
+            written = time.monotonic_ns()
+            profile.record('lock_wait', locked - start)
+            profile.record('write', written - locked)
+            if tracer.enabled:
+                tracer.span(profile.name + ' operate', 'part', end, start)
+                tracer.span(profile.name + ' write', 'part', locked, written)
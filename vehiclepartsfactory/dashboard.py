@@ -6,6 +6,7 @@ class Dashboard(factory.Part):
         super().__init__(loop_time = 1/cfg.DRIVE_LOOP_HZ)
         self.msg = cfg.DASHBOARD_MESSAGE
         self.run_part = True
+        self.inputs = ['angle', 'throttle', 'user/mode']
 
     def read_from_bus(self):
         self.angle = self.data_bus.read('angle')
@@ -0,0 +1,533 @@
+"""
+Data bus implementations for the factory vehicle (Method 2).
+The vehicle owns one data bus and every part reads its inputs from and writes
+its outputs to it. The plain DataBus is a dictionary, SeqLockDataBus adds
+optimistic, lock free reads with consistent multi-key snapshots and
+SharedMemoryDataBus places the data in shared memory so that parts can run
+in their own process.
+"""
+
+import time
+import struct
+import logging
+import collections
+import multiprocessing
+from contextlib import contextmanager
+from threading import RLock
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from donkeycar.vehiclepartsfactory.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# processes are spawned, forking a process that already runs part threads
+# (and possibly tensorflow) is not safe
+mp_context = multiprocessing.get_context('spawn')
+
+# Not really needed, but a structure to combine data, its type, a timestamp
+# and the number of writes of the key
+DataStruct = collections.namedtuple('DataStruct', 'data_type data time_stamp seq')
+
+# an entry as returned by read_stamped(): seq counts the writes of the key,
+# time_stamp is the time.time() of the last write
+Stamped = collections.namedtuple('Stamped', 'data seq time_stamp')
+
+
+class DataBus:
+    """ Single object in the car that shares all data between parts"""
+    def __init__(self):
+        self.data_store = {}
+        self.frame_rings = {}
+        self.subscribers = {}
+
+    def subscribe(self, data_names, event):
+        """ Set the threading.Event whenever one of data_names is written """
+        for data_name in data_names:
+            self.subscribers.setdefault(data_name, []).append(event)
+
+    def unsubscribe(self, event):
+        for events in self.subscribers.values():
+            if event in events:
+                events.remove(event)
+
+    def _notify(self, data_name):
+        # called after every write, also the place to trace it
+        if tracer.enabled:
+            tracer.instant(data_name, 'bus', time.monotonic_ns())
+        events = self.subscribers.get(data_name)
+        if events:
+            for event in events:
+                event.set()
+
+    def add_frame_ring(self, data_name, shape, depth=4):
+        """ Keep the images written to data_name in a preallocated FrameRing """
+        self.frame_rings[data_name] = FrameRing(shape, depth=depth)
+
+    def write(self, data_name, data_type, data):
+        if data is not None:
+            """ Write data into the bus"""
+            # here we check types but could check more like types don't change, etc
+            assert type(data) is data_type, f'{type(data).__name__} does not ' \
+                                            f'match {data_type.__name__}'
+            self._store(data_name, data_type, data)
+            self._notify(data_name)
+
+    def _store(self, data_name, data_type, data):
+        ring = self.frame_rings.get(data_name)
+        if ring is not None:
+            # images are copied into the next slot of the ring, no allocation
+            ring.write(data)
+        else:
+            # we just replace data, don't keep history
+            d = self.data_store.get(data_name)
+            self.data_store[data_name] = DataStruct(data_type=data_type, data=data,
+                                                    time_stamp=time.time(),
+                                                    seq=d.seq + 1 if d else 1)
+
+    def write_section(self):
+        """ Group several writes of one part, nothing to do for a plain dict """
+        return _NO_SECTION
+
+    def _entry(self, data_name):
+        ring = self.frame_rings.get(data_name)
+        if ring is not None:
+            frame = ring.latest()
+            return None if frame is None else frame.data
+        d = self.data_store.get(data_name)
+        return None if d is None else d.data
+
+    def _stamped(self, data_name):
+        ring = self.frame_rings.get(data_name)
+        if ring is not None:
+            frame = ring.latest()
+            return None if frame is None else Stamped(*frame)
+        d = self.data_store.get(data_name)
+        return None if d is None else Stamped(d.data, d.seq, d.time_stamp)
+
+    def read(self, data_name):
+        """ Return current data entry, return None when nothing found but don't throw """
+        return self._entry(data_name)
+
+    def read_stamped(self, data_name):
+        """
+        Return the current entry as Stamped(data, seq, time_stamp) or None,
+        a reader sees from seq whether the entry changed since its last read
+        """
+        return self._stamped(data_name)
+
+    def read_frame(self, data_name):
+        """ Return the latest Frame (read only view, seq, time_stamp) of an image key """
+        return self.frame_rings[data_name].latest()
+
+    def frame_slot(self, data_name):
+        """
+        Return the writable buffer of the next frame of data_name. A producer
+        fills it in place and makes it visible with publish_frame()
+        """
+        return self.frame_rings[data_name].next_slot()
+
+    def publish_frame(self, data_name):
+        self.frame_rings[data_name].commit()
+        self._notify(data_name)
+
+    def readlist(self, data_names):
+        """ Return list of data entries, return None when nothing found but don't throw """
+        datalist = []
+        for data_name in data_names:
+            data = self._entry(data_name)
+            if data is None:
+                return None
+            datalist.append(data)
+        return datalist
+
+    def dump(self):
+        """ Print out the DataBus """
+        for k, d in self.data_store.items():
+            print(f'{k}:{d.data} ', end = '')
+        for k, ring in self.frame_rings.items():
+            print(f'{k}:frame {ring.seq} ', end = '')
+        print()
+
+
+Frame = collections.namedtuple('Frame', 'data seq time_stamp')
+
+
+class FrameRing:
+    """
+    Preallocated ring of image frames for one key of the bus.
+    A write copies the image into the next slot instead of keeping a new
+    array per frame, readers get a read only view of the latest slot plus
+    its sequence number. A view stays valid until depth - 1 newer frames have
+    been written, consumers keeping a frame for longer need to copy it.
+    """
+    def __init__(self, shape, dtype=np.uint8, depth=4):
+        assert depth >= 2, 'A frame ring needs at least two slots'
+        self.depth = depth
+        self.frames = np.zeros((depth,) + tuple(shape), dtype=dtype)
+        self.views = []
+        for frame in self.frames:
+            view = frame.view()
+            view.flags.writeable = False
+            self.views.append(view)
+        self.stamps = [0.] * depth
+        self.seq = 0
+
+    def next_slot(self):
+        return self.frames[self.seq % self.depth]
+
+    def commit(self):
+        self.stamps[self.seq % self.depth] = time.time()
+        self.seq += 1
+
+    def write(self, data):
+        np.copyto(self.next_slot(), data, casting='unsafe')
+        self.commit()
+
+    def latest(self):
+        seq = self.seq
+        if seq == 0:
+            return None
+        slot = (seq - 1) % self.depth
+        return Frame(self.views[slot], seq, self.stamps[slot])
+
+
+class _NoSection:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SECTION = _NoSection()
+
+
+class SeqLockDataBus(DataBus):
+    """
+    DataBus with seqlock style optimistic reads.
+    Every key carries a version counter which is odd while the key is being
+    written. A reader takes the version, reads the entry and retries if the
+    version moved in between, so readers never take a lock and never block
+    writers. All writes of a part issued inside write_section() bump one bus
+    wide sequence, which readlist() uses to return a consistent snapshot of
+    several keys. Writers are serialised against each other only.
+    """
+    # after this many failed optimistic reads yield the GIL to the writer
+    SPIN_LIMIT = 16
+
+    def __init__(self):
+        super().__init__()
+        self.versions = {}
+        self.sequence = 0
+        self.write_lock = RLock()
+        self.write_depth = 0
+        self.read_retries = 0
+
+    @contextmanager
+    def write_section(self):
+        """ Make all writes inside the section visible to readlist() at once """
+        with self.write_lock:
+            self.write_depth += 1
+            if self.write_depth == 1:
+                self.sequence += 1      # odd: section in progress
+            try:
+                yield self
+            finally:
+                self.write_depth -= 1
+                if self.write_depth == 0:
+                    self.sequence += 1  # even: section complete
+
+    def write(self, data_name, data_type, data):
+        if data is not None:
+            assert type(data) is data_type, f'{type(data).__name__} does not ' \
+                                            f'match {data_type.__name__}'
+            with self.write_section():
+                version = self.versions.get(data_name, 0)
+                self.versions[data_name] = version + 1     # odd: writing
+                self._store(data_name, data_type, data)
+                self.versions[data_name] = version + 2     # even: written
+            self._notify(data_name)
+
+    def publish_frame(self, data_name):
+        with self.write_section():
+            version = self.versions.get(data_name, 0)
+            self.versions[data_name] = version + 1
+            self.frame_rings[data_name].commit()
+            self.versions[data_name] = version + 2
+        self._notify(data_name)
+
+    def _backoff(self, spins):
+        self.read_retries += 1
+        if spins >= self.SPIN_LIMIT:
+            time.sleep(0)
+
+    def read(self, data_name):
+        """ Return current data entry, return None when nothing found but don't throw """
+        spins = 0
+        while True:
+            version = self.versions.get(data_name, 0)
+            if not version & 1:
+                data = self._entry(data_name)
+                if self.versions.get(data_name, 0) == version:
+                    return data
+            spins += 1
+            self._backoff(spins)
+
+    def readlist(self, data_names):
+        """ Return a consistent list of data entries, None when one is missing """
+        spins = 0
+        while True:
+            sequence = self.sequence
+            if not sequence & 1:
+                datalist = [self._entry(name) for name in data_names]
+                if self.sequence == sequence:
+                    return None if any(d is None for d in datalist) else datalist
+            spins += 1
+            self._backoff(spins)
+
+    def read_stamped(self, data_name):
+        spins = 0
+        while True:
+            version = self.versions.get(data_name, 0)
+            if not version & 1:
+                stamped = self._stamped(data_name)
+                if self.versions.get(data_name, 0) == version:
+                    return stamped
+            spins += 1
+            self._backoff(spins)
+
+    def version(self, data_name):
+        """ Return the number of completed writes of data_name """
+        return self.versions.get(data_name, 0) // 2
+
+
+class SharedMemoryDataBus(DataBus):
+    """
+    DataBus in a multiprocessing.shared_memory block, shared by the vehicle
+    and all parts running in their own process.
+    The keys are fixed when the bus is created. Images get a fixed size uint8
+    slot, scalars ('float', 'int', 'boolean', 'str') a packed struct field.
+    Every key has a version counter in the header and is read with the same
+    seqlock protocol as SeqLockDataBus, writers of all processes are
+    serialised by one multiprocessing lock. Keys outside the schema are kept
+    in a process local dictionary and are not seen by other processes.
+    """
+    SCALAR_FORMATS = {'float': 'd', 'int': 'q', 'boolean': '?'}
+    SPIN_LIMIT = 16
+
+    def __init__(self, keys, image_shape, str_len=32, name=None, lock=None):
+        super().__init__()
+        self.keys = dict(keys)
+        self.image_shape = tuple(image_shape)
+        self.str_len = str_len
+        self.lock = lock if lock is not None else mp_context.RLock()
+        self.write_depth = 0
+        self.warned = set()
+
+        # header: bus sequence, one version per key, one time stamp per key
+        num_keys = len(self.keys)
+        stamps_offset = 8 * (1 + num_keys)
+        offset = stamps_offset + 8 * num_keys
+        self.slots = {}
+        for index, (key, key_type) in enumerate(self.keys.items()):
+            if key_type == 'image_array':
+                continue
+            if key_type == 'str':
+                fmt = struct.Struct(f'<{str_len}s')
+            elif key_type in self.SCALAR_FORMATS:
+                fmt = struct.Struct('<' + self.SCALAR_FORMATS[key_type])
+            else:
+                raise ValueError(f'Type {key_type} of {key} can not be shared')
+            self.slots[key] = (index, fmt, offset)
+            offset += (fmt.size + 7) // 8 * 8
+        image_offsets = {}
+        image_size = int(np.prod(self.image_shape))
+        for index, (key, key_type) in enumerate(self.keys.items()):
+            if key_type == 'image_array':
+                offset = (offset + 63) // 64 * 64
+                self.slots[key] = (index, None, offset)
+                image_offsets[key] = offset
+                offset += image_size
+
+        self.owner = name is None
+        if self.owner:
+            self.shm = SharedMemory(create=True, size=max(offset, 8))
+            self.shm.buf[:offset] = bytes(offset)
+        else:
+            self.shm = SharedMemory(name=name)
+        buf = self.shm.buf
+        self.header = np.ndarray((1 + num_keys,), dtype=np.uint64, buffer=buf)
+        self.stamps = np.ndarray((num_keys,), dtype=np.float64, buffer=buf,
+                                 offset=stamps_offset)
+        self.images = {key: np.ndarray(self.image_shape, dtype=np.uint8,
+                                       buffer=buf, offset=image_offset)
+                       for key, image_offset in image_offsets.items()}
+
+    @classmethod
+    def from_config(cls, cfg):
+        return cls(cfg.SHARED_BUS_KEYS,
+                   (cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH),
+                   cfg.SHARED_BUS_STR_LEN)
+
+    def connection(self):
+        """ Picklable arguments to attach to this bus from another process """
+        return dict(keys=self.keys, image_shape=self.image_shape,
+                    str_len=self.str_len, name=self.shm.name, lock=self.lock)
+
+    @classmethod
+    def attach(cls, connection):
+        return cls(**connection)
+
+    @contextmanager
+    def write_section(self):
+        """ Make all writes inside the section visible to readlist() at once """
+        with self.lock:
+            self.write_depth += 1
+            if self.write_depth == 1:
+                self.header[0] += 1
+            try:
+                yield self
+            finally:
+                self.write_depth -= 1
+                if self.write_depth == 0:
+                    self.header[0] += 1
+
+    def _warn_local(self, data_name):
+        if data_name not in self.warned:
+            self.warned.add(data_name)
+            logger.warning(f'{data_name} is not in SHARED_BUS_KEYS, it is '
+                           f'only visible inside this process')
+
+    def write(self, data_name, data_type, data):
+        slot = self.slots.get(data_name)
+        if slot is None:
+            self._warn_local(data_name)
+            return super().write(data_name, data_type, data)
+        if data is not None:
+            assert type(data) is data_type, f'{type(data).__name__} does not ' \
+                                            f'match {data_type.__name__}'
+            index, fmt, offset = slot
+            with self.write_section():
+                version = int(self.header[index + 1])
+                self.header[index + 1] = version + 1
+                if fmt is None:
+                    np.copyto(self.images[data_name], data, casting='unsafe')
+                elif data_type is str:
+                    fmt.pack_into(self.shm.buf, offset, data.encode())
+                else:
+                    fmt.pack_into(self.shm.buf, offset, data)
+                self.stamps[index] = time.time()
+                self.header[index + 1] = version + 2
+            # subscribers are woken inside this process only, parts in
+            # other processes keep polling
+            self._notify(data_name)
+
+    def _load(self, data_name, slot):
+        index, fmt, offset = slot
+        if fmt is None:
+            return self.images[data_name].copy()
+        value = fmt.unpack_from(self.shm.buf, offset)[0]
+        if self.keys[data_name] == 'str':
+            return value.rstrip(b'\0').decode()
+        return value
+
+    def read(self, data_name):
+        """ Return current data entry, return None when nothing found but don't throw """
+        slot = self.slots.get(data_name)
+        if slot is None:
+            return super().read(data_name)
+        index = slot[0] + 1
+        spins = 0
+        while True:
+            version = int(self.header[index])
+            if version == 0:
+                return None
+            if not version & 1:
+                value = self._load(data_name, slot)
+                if int(self.header[index]) == version:
+                    return value
+            spins += 1
+            if spins >= self.SPIN_LIMIT:
+                time.sleep(0)
+
+    def readlist(self, data_names):
+        """ Return a consistent list of data entries, None when one is missing """
+        spins = 0
+        while True:
+            sequence = int(self.header[0])
+            if not sequence & 1:
+                datalist = []
+                for data_name in data_names:
+                    slot = self.slots.get(data_name)
+                    if slot is None:
+                        value = super().read(data_name)
+                    elif self.header[slot[0] + 1] == 0:
+                        value = None
+                    else:
+                        value = self._load(data_name, slot)
+                    datalist.append(value)
+                if int(self.header[0]) == sequence:
+                    return None if any(d is None for d in datalist) else datalist
+            spins += 1
+            if spins >= self.SPIN_LIMIT:
+                time.sleep(0)
+
+    def read_stamped(self, data_name):
+        slot = self.slots.get(data_name)
+        if slot is None:
+            return super().read_stamped(data_name)
+        index = slot[0] + 1
+        spins = 0
+        while True:
+            version = int(self.header[index])
+            if version == 0:
+                return None
+            if not version & 1:
+                value = self._load(data_name, slot)
+                time_stamp = float(self.stamps[slot[0]])
+                if int(self.header[index]) == version:
+                    return Stamped(value, version // 2, time_stamp)
+            spins += 1
+            if spins >= self.SPIN_LIMIT:
+                time.sleep(0)
+
+    def version(self, data_name):
+        """ Return the number of completed writes of data_name """
+        slot = self.slots.get(data_name)
+        if slot is None:
+            return 0
+        return int(self.header[slot[0] + 1]) // 2
+
+    def dump(self):
+        """ Print out the DataBus """
+        for k in self.keys:
+            print(f'{k}:{self.read(k)} ', end = '')
+        super().dump()
+
+    def close(self):
+        # drop the numpy views before the buffer can be released
+        self.header = self.stamps = None
+        self.images = {}
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def make_data_bus(cfg):
+    """ Create the data bus selected by cfg.DATABUS_TYPE """
+    bus_type = cfg.DATABUS_TYPE
+    if bus_type == 'dict':
+        data_bus = DataBus()
+    elif bus_type == 'seqlock':
+        data_bus = SeqLockDataBus()
+    elif bus_type == 'shared':
+        # images already have fixed slots in shared memory
+        return SharedMemoryDataBus.from_config(cfg)
+    else:
+        raise ValueError(f'Unknown DATABUS_TYPE {bus_type}, use dict|seqlock|shared')
+    for data_name in cfg.BUS_FRAME_KEYS:
+        data_bus.add_frame_ring(data_name, (cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH),
+                                depth=cfg.BUS_FRAME_RING_DEPTH)
+    return data_bus
@@ -0,0 +1,202 @@
+"""
+Static dataflow analysis of the parts of a vehicle.
+Every part declares the bus keys it reads (inputs, plus run_condition for
+Method 1 parts) and writes (outputs). compile_dataflow() builds the
+producer/consumer graph and returns a DataflowPlan with
+    - inputs nobody produces and outputs nobody consumes
+    - dead parts, whose outputs are all unconsumed (parts with sink = True
+      or without outputs act on the world and are never dead)
+    - cycles, i.e. strongly connected groups of parts. A control loop
+      (camera -> pilot -> drive mode -> actuator -> camera) always is one.
+      Inside a cycle an edge going back in YAML order is a feedback edge,
+      its value comes from the previous loop
+    - a topological execution order, YAML order where data does not decide
+    - the critical path, the chain of parts with the largest summed latency
+The plan is used by both driver.py (Method 1) and vehicle.py (Method 2).
+"""
+
+import heapq
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def part_inputs(part):
+    inputs = list(getattr(part, 'inputs', None) or [])
+    run_condition = getattr(part, 'run_condition', None)
+    if isinstance(run_condition, str) and run_condition not in inputs:
+        inputs.append(run_condition)
+    return inputs
+
+
+def part_outputs(part):
+    return list(getattr(part, 'outputs', None) or [])
+
+
+def part_latency(part):
+    """ Default hop latency of a part: its loop time, 1 for Method 1 parts """
+    return getattr(part, 'loop_time', 1.)
+
+
+class DataflowPlan(object):
+    def __init__(self, parts, names):
+        self.parts = parts
+        self.names = names
+        self.edges = []             # (producer, consumer, key) as part indexes
+        self.feedback = []          # edges whose value is from the previous loop
+        self.unproduced = {}        # key: consuming part names
+        self.unconsumed = {}        # key: producing part names
+        self.dead = []              # part indexes
+        self.cycles = []            # lists of part indexes
+        self.order = []             # part indexes in execution order
+        self.critical_path = []     # part indexes
+        self.critical_latency = 0.
+
+    def ordered_parts(self, prune=False):
+        """ Parts in execution order, without the dead parts when pruning """
+        return [self.parts[i] for i in self.order
+                if not (prune and i in self.dead)]
+
+    def report(self):
+        lines = ['Dataflow of ' + str(len(self.parts)) + ' parts:']
+        for key, names in sorted(self.unproduced.items()):
+            lines.append(f'    input {key} of {", ".join(names)} is never written')
+        for key, names in sorted(self.unconsumed.items()):
+            lines.append(f'    output {key} of {", ".join(names)} is never read')
+        for i in self.dead:
+            lines.append(f'    {self.names[i]} is dead, none of its outputs is read')
+        for cycle in self.cycles:
+            lines.append('    cycle: ' + ', '.join(self.names[i] for i in cycle))
+        for producer, consumer, key in self.feedback:
+            lines.append(f'    feedback {self.names[producer]} -> '
+                         f'{self.names[consumer]} ({key}) uses the previous loop')
+        lines.append('    order: ' + ', '.join(self.names[i] for i in self.order))
+        lines.append('    critical path: '
+                     + ' -> '.join(self.names[i] for i in self.critical_path)
+                     + f' ({self.critical_latency:.3f})')
+        return '\n'.join(lines)
+
+
+def _strongly_connected(num_nodes, successors):
+    """ Tarjan's algorithm, returns the components with more than one node """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    components = []
+    counter = [0]
+
+    def visit(node):
+        index[node] = low[node] = counter[0]
+        counter[0] += 1
+        stack.append(node)
+        on_stack.add(node)
+        for succ in successors[node]:
+            if succ not in index:
+                visit(succ)
+                low[node] = min(low[node], low[succ])
+            elif succ in on_stack:
+                low[node] = min(low[node], index[succ])
+        if low[node] == index[node]:
+            component = []
+            while True:
+                member = stack.pop()
+                on_stack.discard(member)
+                component.append(member)
+                if member == node:
+                    break
+            if len(component) > 1:
+                components.append(sorted(component))
+
+    for node in range(num_nodes):
+        if node not in index:
+            visit(node)
+    return components
+
+
+def compile_dataflow(parts, names=None, latency=part_latency):
+    """
+    :param parts: parts in YAML order, with inputs/outputs attributes
+    :param names: display names of the parts, default their class names
+    :param latency: function returning the hop latency of a part
+    :return: DataflowPlan
+    """
+    if names is None:
+        names = [type(part).__name__ for part in parts]
+    plan = DataflowPlan(parts, names)
+    inputs = [part_inputs(part) for part in parts]
+    outputs = [part_outputs(part) for part in parts]
+
+    producers = {}
+    consumers = {}
+    for i in range(len(parts)):
+        for key in outputs[i]:
+            producers.setdefault(key, []).append(i)
+        for key in inputs[i]:
+            consumers.setdefault(key, []).append(i)
+
+    for key, readers in consumers.items():
+        if key not in producers:
+            plan.unproduced[key] = [names[i] for i in readers]
+    for key, writers in producers.items():
+        if set(consumers.get(key, [])) <= set(writers):
+            plan.unconsumed[key] = [names[i] for i in writers]
+    for i, part in enumerate(parts):
+        if outputs[i] and not getattr(part, 'sink', False) and \
+                all(key in plan.unconsumed for key in outputs[i]):
+            plan.dead.append(i)
+
+    # a part rewriting a key it reads (AiLaunch on pilot/throttle) depends
+    # on the other producers of the key, not on itself
+    successors = [set() for _ in parts]
+    for key, readers in consumers.items():
+        for producer in producers.get(key, []):
+            for consumer in readers:
+                if producer != consumer:
+                    plan.edges.append((producer, consumer, key))
+                    successors[producer].add(consumer)
+
+    plan.cycles = _strongly_connected(len(parts), successors)
+    component_of = {}
+    for c, cycle in enumerate(plan.cycles):
+        for i in cycle:
+            component_of[i] = c
+
+    # drop the feedback edges, what is left is acyclic
+    forward = [set() for _ in parts]
+    predecessors = [set() for _ in parts]
+    for producer, consumer, key in plan.edges:
+        same_cycle = producer in component_of and \
+            component_of.get(producer) == component_of.get(consumer)
+        if same_cycle and producer > consumer:
+            plan.feedback.append((producer, consumer, key))
+        else:
+            forward[producer].add(consumer)
+            predecessors[consumer].add(producer)
+
+    # Kahn's algorithm, ties broken by YAML order
+    pending = [len(predecessors[i]) for i in range(len(parts))]
+    ready = [i for i in range(len(parts)) if pending[i] == 0]
+    heapq.heapify(ready)
+    while ready:
+        i = heapq.heappop(ready)
+        plan.order.append(i)
+        for succ in forward[i]:
+            pending[succ] -= 1
+            if pending[succ] == 0:
+                heapq.heappush(ready, succ)
+
+    # longest path through the forward graph
+    best = {}
+    came_from = {}
+    for i in plan.order:
+        start = max(predecessors[i], key=lambda p: best[p], default=None)
+        best[i] = latency(parts[i]) + (best[start] if start is not None else 0.)
+        came_from[i] = start
+    if best:
+        node = max(best, key=best.get)
+        plan.critical_latency = best[node]
+        while node is not None:
+            plan.critical_path.insert(0, node)
+            node = came_from[node]
+    return plan
@@ -0,0 +1,48 @@
+"""
+Fixed time delay of a stream of samples.
+DonkeyGymEnv uses a DelayLine to emulate the latency of a remote sim
+(SIM_ARTIFICIAL_LATENCY): every step pushes the new (frame, info) and gets
+back the newest sample at least delay old. Samples are kept in a deque with
+their time.monotonic_ns() stamps, each one is appended and popped once, so a
+step costs the same whatever the delay and the sim rate.
+"""
+
+import time
+from collections import deque
+
+
+class DelayLine(object):
+    def __init__(self, delay, initial=None):
+        """
+        :param delay: delay in seconds
+        :param initial: sample returned until the first one is delay old
+        """
+        self.delay_ns = int(delay * 1e9)
+        self.samples = deque()
+        self.current = initial
+        self.current_ns = None
+
+    def __len__(self):
+        """ Samples pushed and not yet delay old """
+        return len(self.samples)
+
+    def push(self, sample, now=None):
+        """ Add a sample taken at now (monotonic ns), returns the delayed sample """
+        if now is None:
+            now = time.monotonic_ns()
+        self.samples.append((now, sample))
+        due = now - self.delay_ns
+        samples = self.samples
+        while samples[0][0] <= due:
+            self.current_ns, self.current = samples.popleft()
+            if not samples:
+                break
+        return self.current
+
+    def age_ms(self, now=None):
+        """ Age of the delayed sample in ms, 0 before the first one """
+        if self.current_ns is None:
+            return 0.
+        if now is None:
+            now = time.monotonic_ns()
+        return (now - self.current_ns) / 1e6
@@ -1,15 +1,17 @@
 import os
 import time
-import gym
-import gym_donkeycar
 import numpy
 
 import donkeycar.vehiclepartsfactory.partfactory as factory
+from donkeycar.vehiclepartsfactory.delayline import DelayLine
 
 def is_exe(fpath):
     return os.path.isfile(fpath) and os.access(fpath, os.X_OK)
 
 class DonkeyGymEnv_Original(factory.Part):
+    blocking = True
+    sink = True     # drives the simulated car
+
 
     def __init__(self, sim_path, host="127.0.0.1", port=9091, headless=0, env_name="donkey-generated-track-v0", sync="asynchronous", 
             conf={}, record_location=False, record_gyroaccel=False, record_velocity=False, record_lidar=False, delay=0, drive_loop_hz=20):
@@ -27,6 +29,10 @@ class DonkeyGymEnv_Original(factory.Part):
         conf["port"] = port
         conf["guid"] = 0
         conf["frame_skip"] = 1
+        # imported when the part is created, gym and the sim client are slow
+        # to import
+        import gym
+        import gym_donkeycar     # registers the donkey environments
         self.env = gym.make(env_name, conf=conf)
         self.frame = self.env.reset()
         self.action = [0.0, 0.0, 0.0]
@@ -36,31 +42,35 @@ class DonkeyGymEnv_Original(factory.Part):
                      'cte': 0,
                      'gyro': (0., 0., 0.),
                      'accel': (0., 0., 0.),
-                     'vel': (0., 0., 0.)}
+                     'vel': (0., 0., 0.),
+                     'lidar': []}
         self.delay = float(delay) / 1000
         self.record_location = record_location
         self.record_gyroaccel = record_gyroaccel
         self.record_velocity = record_velocity
         self.record_lidar = record_lidar
 
-        self.buffer = []
+        self.delay_line = DelayLine(self.delay, (self.frame, self.info))
 
     def delay_buffer(self, frame, info):
-        now = time.time()
-        buffer_tuple = (now, frame, info)
-        self.buffer.append(buffer_tuple)
-
-        # go through the buffer
-        num_to_remove = 0
-        for buf in self.buffer:
-            if now - buf[0] >= self.delay:
-                num_to_remove += 1
-                self.frame = buf[1]
-            else:
-                break
-
-        # clear the buffer
-        del self.buffer[:num_to_remove]
+        # the frame and info of the step delay old, or the ones after reset
+        self.frame, self.info = self.delay_line.push((frame, info))
+
+    def telemetry(self):
+        """ (bus key, value) of the recorded sim info, delayed like the frame """
+        info = self.info
+        values = []
+        if self.record_location:
+            values += zip(('pos/pos_x', 'pos/pos_y', 'pos/pos_z'), info['pos'])
+            values += ('pos/speed', info['speed']), ('pos/cte', info['cte'])
+        if self.record_gyroaccel:
+            values += zip(('gyro/gyro_x', 'gyro/gyro_y', 'gyro/gyro_z'), info['gyro'])
+            values += zip(('accel/accel_x', 'accel/accel_y', 'accel/accel_z'), info['accel'])
+        if self.record_velocity:
+            values += zip(('vel/vel_x', 'vel/vel_y', 'vel/vel_z'), info['vel'])
+        if self.record_lidar:
+            values.append(('lidar/dist_array', info['lidar']))
+        return values
 
 #     def update(self):
 #         while self.running:
@@ -106,6 +116,10 @@ class DonkeyGymEnv_Original(factory.Part):
 
     def write_to_bus(self):
         self.data_bus.write('cam/image_array', numpy.ndarray, self.frame)
+        for key, value in self.telemetry():
+            self.data_bus.write(key, type(value), value)
+        if self.delay > 0.0:
+            self.data_bus.write('sim/delay_ms', float, self.delay_line.age_ms())
         
     def operate(self):
         if self.angle is None or self.throttle is None:
@@ -131,11 +145,15 @@ class DonkeyGymEnv_Original(factory.Part):
 
 class DonkeyGymEnv(DonkeyGymEnv_Original):
     def __init__(self, cfg):
-        super(DonkeyGymEnv, self).__init__(cfg.DONKEY_SIM_PATH, host=cfg.SIM_HOST, env_name=cfg.DONKEY_GYM_ENV_NAME, conf=cfg.GYM_CONF, delay=cfg.SIM_ARTIFICIAL_LATENCY, drive_loop_hz=cfg.DRIVE_LOOP_HZ)
+        super(DonkeyGymEnv, self).__init__(cfg.DONKEY_SIM_PATH, host=cfg.SIM_HOST, env_name=cfg.DONKEY_GYM_ENV_NAME, conf=cfg.GYM_CONF, delay=cfg.SIM_ARTIFICIAL_LATENCY, drive_loop_hz=cfg.DRIVE_LOOP_HZ,
+            record_location=cfg.SIM_RECORD_LOCATION, record_gyroaccel=cfg.SIM_RECORD_GYROACCEL,
+            record_velocity=cfg.SIM_RECORD_VELOCITY, record_lidar=cfg.SIM_RECORD_LIDAR)
        
-#        # vehicle parameters       
-#        self.inputs  = ['angle', 'throttle', 'brake']
-#        self.outputs = ['cam/image_array']
+        # vehicle parameters       
+        self.inputs  = ['angle', 'throttle', 'brake']
+        self.outputs = ['cam/image_array'] + [key for key, _ in self.telemetry()]
+        if self.delay > 0.0:
+            self.outputs.append('sim/delay_ms')
 #        self.threaded = True
         self.run_part = True
 
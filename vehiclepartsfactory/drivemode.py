@@ -4,8 +4,8 @@ class DriveMode(factory.Part):
     def __init__(self, cfg):   
         super().__init__(loop_time = 1/cfg.DRIVE_LOOP_HZ)
         # vehicle parameters       
-#         self.inputs = ['user/mode', 'user/angle', 'user/throttle', 'pilot/angle', 'pilot/throttle', 'AImultiplier']
-#         self.outputs = ['angle', 'throttle']
+        self.inputs = ['user/mode', 'user/angle', 'user/throttle', 'pilot/angle', 'pilot/throttle', 'AImultiplier']
+        self.outputs = ['angle', 'throttle']
 #         self.run_condition = None
         self.run_part = True
         
@@ -5,6 +5,8 @@ class ExamplePart(factory.Part):
     def __init__(self, cfg):
         super().__init__(loop_time = 1/cfg.DRIVE_LOOP_HZ)
         self.run_part = True
+        self.inputs = ['data1', 'data2']
+        self.outputs = ['out1', 'out2']
 
     def read_from_bus(self):
     # Thread is locked while reading data; only read
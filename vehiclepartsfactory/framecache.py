@@ -0,0 +1,161 @@
+"""
+Cache of decoded tub frames.
+A FrameCache keeps the decoded, optionally ROI cropped images of a tub in one
+.npy file next to the tub, row i holding the image of record i, and a second
+.npy with a flag per row whether it is filled. The first epoch decodes the
+jpegs and fills the rows, later epochs read them from the memory mapped file.
+Deleting or restoring records through the tub clears their rows. Changes made
+to the tub by other programs are found on open by comparing the deleted
+records with the ones the cache was built with.
+"""
+
+import os
+import json
+from threading import Lock
+
+import numpy as np
+from PIL import Image
+
+
+class FrameCache(object):
+    def __init__(self, tub, image_key='cam/image_array', crop=(0, 0, 0, 0)):
+        """
+        :param tub: Tub or ColumnarTub, the cache registers with it
+        :param image_key: image input to cache
+        :param crop: rows and columns cut off (top, bottom, left, right)
+        """
+        self.tub = tub
+        self.image_key = image_key
+        self.crop = tuple(int(c) for c in crop)
+        name = image_key.replace('/', '_') + '_' + '_'.join(map(str, self.crop))
+        self.path = os.path.join(tub.base_path, f'cache_{name}')
+        self.frames = None
+        self.valid = None
+        self.lock = Lock()
+        self._open()
+        tub.caches.append(self)
+
+    @classmethod
+    def from_config(cls, tub, cfg, image_key='cam/image_array'):
+        """ Crop with the ROI_CROP_* settings if 'CROP' is in TRANSFORMATIONS """
+        crop = (0, 0, 0, 0)
+        if 'CROP' in cfg.TRANSFORMATIONS:
+            crop = (cfg.ROI_CROP_TOP, cfg.ROI_CROP_BOTTOM,
+                    cfg.ROI_CROP_LEFT, cfg.ROI_CROP_RIGHT)
+        return cls(tub, image_key, crop)
+
+    def _deleted(self):
+        # DeletedRuns of Tub or ColumnarTub
+        if hasattr(self.tub, 'deleted'):
+            return self.tub.deleted
+        return self.tub.deleted_indexes
+
+    def _open(self):
+        count = self.tub.current_index
+        meta = None
+        if os.path.exists(self.path + '.json'):
+            with open(self.path + '.json') as file:
+                meta = json.load(file)
+        if meta is None or meta['count'] == 0:
+            # nothing cached yet, the frame shape is known with the first row
+            self.meta = {'count': 0, 'shape': None, 'deleted': []}
+            return
+        self.meta = meta
+        frames = np.load(self.path + '.npy', mmap_mode='r+')
+        valid = np.load(self.path + '_valid.npy', mmap_mode='r+')
+        if count > meta['count']:
+            # the tub grew, move the rows into bigger files
+            frames, valid = self._resize(frames, valid, count)
+        self.frames, self.valid = frames, valid
+        # records deleted or restored since the cache was written
+        changed = set(meta['deleted']).symmetric_difference(self._deleted())
+        self.invalidate(changed)
+
+    def _create(self, shape, count):
+        frames = np.lib.format.open_memmap(self.path + '.npy.tmp', mode='w+',
+                                           dtype=np.uint8, shape=(count,) + shape)
+        valid = np.lib.format.open_memmap(self.path + '_valid.npy.tmp', mode='w+',
+                                          dtype=np.bool_, shape=(count,))
+        return frames, valid
+
+    def _resize(self, frames, valid, count):
+        new_frames, new_valid = self._create(frames.shape[1:], count)
+        new_frames[:len(frames)] = frames
+        new_valid[:len(valid)] = valid
+        return self._replace(new_frames, new_valid, count)
+
+    def _replace(self, frames, valid, count):
+        frames.flush()
+        valid.flush()
+        del frames, valid
+        os.replace(self.path + '.npy.tmp', self.path + '.npy')
+        os.replace(self.path + '_valid.npy.tmp', self.path + '_valid.npy')
+        self.meta['count'] = count
+        self._save_meta()
+        return (np.load(self.path + '.npy', mmap_mode='r+'),
+                np.load(self.path + '_valid.npy', mmap_mode='r+'))
+
+    def _save_meta(self):
+        self.meta['deleted'] = list(self._deleted())
+        with open(self.path + '.json', 'w') as file:
+            json.dump(self.meta, file)
+
+    def _decode(self, index):
+        """ Cropped image of record index from the tub, None if it has none """
+        if hasattr(self.tub, 'read_frame'):
+            image = self.tub.read_frame(self.image_key, index)
+        else:
+            name = self.tub._image_file_name(index, self.image_key)
+            try:
+                image = np.asarray(Image.open(os.path.join(self.tub.images_base_path, name)))
+            except FileNotFoundError:
+                image = None
+        if image is None:
+            return None
+        top, bottom, left, right = self.crop
+        height, width = image.shape[:2]
+        return image[top:height - bottom, left:width - right]
+
+    def get(self, index):
+        """
+        Cropped image of record index, decoded on the first access, None if
+        the record has no image (deleted or missing)
+        """
+        index = int(index)
+        with self.lock:
+            if self.frames is not None and index < len(self.frames) \
+                    and self.valid[index]:
+                return self.frames[index]
+        image = self._decode(index)
+        if image is None:
+            return None
+        # another thread may swap the files in _grow, the row is written
+        # into the files which are current under the lock
+        with self.lock:
+            if self.frames is None or index >= len(self.frames):
+                self._grow(image.shape)
+            self.frames[index] = image
+            self.valid[index] = True
+            return self.frames[index]
+
+    def _grow(self, shape):
+        count = max(self.tub.current_index, 1)
+        # another thread may have grown the files already
+        if self.frames is None:
+            self.meta['shape'] = list(shape)
+            self.frames, self.valid = self._replace(*self._create(shape, count), count)
+        elif count > len(self.frames):
+            self.frames, self.valid = self._resize(self.frames, self.valid, count)
+
+    def invalidate(self, indexes):
+        """ Clear the rows of records which were deleted or restored """
+        if self.valid is not None:
+            indexes = [i for i in indexes if i < len(self.valid)]
+            self.valid[indexes] = False
+        self._save_meta()
+
+    def flush(self):
+        if self.frames is not None:
+            self.frames.flush()
+            self.valid.flush()
+            self._save_meta()
@@ -0,0 +1,115 @@
+"""
+Pipelined model inference for the pilot parts.
+An InferenceEngine runs the model in its own thread. The pilot part hands it
+frames with submit(), which preprocesses the frame in the caller's thread
+while the engine is still inferring the previous one, and picks up the
+newest result with latest() without waiting. The engine holds one pending
+frame only: a frame submitted before the engine got to the previous one
+replaces it, so inference always starts on the freshest frame and the output
+lags the camera by at most the frame being inferred.
+"""
+
+import time
+import logging
+from threading import Thread, Condition
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ONE_BYTE_SCALE = 1.0 / 255.0
+
+
+class InferenceEngine(object):
+    def __init__(self, kl, name='InferenceEngine'):
+        """
+        :param kl: loaded pilot (KerasPilot, TFLite, ...), pilots with an
+                   inference() method get the frame normalized in submit(),
+                   others get a copy of the frame in run()
+        """
+        self.kl = kl
+        self.name = name
+        self.split = hasattr(kl, 'inference')
+        self.condition = Condition()
+        self.pending = None
+        self.result = None
+        self.on = False
+        self.thread = None
+        # counters
+        self.submitted = 0
+        self.inferred = 0
+        self.dropped = 0
+        self.latency_ms = 0.
+        self.total_ms = 0.
+
+    def preprocess(self, image):
+        """ Copy the frame out of the bus (frame ring slots get reused) """
+        if self.split:
+            # same as KerasPilot.run() does before inference()
+            return np.asarray(image, dtype=np.float64) * ONE_BYTE_SCALE
+        return np.array(image)
+
+    def submit(self, image, time_stamp=None, skipped=0):
+        """
+        Queue a frame for inference, replacing a frame not yet started.
+        :param time_stamp: time.time() the frame was taken, default now
+        :param skipped: frames the caller never got to see, counted as dropped
+        """
+        x = self.preprocess(image)
+        with self.condition:
+            if self.pending is not None:
+                self.dropped += 1
+            self.dropped += skipped
+            self.pending = (x, time_stamp or time.time())
+            self.submitted += 1
+            self.condition.notify()
+
+    def infer(self, x):
+        if self.split:
+            return self.kl.inference(x, None)
+        return self.kl.run(x)
+
+    def run(self):
+        """ Engine loop, infers the pending frame whenever there is one """
+        self.on = True
+        while self.on:
+            with self.condition:
+                while self.pending is None and self.on:
+                    self.condition.wait(timeout=.1)
+                if not self.on:
+                    break
+                x, time_stamp = self.pending
+                self.pending = None
+            start = time.monotonic_ns()
+            try:
+                outputs = self.infer(x)
+            except Exception as e:
+                logger.error(f'{self.name} inference failed: {e}')
+                continue
+            latency_ms = (time.monotonic_ns() - start) / 1e6
+            with self.condition:
+                self.result = (outputs, time_stamp, latency_ms)
+                self.latency_ms = latency_ms
+                self.total_ms += latency_ms
+                self.inferred += 1
+
+    def start(self):
+        self.on = True
+        self.thread = Thread(target=self.run, name=self.name, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.on = False
+        with self.condition:
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout=1.)
+
+    def latest(self):
+        """ (outputs, frame time stamp, latency ms) of the newest inference or None """
+        return self.result
+
+    def report(self):
+        average = self.total_ms / max(1, self.inferred)
+        return (f'{self.name}: {self.submitted} frames submitted, {self.inferred} '
+                f'inferred, {self.dropped} dropped, avg inference {average:.1f} ms')
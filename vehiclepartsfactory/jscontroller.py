@@ -4,16 +4,20 @@ import array
 import time
 import struct
 import random
-from threading import Thread
+import select
+from threading import Thread, Lock
 import logging
 
-from prettytable import PrettyTable
+import numpy as np
 
-#import for syntactical ease
-from donkeycar.parts.web_controller.web import LocalWebController
-from donkeycar.parts.web_controller.web import WebFpv
 import donkeycar.vehiclepartsfactory.partfactory as factory
 
+# struct js_event of the Linux joystick api: time ms, value, type, number
+JS_EVENT = struct.Struct('IhBB')
+JS_EVENT_BUTTON = 0x01
+JS_EVENT_AXIS = 0x02
+JS_EVENT_INIT = 0x80
+
 class JoystickController(factory.Part):
     '''
     JoystickController is a base class. You will not use this class directly,
@@ -72,6 +76,8 @@ class JoystickController(factory.Part):
         print ("Initial mode is " + self.mode)
         
         self.run_part = True
+        self.inputs = ['cam/image_array']
+        self.outputs = ['user/angle', 'user/throttle', 'user/mode', 'recording', 'AImultiplier', 'command']
 
         
     def init_js(self):
@@ -98,6 +104,7 @@ class JoystickController(factory.Part):
         '''
         print the mapping of buttons and axis to functions
         '''
+        from prettytable import PrettyTable
         pt = PrettyTable()
         pt.field_names = ["control", "action"]
         for button, control in self.button_down_trigger_map.items():
@@ -409,19 +416,14 @@ class JoystickController(factory.Part):
             self.angle = 0
             self.throttle = 0
             
-        button, button_state, axis, axis_val = self.js.poll()
-
-        if axis is not None and axis in self.axis_trigger_map:
-            ''' then invoke the function attached to that axis '''
-            self.axis_trigger_map[axis](axis_val)
-
-        if button and button_state >= 1 and button in self.button_down_trigger_map:
-            ''' then invoke the function attached to that button '''
-            self.button_down_trigger_map[button]()
-
-        if button and button_state == 0 and button in self.button_up_trigger_map:
-            '''then invoke the function attached to that button'''
-            self.button_up_trigger_map[button]()           
+        poll_all = getattr(self.js, 'poll_all', None)
+        if poll_all is not None:
+            # every event since the last loop, axis moves coalesced
+            events = poll_all()
+        else:
+            events = [self.js.poll()]
+        for button, button_state, axis, axis_val in events:
+            self.dispatch(button, button_state, axis, axis_val)
         
         if self.estop_state > self.ES_IDLE:
             if self.estop_state == self.ES_START:
@@ -444,6 +446,102 @@ class JoystickController(factory.Part):
         if self.chaos_monkey_steering is not None:
             self.angle = self.chaos_monkey_steering
 
+    def dispatch(self, button, button_state, axis, axis_val):
+        '''
+        invoke the functions attached to a joystick event
+        '''
+        if axis is not None and axis in self.axis_trigger_map:
+            ''' then invoke the function attached to that axis '''
+            self.axis_trigger_map[axis](axis_val)
+
+        if button and button_state >= 1 and button in self.button_down_trigger_map:
+            ''' then invoke the function attached to that button '''
+            self.button_down_trigger_map[button]()
+
+        if button and button_state == 0 and button in self.button_up_trigger_map:
+            '''then invoke the function attached to that button'''
+            self.button_up_trigger_map[button]()           
+
+
+class JoystickReader(object):
+    '''
+    Non blocking reader of joystick events from a file descriptor, the
+    /dev/input/js* device or a pipe or pty standing in for it. read_events()
+    drains all pending events with bulk reads and keeps only the last value
+    of every axis, so a burst of axis events between two loops is handled in
+    one loop instead of one event per loop.
+    '''
+    def __init__(self, fd, axis_map, button_map, chunk_events=64):
+        os.set_blocking(fd, False)
+        self.fd = fd
+        self.axis_map = axis_map
+        self.button_map = button_map
+        self.chunk_size = JS_EVENT.size * chunk_events
+        # bytes of an event not completely read yet
+        self.partial = b''
+        self.epoll = select.epoll()
+        self.epoll.register(fd, select.EPOLLIN)
+        self.events_read = 0
+        self.axis_coalesced = 0
+
+    def wait(self, timeout=None):
+        '''
+        wait up to timeout seconds (None: forever) for events, returns
+        whether there are some
+        '''
+        return bool(self.epoll.poll(-1 if timeout is None else timeout))
+
+    def drain(self):
+        '''
+        read all pending bytes, returns the complete events
+        '''
+        chunks = [self.partial]
+        while True:
+            try:
+                chunk = os.read(self.fd, self.chunk_size)
+            except BlockingIOError:
+                break
+            chunks.append(chunk)
+            if len(chunk) < self.chunk_size:
+                # drained, or the other end of a pipe is closed
+                break
+        data = b''.join(chunks)
+        end = len(data) - len(data) % JS_EVENT.size
+        self.partial = data[end:]
+        return data[:end]
+
+    def read_events(self, timeout=0.):
+        '''
+        pending events as (button, button_state, axis, axis_val) in the order
+        they happened, an axis at the place of its last event
+        '''
+        if not self.wait(timeout):
+            return []
+        events = []
+        axis_index = {}
+        for tval, value, typev, number in JS_EVENT.iter_unpack(self.drain()):
+            self.events_read += 1
+            if typev & JS_EVENT_INIT:
+                #ignore initialization event
+                continue
+            if typev & JS_EVENT_BUTTON and number < len(self.button_map):
+                button = self.button_map[number]
+                if button:
+                    # every press and release counts
+                    events.append((button, value, None, None))
+            elif typev & JS_EVENT_AXIS and number < len(self.axis_map):
+                axis = self.axis_map[number]
+                if axis:
+                    if axis in axis_index:
+                        events[axis_index[axis]] = None
+                        self.axis_coalesced += 1
+                    axis_index[axis] = len(events)
+                    events.append((None, None, axis, value / 32767.0))
+        return [event for event in events if event is not None]
+
+    def close(self):
+        self.epoll.close()
+
 
 class Joystick(object):
     '''
@@ -457,6 +555,9 @@ class Joystick(object):
         self.axis_map = []
         self.button_map = []
         self.jsdev = None
+        self.reader = None
+        # events read by poll_all() for poll() to hand out one by one
+        self.pending = []
         self.dev_fn = dev_fn
 
 
@@ -476,9 +577,10 @@ class Joystick(object):
         '''
         call once to setup connection to device and map buttons
         '''
-        # Open the joystick device.
+        # Open the joystick device, non blocking for the JoystickReader.
         print('Opening %s...' % self.dev_fn)
-        self.jsdev = open(self.dev_fn, 'rb')
+        fd = os.open(self.dev_fn, os.O_RDONLY | os.O_NONBLOCK)
+        self.jsdev = os.fdopen(fd, 'rb', buffering=0)
 
         # Get the device name.
         buf = array.array('B', [0] * 64)
@@ -514,6 +616,7 @@ class Joystick(object):
             self.button_states[btn_name] = 0
             #print('btn', '0x%03x' % btn, 'name', btn_name)
 
+        self.reader = JoystickReader(fd, self.axis_map, self.button_map)
         return True
 
 
@@ -525,48 +628,38 @@ class Joystick(object):
         print ('%d buttons found: %s' % (self.num_buttons, ', '.join(self.button_map)))
 
 
-    def poll(self):
+    def poll(self, timeout=.1):
         '''
         query the state of the joystick, returns button which was pressed, if any,
         and axis which was moved, if any. button_state will be None, 1, or 0 if no changes,
         pressed, or released. axis_val will be a float from -1 to +1. button and axis will
         be the string label determined by the axis map in init.
+        One event per call, taken from poll_all(), waits up to timeout seconds
+        when there is none.
         '''
-        button = None
-        button_state = None
-        axis = None
-        axis_val = None
-
-        if self.jsdev is None:
-            return button, button_state, axis, axis_val
-
-        # Main event loop
-        evbuf = self.jsdev.read(8)
-
-        if evbuf:
-            tval, value, typev, number = struct.unpack('IhBB', evbuf)
-
-            if typev & 0x80:
-                #ignore initialization event
-                return button, button_state, axis, axis_val
+        if not self.pending:
+            self.pending = self.poll_all(timeout)
+        if self.pending:
+            return self.pending.pop(0)
+        return None, None, None, None
 
-            if typev & 0x01:
-                button = self.button_map[number]
-                #print(tval, value, typev, number, button, 'pressed')
-                if button:
-                    self.button_states[button] = value
-                    button_state = value
-                    logging.info("button: %s state: %d" % (button, value))
-
-            if typev & 0x02:
-                axis = self.axis_map[number]
-                if axis:
-                    fvalue = value / 32767.0
-                    self.axis_states[axis] = fvalue
-                    axis_val = fvalue
-                    logging.debug("axis: %s val: %f" % (axis, fvalue))
-
-        return button, button_state, axis, axis_val
+    def poll_all(self, timeout=0.):
+        '''
+        all events since the last call without blocking (or waiting up to
+        timeout seconds for the first), see JoystickReader.read_events().
+        Events read by poll() and not returned yet come first.
+        '''
+        events, self.pending = self.pending, []
+        if self.reader is None:
+            return events
+        new_events = self.reader.read_events(0. if events else timeout)
+        for button, button_state, axis, axis_val in new_events:
+            if button:
+                self.button_states[button] = button_state
+                logging.info("button: %s state: %d" % (button, button_state))
+            else:
+                self.axis_states[axis] = axis_val
+        return events + new_events
 
 class PyGameJoystick(object):
     def __init__( self,
@@ -594,8 +687,9 @@ class PyGameJoystick(object):
         name = self.joystick.get_name()
         print("detected joystick device:", name)
 
-        self.axis_states = [ 0.0 for i in range(self.joystick.get_numaxes())]
-        self.button_states = [ 0 for i in range(self.joystick.get_numbuttons() + self.joystick.get_numhats() * 4)]
+        # numpy arrays, poll_all() compares a snapshot of the joystick with them
+        self.axis_states = np.zeros(self.joystick.get_numaxes())
+        self.button_states = np.zeros(self.joystick.get_numbuttons() + self.joystick.get_numhats() * 4, dtype=np.int64)
         self.axis_names = {}
         self.button_names = {}
         self.dead_zone = 0.0
@@ -653,52 +747,185 @@ class PyGameJoystick(object):
                 break
         
         return button, button_state, axis, axis_val
+
+    def poll_all(self):
+        '''
+        snapshot all axes and buttons, returns the events of every changed
+        button and the latest value of every changed axis, in one call. The
+        joystick state is only updated when pygame events are pumped, see
+        PyGamePS4JoystickController.mainthread()
+        '''
+        joystick = self.joystick
+        axes = np.array([joystick.get_axis(i) for i in range(len(self.axis_states))])
+        axes[np.abs(axes) < self.dead_zone] = 0.0
+        num_buttons = joystick.get_numbuttons()
+        buttons = np.array([joystick.get_button(i) for i in range(num_buttons)],
+                           dtype=np.int64)
+        events = []
+        for i in np.flatnonzero(buttons != self.button_states[:num_buttons]):
+            if i in self.button_names:
+                events.append((self.button_names[i], int(buttons[i]), None, None))
+        for i in np.flatnonzero(axes != self.axis_states):
+            if i in self.axis_names:
+                events.append((None, None, self.axis_names[i], float(axes[i])))
+        self.axis_states = axes
+        self.button_states[:num_buttons] = buttons
+        return events
         
     def set_deadzone(self, val):
         self.dead_zone = val
 
+# remote joystick wire format, little endian: a header of sequence number,
+# time.time_ns() of the sender and entry count, then the entries, an axis
+# name and value or a button name and state
+JS_WIRE_HEADER = struct.Struct('<IqH')
+JS_WIRE_NAME_LEN = 16
+JS_WIRE_AXIS = struct.Struct(f'<{JS_WIRE_NAME_LEN}sf')
+JS_WIRE_BUTTON = struct.Struct(f'<{JS_WIRE_NAME_LEN}sB')
+
+
+def pack_js_message(seq, entry, values):
+    """ Header and one entry per (name, value) of values """
+    parts = [JS_WIRE_HEADER.pack(seq & 0xffffffff, time.time_ns(), len(values))]
+    for name, value in values:
+        encoded = name.encode()
+        # struct would cut the name silently
+        if len(encoded) > JS_WIRE_NAME_LEN:
+            raise ValueError(f'Joystick name {name} is longer than '
+                             f'{JS_WIRE_NAME_LEN} bytes')
+        parts.append(entry.pack(encoded, value))
+    return b''.join(parts)
+
+
+def unpack_js_message(entry, message):
+    """ (seq, time_ns, [(name, value), ...]) of a message """
+    seq, time_ns, count = JS_WIRE_HEADER.unpack_from(message)
+    values = [(name.rstrip(b'\0').decode(), value) for name, value
+              in entry.iter_unpack(message[JS_WIRE_HEADER.size:])]
+    return seq, time_ns, values[:count]
+
+
+def js_endpoints(address, port):
+    """
+    Axis and button endpoints of a remote joystick, tcp uses port and
+    port + 1, inproc:// and ipc:// get an .axes and .buttons suffix
+    """
+    if address.startswith('tcp://'):
+        return f'{address}:{port}', f'{address}:{port + 1}'
+    return f'{address}.axes', f'{address}.buttons'
+
+
 class JoyStickPub(object):
     '''
-    Use Zero Message Queue (zmq) to publish the control messages from a local joystick
+    Use Zero Message Queue (zmq) to publish the control messages from a local joystick.
+    The axes go out as one message with the state of all axes whenever any
+    moved (and every heartbeat seconds), on a PUB socket the subscriber
+    conflates, a late message is superseded by the next one anyway. Button
+    presses and releases go on a PUSH socket, they queue until the
+    subscriber took them and are never dropped.
     '''
-    def __init__(self, port = 5556, dev_fn='/dev/input/js1'):
+    def __init__(self, port = 5556, dev_fn='/dev/input/js1', address='tcp://*',
+                 context=None, js=None, heartbeat=.1):
+        '''
+        :param address: tcp://<interface>, inproc://<name> or ipc://<path>
+        :param context: zmq context, inproc needs the one of the subscriber
+        :param js: joystick with poll_all(timeout), default a Joystick on dev_fn
+        '''
         import zmq
         self.dev_fn = dev_fn
-        self.js = PS3JoystickPC(self.dev_fn)
-        self.js.init()
-        context = zmq.Context()
-        self.socket = context.socket(zmq.PUB)
-        self.socket.bind("tcp://*:%d" % port)
+        if js is None:
+            js = Joystick(self.dev_fn)
+            if not js.init():
+                raise Exception(f'No joystick on {self.dev_fn} to publish')
+        self.js = js
+        self.context = context or zmq.Context.instance()
+        axis_endpoint, button_endpoint = js_endpoints(address, port)
+        self.axis_socket = self.context.socket(zmq.PUB)
+        self.axis_socket.setsockopt(zmq.LINGER, 0)
+        self.axis_socket.bind(axis_endpoint)
+        self.button_socket = self.context.socket(zmq.PUSH)
+        self.button_socket.setsockopt(zmq.LINGER, 0)
+        self.button_socket.bind(button_endpoint)
+        self.heartbeat = heartbeat
+        self.axis_states = {}
+        self.axis_seq = 0
+        self.button_seq = 0
+        self.last_send = 0.
+        # button messages not taken yet because no subscriber is connected
+        self.unsent = []
+        self.running = True
 
+    def publish(self, events):
+        ''' Send the (button, button_state, axis, axis_val) events of one poll '''
+        import zmq
+        buttons = []
+        moved = False
+        for button, button_state, axis, axis_val in events:
+            if button:
+                buttons.append((button, button_state))
+            elif axis:
+                self.axis_states[axis] = axis_val
+                moved = True
+        if buttons:
+            self.button_seq += 1
+            self.unsent.append(pack_js_message(self.button_seq, JS_WIRE_BUTTON, buttons))
+        while self.unsent:
+            try:
+                self.button_socket.send(self.unsent[0], zmq.NOBLOCK)
+            except zmq.Again:
+                break
+            self.unsent.pop(0)
+        now = time.monotonic()
+        if moved or now - self.last_send >= self.heartbeat:
+            self.axis_seq += 1
+            self.axis_socket.send(pack_js_message(self.axis_seq, JS_WIRE_AXIS,
+                                                  list(self.axis_states.items())))
+            self.last_send = now
 
     def run(self):
-        while True:
-            button, button_state, axis, axis_val = self.js.poll()
-            if axis is not None or button is not None:
-                if button is None:
-                    button  = "0"
-                    button_state = 0
-                if axis is None:
-                    axis = "0"
-                    axis_val = 0
-                message_data = (button, button_state, axis, axis_val)
-                self.socket.send_string( "%s %d %s %f" % message_data)
-                print("SENT", message_data)
+        while self.running:
+            self.publish(self.js.poll_all(self.heartbeat))
+
+    def shutdown(self):
+        self.running = False
+        self.axis_socket.close()
+        self.button_socket.close()
 
 class JoyStickSub(object):
     '''
-    Use Zero Message Queue (zmq) to subscribe to control messages from a remote joystick
+    Use Zero Message Queue (zmq) to subscribe to control messages from a remote joystick.
+    Only the newest axis message is kept (ZMQ_CONFLATE), every button
+    message is queued, poll_all() returns all button edges and the axes
+    which changed since the last call.
     '''
-    def __init__(self, ip, port = 5556):
+    def __init__(self, ip, port = 5556, address=None, context=None):
+        '''
+        :param address: inproc://<name> or ipc://<path> instead of tcp to ip
+        '''
         import zmq
-        context = zmq.Context()
-        self.socket = context.socket(zmq.SUB)
-        self.socket.connect("tcp://%s:%d" % (ip, port))
-        self.socket.setsockopt_string(zmq.SUBSCRIBE, '')
-        self.button = None
-        self.button_state = 0
-        self.axis = None
-        self.axis_val = 0.0
+        self.context = context or zmq.Context.instance()
+        axis_endpoint, button_endpoint = js_endpoints(address or f'tcp://{ip}', port)
+        self.axis_socket = self.context.socket(zmq.SUB)
+        # conflate has to be set before connecting
+        self.axis_socket.setsockopt(zmq.CONFLATE, 1)
+        self.axis_socket.setsockopt(zmq.LINGER, 0)
+        self.axis_socket.connect(axis_endpoint)
+        self.axis_socket.setsockopt(zmq.SUBSCRIBE, b'')
+        self.button_socket = self.context.socket(zmq.PULL)
+        self.button_socket.setsockopt(zmq.LINGER, 0)
+        self.button_socket.connect(button_endpoint)
+        self.poller = zmq.Poller()
+        self.poller.register(self.axis_socket, zmq.POLLIN)
+        self.poller.register(self.button_socket, zmq.POLLIN)
+        self.lock = Lock()
+        self.axis_states = {}
+        self.reported_axes = {}
+        self.button_edges = []
+        self.pending = []
+        # counters
+        self.axis_messages = 0
+        self.axis_seq = 0
+        self.button_messages = 0
         self.running = True
 
 
@@ -707,30 +934,61 @@ class JoyStickSub(object):
         time.sleep(0.1)
 
 
+    def receive_axes(self, message):
+        seq, time_ns, axes = unpack_js_message(JS_WIRE_AXIS, message)
+        with self.lock:
+            self.axis_states.update(axes)
+            self.axis_seq = seq
+            self.axis_messages += 1
+
+
+    def receive_buttons(self, message):
+        seq, time_ns, buttons = unpack_js_message(JS_WIRE_BUTTON, message)
+        with self.lock:
+            self.button_edges.extend(buttons)
+            self.button_messages += 1
+
+
     def update(self):
+        import zmq
         while self.running:
-            payload = self.socket.recv().decode("utf-8")
-            #print("got", payload)
-            button, button_state, axis, axis_val = payload.split(' ')
-            self.button = button
-            self.button_state = (int)(button_state)
-            self.axis = axis
-            self.axis_val = (float)(axis_val)
-            if self.button == "0":
-                self.button = None
-            if self.axis == "0":
-                self.axis = None
+            ready = dict(self.poller.poll(100))
+            # all queued button messages, then the newest axis message
+            if ready.get(self.button_socket):
+                while True:
+                    try:
+                        self.receive_buttons(self.button_socket.recv(zmq.NOBLOCK))
+                    except zmq.Again:
+                        break
+            if ready.get(self.axis_socket):
+                self.receive_axes(self.axis_socket.recv())
+        self.axis_socket.close()
+        self.button_socket.close()
 
 
     def run_threaded(self):
         pass
 
 
+    def poll_all(self):
+        ''' button edges, then the axes changed since the last call '''
+        with self.lock:
+            events = [(button, button_state, None, None)
+                      for button, button_state in self.button_edges]
+            self.button_edges = []
+            for axis, axis_val in self.axis_states.items():
+                if self.reported_axes.get(axis) != axis_val:
+                    events.append((None, None, axis, axis_val))
+                    self.reported_axes[axis] = axis_val
+        return events
+
+
     def poll(self):
-        ret = (self.button, self.button_state, self.axis, self.axis_val)
-        self.button = None
-        self.axis = None
-        return ret
+        if not self.pending:
+            self.pending = self.poll_all()
+        if self.pending:
+            return self.pending.pop(0)
+        return None, None, None, None
 
 class JoystickCreator(Joystick):
     '''
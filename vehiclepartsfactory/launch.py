@@ -20,6 +20,8 @@ class AiLaunch(factory.Part):
         self.trigger_on_switch = cfg.AI_LAUNCH_KEEP_ENABLED
         
         self.run_part = True
+        self.inputs = ['user/mode', 'pilot/throttle']
+        self.outputs = ['pilot/throttle']
         
 #     def enable_ai_launch(self):
 #         self.enabled = True
@@ -0,0 +1,92 @@
+"""
+Main thread service loop of the vehicle.
+Some work has to run in the main thread, pygame and GUI toolkits only take
+their events there. A part asks for main thread time with mainthread_tasks(),
+(name, callback, hz) tuples, the default being mainthread() at the part's
+mainthread_hz when that is set. The MainThreadScheduler calls every callback
+on its own grid of deadlines (DeadlineTimer, missed deadlines are skipped),
+sleeps until the next deadline due and keeps a histogram of how long each
+callback held the main thread. With no callbacks registered it just sleeps.
+"""
+
+import time
+
+from donkeycar.vehiclepartsfactory.scheduler import DeadlineTimer
+from donkeycar.vehiclepartsfactory.profiling import LatencyHistogram
+
+
+class MainThreadTask(object):
+    def __init__(self, name, callback, hz):
+        self.name = name
+        self.callback = callback
+        self.hz = hz
+        self.timer = DeadlineTimer(1. / hz)
+        self.hold = LatencyHistogram()
+
+
+class MainThreadScheduler(object):
+    def __init__(self, idle_time=1.):
+        """
+        :param idle_time: longest sleep of the loop, e.g. with no callbacks
+        """
+        self.idle_time = idle_time
+        self.tasks = []
+        self.epoch_ns = None
+
+    def register(self, name, callback, hz):
+        """ Call callback() hz times per second in the main thread """
+        if hz <= 0:
+            return
+        task = MainThreadTask(name, callback, hz)
+        if self.epoch_ns is not None:
+            task.timer.start(self.epoch_ns)
+        self.tasks.append(task)
+
+    def register_parts(self, parts):
+        for part in parts:
+            for name, callback, hz in part.mainthread_tasks():
+                self.register(name, callback, hz)
+
+    def start(self, epoch_ns=None):
+        self.epoch_ns = time.monotonic_ns() if epoch_ns is None else epoch_ns
+        for task in self.tasks:
+            task.timer.start(self.epoch_ns)
+
+    def delay(self):
+        """ Seconds until the next callback is due, at most idle_time """
+        if self.epoch_ns is None:
+            self.start()
+        if not self.tasks:
+            return self.idle_time
+        next_ns = min(task.timer.next_ns for task in self.tasks)
+        return min(self.idle_time, max(0., (next_ns - time.monotonic_ns()) / 1e9))
+
+    def service(self):
+        """ Run the callbacks which are due, returns how many ran """
+        if self.epoch_ns is None:
+            self.start()
+        count = 0
+        for task in self.tasks:
+            now = time.monotonic_ns()
+            if now < task.timer.next_ns:
+                continue
+            task.timer.tick(now)
+            task.callback()
+            task.hold.record(time.monotonic_ns() - now)
+            count += 1
+        return count
+
+    def run_once(self):
+        """ Sleep until the next callback is due and run the due ones """
+        time.sleep(self.delay())
+        return self.service()
+
+    def report(self):
+        lines = [f'{"main thread":<24}{"hz":>6}{"count":>8}{"hold ms":>10}'
+                 f'{"p99":>9}{"max":>9}{"skipped":>9}']
+        for task in self.tasks:
+            s = task.hold.summary()
+            lines.append(f'    {task.name:<20}{task.hz:>6.0f}{s["count"]:>8}'
+                         f'{s["mean"]:>10.3f}{s["p99"]:>9.3f}{s["max"]:>9.3f}'
+                         f'{task.timer.skipped:>9}')
+        return '\n'.join(lines)
@@ -0,0 +1,99 @@
+"""
+Loading of the pilot models for AI_Pilot and AI_PilotEngine.
+load_pilot() loads cfg.MODEL_PATH, optionally through a cache of converted
+models, and warms the model up with a few inferences on a zero frame so the
+graph tracing and memory allocation of the first inference happen before the
+car moves. With MODEL_CACHE = 'tflite' a Keras linear model is converted to
+TFLite once and the conversion is kept in MODEL_CACHE_DIR under the hash of
+the model file, later starts load the .tflite directly.
+"""
+
+import os
+import time
+import hashlib
+import logging
+
+import numpy as np
+
+import donkeycar as dk
+
+logger = logging.getLogger(__name__)
+
+# model types with a TFLite counterpart the cache can convert to
+TFLITE_TYPES = {'linear': 'tflite_linear'}
+
+
+def model_hash(path):
+    """ sha256 of a model file or of all files of a SavedModel directory """
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        paths = sorted(os.path.join(root, name)
+                       for root, dirs, names in os.walk(path) for name in names)
+    else:
+        paths = [path]
+    for file_path in paths:
+        with open(file_path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cached_tflite(cfg, model_path):
+    """ Path of the TFLite conversion of model_path, converted if not cached """
+    os.makedirs(cfg.MODEL_CACHE_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(model_path.rstrip('/')))[0]
+    cache_path = os.path.join(cfg.MODEL_CACHE_DIR,
+                              f'{stem}-{model_hash(model_path)[:16]}.tflite')
+    if os.path.exists(cache_path):
+        logger.info(f'Using cached TFLite model {cache_path}')
+        return cache_path
+    from donkeycar.parts.interpreter import keras_model_to_tflite
+    start = time.monotonic()
+    # convert into a temporary file, a half written model is never cached
+    keras_model_to_tflite(model_path, cache_path + '.tmp')
+    os.replace(cache_path + '.tmp', cache_path)
+    logger.info(f'Converted {model_path} to {cache_path} in '
+                f'{time.monotonic() - start:.1f} s')
+    return cache_path
+
+
+def warm_up(kl, cfg, runs):
+    """ Run the model runs times on a zero frame, returns the times in ms """
+    frame = np.zeros((cfg.IMAGE_H, cfg.IMAGE_W, cfg.IMAGE_DEPTH), dtype=np.uint8)
+    times = []
+    for _ in range(runs):
+        start = time.monotonic_ns()
+        kl.run(frame)
+        times.append((time.monotonic_ns() - start) / 1e6)
+    if times:
+        print(f'Model warm up: {runs} runs in {sum(times):.0f} ms, first '
+              f'{times[0]:.1f} ms, last {times[-1]:.1f} ms')
+    return times
+
+
+def load_pilot(cfg):
+    """ Load cfg.MODEL_PATH (through the model cache) and warm it up """
+    start = time.monotonic()
+    model_type = cfg.DEFAULT_MODEL_TYPE
+    model_path = cfg.MODEL_PATH
+    if cfg.MODEL_CACHE == 'tflite':
+        if model_type in TFLITE_TYPES:
+            try:
+                model_path = cached_tflite(cfg, model_path)
+                model_type = TFLITE_TYPES[model_type]
+            except ImportError:
+                # a missing converter is a broken install, not a bad model
+                raise
+            except Exception as e:
+                logger.error(f'TFLite conversion of {model_path} failed, '
+                             f'loading the Keras model: {e}')
+        else:
+            logger.warning(f'No TFLite conversion for model type {model_type}')
+    elif cfg.MODEL_CACHE:
+        logger.error(f'Unknown MODEL_CACHE {cfg.MODEL_CACHE}, use tflite|None')
+        raise Exception()
+    kl = dk.utils.get_model_by_type(model_type, cfg)
+    kl.load(model_path)
+    print(f'Loaded {model_type} model {model_path} in {time.monotonic() - start:.1f} s')
+    warm_up(kl, cfg, cfg.AI_PILOT_WARMUP_RUNS)
+    return kl
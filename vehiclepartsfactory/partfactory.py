@@ -8,8 +8,15 @@ creation functions of classes derived from a base class Creatable.
 
 
 import time
+import traceback
 from threading import Thread
+from threading import current_thread
 from threading import Lock
+from threading import Event
+
+from donkeycar.vehiclepartsfactory.scheduler import DeadlineTimer
+from donkeycar.vehiclepartsfactory.profiling import PartProfile
+from donkeycar.vehiclepartsfactory.tracing import tracer
 
 class PartFactory(type):
     """
@@ -29,6 +36,18 @@ class Part(object, metaclass=PartFactory):
     Base class for factory creatable objects, implementing create()
     Part base class, provides asynchronous threads with individual loop
         frequencies """
+    # operate() blocks (inference, I/O), the asyncio runtime runs it in an
+    # executor thread
+    blocking = False
+    # bus keys read and written by the part, used by the dataflow analysis.
+    # A sink acts on the world (disk, actuators) even if its outputs are
+    # never read
+    inputs = []
+    outputs = []
+    sink = False
+    # rate of mainthread() in the vehicle's main thread, 0 for no main
+    # thread work, see mainthread.py
+    mainthread_hz = 0
 
     @classmethod
     def create(cls, kwargs):
@@ -37,43 +56,111 @@ class Part(object, metaclass=PartFactory):
     def __init__(self, loop_time):
         self.data_bus = None
         self.loop_time = loop_time
-        self.t = Thread(target=self.update, args=())
+        self.t = Thread(target=self.update, args=(), name=type(self).__name__)
         self.t.daemon = True
         self.lock = Lock()
         self.on = False
-        self.last_time = time.time()
         self.loop_count = 0
-        self.time_diff_total = 0.
+        self.first_ns = self.last_ns = 0
+        # loop deadlines on time.monotonic_ns(), see set_schedule()
+        self.timer = DeadlineTimer(loop_time)
+        self.epoch_ns = None
+        # phase latency histograms, see profiling.py
+        self.profile = PartProfile(type(self).__name__)
+        self.profile.timer = self.timer
         print('Created part', type(self).__name__, 'with loop time', self.loop_time)
         self.run_part = False
+        # subscription mode: run only when one of the trigger keys is written
+        self.trigger_keys = None
+        self.min_trigger_time = 0.
+        self.trigger = Event()
+
+    def subscribe(self, trigger_keys, max_rate_hz=None):
+        """
+        Run the part whenever one of trigger_keys is written to the data bus
+        instead of every loop_time, at most max_rate_hz times per second
+        """
+        self.trigger_keys = list(trigger_keys)
+        self.min_trigger_time = 1. / max_rate_hz if max_rate_hz else 0.
+
+    def set_schedule(self, offset=0., policy='skip', spin=0., tolerance=0.001):
+        """
+        Set the phase of the loop deadlines relative to the vehicle start and
+        what to do after an overrun, see DeadlineTimer
+        """
+        self.timer = DeadlineTimer(self.loop_time, offset=offset, policy=policy,
+                                   spin=spin, tolerance=tolerance)
+        self.profile.timer = self.timer
+
+    def step(self):
+        """ One pass of the part: read the inputs, operate, write the outputs """
+        profile = self.profile
+        start = time.monotonic_ns()
+        # lock share resource
+        with self.lock:
+            locked = time.monotonic_ns()
+            self.read_from_bus()
+        end = time.monotonic_ns()
+        profile.record('lock_wait', locked - start)
+        profile.record('read', end - locked)
+        if tracer.enabled:
+            tracer.span(profile.name + ' read', 'part', locked, end)
+        if self.run_part:
+            self.operate()
+            start = time.monotonic_ns()
+            profile.record('operate', start - end)
+            # lock shared resource, publish all outputs of this loop
+            # together
+            with self.lock, self.data_bus.write_section():
+                locked = time.monotonic_ns()
+                self.write_to_bus()
+            written = time.monotonic_ns()
+            profile.record('lock_wait', locked - start)
+            profile.record('write', written - locked)
+            if tracer.enabled:
+                tracer.span(profile.name + ' operate', 'part', end, start)
+                tracer.span(profile.name + ' write', 'part', locked, written)
+#                 print(f'{self.__class__.__name__}: ', end ='')
+#                 self.data_bus.dump()
 
     def update(self):
         """ Only needs to be implemented here """
         assert self.data_bus, "Need to set data bus first"
+        if self.trigger_keys:
+            self.data_bus.subscribe(self.trigger_keys, self.trigger)
+        self.timer.start(self.epoch_ns)
+        min_trigger_ns = int(self.min_trigger_time * 1e9)
         self.on = True
+        sleep_start = time.monotonic_ns()
         while self.on:
 
-            # lock share resource
-            with self.lock:
-                self.read_from_bus()
-            if self.run_part:
-                self.operate()
-                # lock shared resource
-                with self.lock:
-                    self.write_to_bus()
-#                     print(f'{self.__class__.__name__}: ', end ='')
-#                     self.data_bus.dump()
-                        
-            now = time.time()
-            time_diff = now - self.last_time
-            # mechanically delay loop to match expected loop time - this is
-            # not exact but approximate
-            if time_diff < self.loop_time:
-                time.sleep(self.loop_time - time_diff)
-            now = time.time()
-            self.time_diff_total += now - self.last_time
-            self.last_time = now
-            self.loop_count += 1
+            if self.trigger_keys:
+                # sleep until an input changed, wake up regularly to check
+                # whether the part has been stopped
+                if not self.trigger.wait(timeout=.1):
+                    continue
+                # triggered parts are only held back by their max rate
+                hold = self.last_ns + min_trigger_ns - time.monotonic_ns()
+                if self.loop_count and hold > 0:
+                    time.sleep(hold / 1e9)
+                self.trigger.clear()
+            else:
+                # sleep until the next absolute deadline
+                self.timer.wait()
+                if not self.on:
+                    break
+            self.profile.record('sleep', time.monotonic_ns() - sleep_start)
+
+            self.count_loop()
+            self.step()
+            sleep_start = time.monotonic_ns()
+
+    def count_loop(self):
+        now = time.monotonic_ns()
+        if self.loop_count == 0:
+            self.first_ns = now
+        self.last_ns = now
+        self.loop_count += 1
 
     def read_from_bus(self):
         pass
@@ -88,8 +175,16 @@ class Part(object, metaclass=PartFactory):
         # process that is called by vehicle main ; where statements need to be executed outside of thread
         pass
 
-    def start(self):
+    def mainthread_tasks(self):
+        """ (name, callback, hz) of the main thread work of the part """
+        if not self.mainthread_hz:
+            return []
+        return [(type(self).__name__, self.mainthread, self.mainthread_hz)]
+
+    def start(self, epoch_ns=None):
 #         print (f'{self.__class__.__name__} starting...')        
+        # parts started with the same epoch keep their relative phases
+        self.epoch_ns = epoch_ns
         self.t.start()
 
     def set_data_bus(self, data_bus):
@@ -97,8 +192,72 @@ class Part(object, metaclass=PartFactory):
 
     def stop(self):
         self.on = False
+        if self.trigger_keys:
+            self.data_bus.unsubscribe(self.trigger)
+            self.trigger.set()
+        # let a running step finish, the vehicle closes the data bus after
+        # the parts are stopped. Not started for group members and the
+        # asyncio runtime
+        if self.t.is_alive() and self.t is not current_thread():
+            self.t.join(timeout=self.loop_time + 1.)
+            if self.t.is_alive():
+                print('Part', type(self).__name__, 'did not stop its loop')
         # just check how exact the timing was
-        print('Stopped part', type(self).__name__, 'with avg loop time',
-              self.time_diff_total / self.loop_count)
+        avg_loop_time = (self.last_ns - self.first_ns) / max(1, self.loop_count - 1) / 1e9
+        print('Stopped part', type(self).__name__, 'with avg loop time', avg_loop_time)
+        # phase latencies and the timer statistics
+        print(self.profile.report())
+
+
+class PartGroup(Part):
+    """
+    Cooperative executor for light parts. The member parts run back to back,
+    in the given order, in the single thread of the group instead of each
+    having its own thread and sleep. Members still take their own lock,
+    uncontended it costs little. The group loops at the rate of its fastest
+    member, a slower member only runs on the loops where its own deadline
+    is due, so every member keeps its rate. Members can not have triggers.
+    """
+    def __init__(self, name, parts):
+        super().__init__(loop_time = min(part.loop_time for part in parts))
+        self.name = name
+        self.parts = parts
+        self.run_part = True
+        print('    members', ', '.join(type(part).__name__ for part in parts))
+
+    def set_data_bus(self, data_bus):
+        super().set_data_bus(data_bus)
+        for part in self.parts:
+            part.set_data_bus(data_bus)
+
+    def step(self):
+        now = time.monotonic_ns()
+        for part in list(self.parts):
+            timer = part.timer
+            if timer.next_ns is None:
+                timer.start(self.epoch_ns)
+            if now < timer.next_ns:
+                continue
+            timer.tick(now)
+            part.count_loop()
+            try:
+                part.step()
+            except Exception:
+                # like a part thread dying, only the failing member stops
+                traceback.print_exc()
+                print('Removed part', type(part).__name__, 'from group', self.name)
+                self.parts.remove(part)
+
+    def mainthread(self):
+        for part in self.parts:
+            part.mainthread()
+
+    def mainthread_tasks(self):
+        return [task for part in self.parts for task in part.mainthread_tasks()]
+
+    def stop(self):
+        super().stop()
+        for part in self.parts:
+            part.stop()
 
 
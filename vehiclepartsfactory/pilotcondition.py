@@ -3,11 +3,12 @@ import donkeycar.vehiclepartsfactory.partfactory as factory
 class PilotCondition(factory.Part):
     def __init__(self, cfg):   
         super().__init__(loop_time = 1/cfg.DRIVE_LOOP_HZ)
-#         # vehicle parameters       
-#         self.inputs = ['user/mode']
-#         self.outputs = ['run_pilot']
+        # vehicle parameters       
+        self.inputs = ['user/mode']
+        self.outputs = ['run_pilot']
 #         self.run_condition = None
         self.run_part = True
+        self.run_pilot = None   # nothing is written until the mode is known
 
 #     def run(self, mode):
 #         return False if mode == 'user' else True
@@ -0,0 +1,103 @@
+"""
+Run a factory part in its own process.
+A ProcessPart stands in for the part inside the vehicle. The real part is
+created in a spawned child process, which attaches to the vehicle's
+SharedMemoryDataBus and runs the usual part thread there. This keeps heavy
+parts (keras inference, jpeg encoding, the gym) off the GIL of the control
+loop.
+"""
+
+import os
+import signal
+import importlib
+import logging
+
+import donkeycar.vehiclepartsfactory.partfactory as factory
+from donkeycar.vehiclepartsfactory.databus import SharedMemoryDataBus, mp_context
+from donkeycar.vehiclepartsfactory.mainthread import MainThreadScheduler
+from donkeycar.vehiclepartsfactory.tracing import tracer, start_tracing
+
+logger = logging.getLogger(__name__)
+
+
+def run_part_process(mod_name, class_name, cfg, connection, stop_event,
+                     schedule, epoch_ns):
+    """ Entry point of the child process """
+    # the vehicle handles ctrl-c and tells us to stop through stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cfg.TRACE_PATH:
+        # trace.json -> trace.AI_Pilot.json, one trace per process
+        root, ext = os.path.splitext(cfg.TRACE_PATH)
+        start_tracing(cfg, f'{root}.{class_name}{ext}')
+    importlib.import_module(mod_name)
+    part = factory.PartFactory.make(class_name, {'cfg': cfg})
+    data_bus = SharedMemoryDataBus.attach(connection)
+    part.set_data_bus(data_bus)
+    part.set_schedule(**schedule)
+    # time.monotonic_ns() is system wide, the epoch is valid in the child
+    part.start(epoch_ns)
+    # the main thread of the child serves the part's main thread work
+    # (pygame events are pumped there)
+    mainthread = MainThreadScheduler()
+    mainthread.register_parts([part])
+    mainthread.start(epoch_ns)
+    try:
+        while not stop_event.wait(mainthread.delay()):
+            mainthread.service()
+    finally:
+        part.stop()
+        if mainthread.tasks:
+            print(mainthread.report())
+        data_bus.close()
+        if tracer.enabled:
+            tracer.write()
+
+
+class ProcessPart(object):
+    """
+    Vehicle side proxy of a part running in a child process
+    """
+    def __init__(self, mod_name, class_name, cfg):
+        self.mod_name = mod_name
+        self.class_name = class_name
+        self.cfg = cfg
+        self.data_bus = None
+        self.process = None
+        self.stop_event = mp_context.Event()
+        self.schedule = {}
+
+    def set_data_bus(self, data_bus):
+        assert isinstance(data_bus, SharedMemoryDataBus), \
+            f'{self.class_name} runs in its own process and needs ' \
+            f'DATABUS_TYPE = "shared"'
+        self.data_bus = data_bus
+
+    def set_schedule(self, **schedule):
+        # applied to the part once it is created in the child
+        self.schedule = schedule
+
+    def start(self, epoch_ns=None):
+        assert self.data_bus, "Need to set data bus first"
+        self.process = mp_context.Process(
+            target=run_part_process, name=self.class_name, daemon=True,
+            args=(self.mod_name, self.class_name, self.cfg,
+                  self.data_bus.connection(), self.stop_event,
+                  self.schedule, epoch_ns))
+        self.process.start()
+        logger.info(f'{self.class_name} started in process {self.process.pid}')
+
+    def mainthread(self):
+        # main thread work is done in the child process
+        pass
+
+    def mainthread_tasks(self):
+        return []
+
+    def stop(self):
+        self.stop_event.set()
+        if self.process is not None:
+            self.process.join(timeout=5.)
+            if self.process.is_alive():
+                logger.warning(f'{self.class_name} did not stop, terminating')
+                self.process.terminate()
+        print('Stopped process part', self.class_name)
@@ -0,0 +1,204 @@
+"""
+Always-on latency profiling of factory parts.
+Every Part keeps a PartProfile with HDR style histograms of the time spent in
+read_from_bus, operate, write_to_bus, sleeping until the next loop and
+waiting for the part lock and the bus write section. Recording a value is a
+couple of integer operations, cheap enough to leave on while driving.
+The profiles are printed when a part stops and can be read live from a
+ProfileServer, over HTTP on localhost or over a Unix socket:
+    curl localhost:8887/
+    curl --unix-socket /tmp/donkey-profile.sock http://car/text
+Parts running in their own process (ProcessPart) print their profile when
+the child process stops, they are not served by the vehicle.
+"""
+
+import os
+import json
+import socket
+import logging
+from threading import Thread
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyHistogram(object):
+    """
+    Log-linear histogram of nanosecond values, like HdrHistogram. Every power
+    of two is split into 2**SUB_BITS buckets, so a value is known to within
+    1 / 2**SUB_BITS (3 %) whatever its magnitude.
+    """
+    SUB_BITS = 5
+    SUB_COUNT = 1 << SUB_BITS
+    # 2**45 ns is about 10 hours, anything longer lands in the last bucket
+    MAX_EXPONENT = 45
+
+    def __init__(self):
+        self.counts = [0] * ((self.MAX_EXPONENT + 1) * self.SUB_COUNT)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def bucket(self, value):
+        if value < self.SUB_COUNT:
+            return max(0, value)
+        # shift value into [SUB_COUNT, 2 * SUB_COUNT)
+        shift = value.bit_length() - self.SUB_BITS - 1
+        return (shift + 1) * self.SUB_COUNT + (value >> shift) - self.SUB_COUNT
+
+    def bucket_limit(self, index):
+        """ Largest value falling into bucket index """
+        exponent, sub = divmod(index, self.SUB_COUNT)
+        if exponent == 0:
+            return sub
+        return ((sub + self.SUB_COUNT + 1) << (exponent - 1)) - 1
+
+    def record(self, value):
+        self.counts[min(self.bucket(value), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """ Value below which a fraction p of the recorded values are """
+        if not self.count:
+            return 0
+        rank = max(1, int(p * self.count + 0.5))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.bucket_limit(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def summary(self):
+        """ Count and statistics in milliseconds """
+        return {'count': self.count,
+                'mean': self.mean() / 1e6,
+                'p50': self.percentile(.5) / 1e6,
+                'p99': self.percentile(.99) / 1e6,
+                'p999': self.percentile(.999) / 1e6,
+                'max': self.max / 1e6}
+
+
+class PartProfile(object):
+    PHASES = ('read', 'operate', 'write', 'sleep', 'lock_wait')
+
+    def __init__(self, name):
+        self.name = name
+        self.histograms = {phase: LatencyHistogram() for phase in self.PHASES}
+        self.timer = None
+
+    def record(self, phase, value):
+        self.histograms[phase].record(value)
+
+    def summary(self):
+        summary = {phase: histogram.summary()
+                   for phase, histogram in self.histograms.items()}
+        if self.timer is not None:
+            summary['timer'] = {'ticks': self.timer.ticks,
+                                'late_starts': self.timer.late_starts,
+                                'overruns': self.timer.overruns,
+                                'skipped': self.timer.skipped,
+                                'max_lateness': self.timer.max_lateness_ns / 1e6}
+        return summary
+
+    def report(self, name=None):
+        lines = [f'{name or self.name:<24}{"count":>8}{"mean ms":>10}{"p50":>9}'
+                 f'{"p99":>9}{"p999":>9}{"max":>9}']
+        for phase, histogram in self.histograms.items():
+            if not histogram.count:
+                continue
+            s = histogram.summary()
+            lines.append(f'    {phase:<20}{s["count"]:>8}{s["mean"]:>10.3f}'
+                         f'{s["p50"]:>9.3f}{s["p99"]:>9.3f}{s["p999"]:>9.3f}'
+                         f'{s["max"]:>9.3f}')
+        if self.timer is not None and self.timer.ticks:
+            lines.append('    ' + self.timer.report())
+        return '\n'.join(lines)
+
+
+def part_profiles(parts):
+    """ Profiles of the parts and group members, by unique part name """
+    profiles = {}
+    for part in parts:
+        for member in getattr(part, 'parts', [part]):
+            profile = getattr(member, 'profile', None)
+            if profile is None:
+                continue
+            name, n = profile.name, 1
+            while name in profiles:
+                n += 1
+                name = f'{profile.name}#{n}'
+            profiles[name] = profile
+    return profiles
+
+
+class ProfileRequestHandler(BaseHTTPRequestHandler):
+    """ GET / returns the profiles as json, GET /text as a table """
+    def do_GET(self):
+        profiles = part_profiles(self.server.parts)
+        if self.path.rstrip('/') == '/text':
+            body = '\n'.join(p.report(name) for name, p in profiles.items()).encode()
+            content_type = 'text/plain'
+        else:
+            body = json.dumps({name: p.summary() for name, p in profiles.items()},
+                              indent=1).encode()
+            content_type = 'application/json'
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # don't print a line per request on the car's console
+        pass
+
+
+class UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        self.socket.bind(self.server_address)
+        self.server_name, self.server_port = 'localhost', 0
+
+    def get_request(self):
+        request, _ = self.socket.accept()
+        # unix sockets have no client address, the handler wants one
+        return request, ('unix', 0)
+
+
+class ProfileServer(object):
+    def __init__(self, parts, port=None, socket_path=None):
+        """
+        :param parts: parts of the vehicle, may change while serving
+        :param port: serve on localhost:port
+        :param socket_path: serve on this Unix socket instead
+        """
+        if socket_path:
+            self.server = UnixHTTPServer(socket_path, ProfileRequestHandler)
+            self.address = socket_path
+        else:
+            self.server = ThreadingHTTPServer(('127.0.0.1', port), ProfileRequestHandler)
+            self.address = f'http://127.0.0.1:{self.server.server_port}/'
+        self.server.parts = parts
+        self.socket_path = socket_path
+        self.t = Thread(target=self.server.serve_forever, name='profile-server')
+        self.t.daemon = True
+
+    def start(self):
+        self.t.start()
+        logger.info(f'Part profiles served on {self.address}')
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
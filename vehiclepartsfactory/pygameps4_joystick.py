@@ -62,6 +62,8 @@ class PyGamePS4JoystickController(JoystickController):
                             drive_loop_hz = cfg.DRIVE_LOOP_HZ)
                                                     
         self.set_deadzone(cfg.JOYSTICK_DEADZONE)
+        # pygame only updates the joystick state when its events are pumped
+        self.mainthread_hz = cfg.MAINTHREAD_PYGAME_HZ
         
         self.which_js = 0
 #         self.which_js=which_js
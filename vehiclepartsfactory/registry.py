@@ -0,0 +1,202 @@
+"""
+Manifest of the part classes and timing of their imports.
+PartManifest maps the class names of the part packages (vehicleparts and
+vehiclepartsfactory) to their modules by parsing the sources with ast, no
+module is imported. The manifest is cached as json and rebuilt when a source
+file changes. driver.py and vehicle.py check parts.yml against it before any
+part module is imported, so a wrong class name fails at once instead of after
+TensorFlow and gym have been loaded.
+ImportTimer times every module executed while it is installed, like
+python -X importtime, and tells the import cost of each part by package.
+"""
+
+import os
+import ast
+import sys
+import json
+import time
+import difflib
+import logging
+import threading
+import importlib.util
+
+logger = logging.getLogger(__name__)
+
+PART_PACKAGES = ('donkeycar.vehicleparts', 'donkeycar.vehiclepartsfactory')
+
+
+class PartManifest(object):
+    def __init__(self, path=None, packages=PART_PACKAGES):
+        """
+        :param path: json cache of the manifest, None to scan every time
+        """
+        self.path = path
+        self.packages = packages
+        self.modules = {}       # module: class names
+        self.signature = {}     # source file: [mtime_ns, size]
+        self.load()
+
+    def _sources(self):
+        """ Source files of the part packages by module name """
+        sources = {}
+        for package in self.packages:
+            spec = importlib.util.find_spec(package)
+            if spec is None or not spec.submodule_search_locations:
+                continue
+            for directory in spec.submodule_search_locations:
+                for name in sorted(os.listdir(directory)):
+                    if name.endswith('.py') and name != '__init__.py':
+                        sources[f'{package}.{name[:-3]}'] = os.path.join(directory, name)
+        return sources
+
+    @staticmethod
+    def _stat(path):
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def load(self):
+        sources = self._sources()
+        signature = {path: self._stat(path) for path in sources.values()}
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as file:
+                cached = json.load(file)
+            if cached.get('signature') == signature:
+                self.modules = cached['modules']
+                self.signature = signature
+                return
+        start = time.monotonic()
+        self.modules = {mod_name: self.scan(path) for mod_name, path in sources.items()}
+        self.signature = signature
+        logger.info(f'Part manifest of {len(self.modules)} modules built in '
+                    f'{(time.monotonic() - start) * 1000:.0f} ms')
+        if self.path:
+            # only written when a source changed, a failed write just means
+            # scanning again next time
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                with open(self.path + '.tmp', 'w') as file:
+                    json.dump({'signature': signature, 'modules': self.modules}, file)
+                os.replace(self.path + '.tmp', self.path)
+            except OSError as e:
+                logger.warning(f'Part manifest not cached in {self.path}: {e}')
+
+    @staticmethod
+    def scan(path):
+        """ Class names defined at the top level of a source file """
+        with open(path) as file:
+            tree = ast.parse(file.read(), path)
+        return [node.name for node in tree.body if isinstance(node, ast.ClassDef)]
+
+    def modules_of(self, class_name):
+        return [mod_name for mod_name, classes in self.modules.items()
+                if class_name in classes]
+
+    def check(self, mod_name, class_name):
+        """ Raise if class_name can not be created from mod_name """
+        classes = self.modules.get(mod_name)
+        if classes is None:
+            if any(mod_name.startswith(package + '.') for package in self.packages):
+                message = f'No part module {mod_name}'
+            elif importlib.util.find_spec(mod_name) is None:
+                message = f'Module {mod_name} not found'
+            else:
+                # a module outside the part packages, checked on import
+                return
+        elif class_name in classes:
+            return
+        else:
+            message = f'No class {class_name} in {mod_name}'
+            close = difflib.get_close_matches(class_name, classes, n=1)
+            if close:
+                message += f', did you mean {close[0]}?'
+        others = self.modules_of(class_name)
+        if others:
+            message += f' ({class_name} is in {", ".join(others)})'
+        logger.error(message)
+        raise Exception(message)
+
+
+class ImportTimer(object):
+    """
+    Meta path finder timing the execution of the modules imported while it
+    is installed. The times are kept per thread, take() returns and clears
+    the (module, self ns, cumulative ns) of the calling thread. The loaders
+    get a timing exec_module while installed, remove() takes it off again.
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.installed = False
+        self.patched = []
+        self.patch_lock = threading.Lock()
+
+    def install(self):
+        sys.meta_path.insert(0, self)
+        self.installed = True
+
+    def remove(self):
+        self.installed = False
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+        with self.patch_lock:
+            for loader in self.patched:
+                # back to the exec_module of the loader class
+                loader.__dict__.pop('exec_module', None)
+            self.patched = []
+
+    def find_spec(self, name, path, target=None):
+        if getattr(self.local, 'finding', False):
+            return None
+        # let the other finders find the module, then time its loader
+        self.local.finding = True
+        try:
+            spec = None
+            for finder in sys.meta_path:
+                if finder is not self and hasattr(finder, 'find_spec'):
+                    spec = finder.find_spec(name, path, target)
+                    if spec is not None:
+                        break
+        finally:
+            self.local.finding = False
+        loader = spec.loader if spec is not None else None
+        exec_module = getattr(loader, 'exec_module', None)
+        # builtin and frozen modules have classes as loaders, not worth timing
+        if exec_module is None or isinstance(loader, type) \
+                or getattr(exec_module, 'timed', False):
+            return spec
+        with self.patch_lock:
+            if not self.installed:
+                return spec
+            try:
+                loader.exec_module = self._timed(name, exec_module)
+            except AttributeError:
+                return spec
+            self.patched.append(loader)
+        return spec
+
+    def _timed(self, name, exec_module):
+        def timed_exec_module(module):
+            if not self.installed:
+                return exec_module(module)
+            local = self.local.__dict__
+            stack = local.setdefault('stack', [])
+            stack.append(0)
+            start = time.perf_counter_ns()
+            try:
+                exec_module(module)
+            finally:
+                total = time.perf_counter_ns() - start
+                children = stack.pop()
+                if stack:
+                    stack[-1] += total
+                local.setdefault('records', []).append((name, total - children, total))
+        timed_exec_module.timed = True
+        return timed_exec_module
+
+    def take(self):
+        return self.local.__dict__.pop('records', [])
+
+
+def heaviest_packages(records, count):
+    """ Top level packages with the longest cumulative import time, in s """
+    packages = [(name, total / 1e9) for name, _, total in records if '.' not in name]
+    return sorted(packages, key=lambda package: -package[1])[:count]
@@ -0,0 +1,104 @@
+"""
+Drift free loop timing for parts.
+A DeadlineTimer wakes a loop on absolute deadlines epoch + offset + n * period
+of time.monotonic_ns(), so time spent in the loop body does not accumulate
+as drift and wall clock jumps have no effect. What happens after the body
+overran one or more deadlines is set by the overrun policy:
+    skip     - drop the missed deadlines and continue on the original grid
+    catchup  - run the missed deadlines back to back until on schedule again
+    shift    - restart the grid at the late start, i.e. shift the phase
+"""
+
+import time
+
+
+class DeadlineTimer(object):
+    POLICIES = ('skip', 'catchup', 'shift')
+
+    def __init__(self, period, offset=0., policy='skip', spin=0.,
+                 tolerance=0.001):
+        """
+        :param period: loop period in seconds
+        :param offset: phase of the deadlines relative to the epoch in seconds
+        :param policy: overrun policy, skip|catchup|shift
+        :param spin: sleep until this close to the deadline and yield-spin
+                     for the rest, 0 to only sleep
+        :param tolerance: a start later than this after the deadline counts
+                          as a late start
+        """
+        assert policy in self.POLICIES, \
+            f'Unknown overrun policy {policy}, use {"|".join(self.POLICIES)}'
+        self.period_ns = int(period * 1e9)
+        self.offset_ns = int(offset * 1e9)
+        self.policy = policy
+        self.spin_ns = int(spin * 1e9)
+        self.tolerance_ns = int(tolerance * 1e9)
+        self.next_ns = None
+        self.first_ns = None
+        self.last_ns = None
+        self.ticks = 0
+        self.late_starts = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.max_lateness_ns = 0
+
+    def start(self, epoch_ns=None):
+        """ Set the first deadline, parts started with the same epoch keep their phases """
+        if epoch_ns is None:
+            epoch_ns = time.monotonic_ns()
+        self.next_ns = epoch_ns + self.offset_ns
+
+    def wait(self):
+        """ Sleep until the next deadline and schedule the one after """
+        if self.next_ns is None:
+            self.start()
+        deadline = self.next_ns
+        remaining = deadline - time.monotonic_ns()
+        if remaining > self.spin_ns:
+            time.sleep((remaining - self.spin_ns) / 1e9)
+        while time.monotonic_ns() < deadline:
+            # yield the GIL while spinning, other parts still need it
+            time.sleep(0)
+        return self.tick(time.monotonic_ns(), remaining < -self.tolerance_ns)
+
+    def tick(self, now, overrun=False):
+        """
+        Account for a loop started at now (monotonic ns) and schedule the
+        next deadline, for loops which do their own waiting (asyncio)
+        """
+        deadline = self.next_ns
+        if overrun and self.ticks > 0:
+            # the previous loop body ran past this deadline
+            self.overruns += 1
+        lateness = now - deadline
+        if lateness > self.tolerance_ns:
+            self.late_starts += 1
+        self.max_lateness_ns = max(self.max_lateness_ns, lateness)
+
+        next_ns = deadline + self.period_ns
+        if next_ns <= now:
+            if self.policy == 'skip':
+                missed = (now - next_ns) // self.period_ns + 1
+                self.skipped += missed
+                next_ns += missed * self.period_ns
+            elif self.policy == 'shift':
+                next_ns = now + self.period_ns
+            # catchup: keep the missed deadline, the next wait returns at once
+        self.next_ns = next_ns
+
+        if self.first_ns is None:
+            self.first_ns = now
+        self.last_ns = now
+        self.ticks += 1
+        return lateness
+
+    def average_period(self):
+        """ Average time between loop starts in seconds """
+        if self.ticks < 2:
+            return 0.
+        return (self.last_ns - self.first_ns) / (self.ticks - 1) / 1e9
+
+    def report(self):
+        return f'late starts {self.late_starts}, overruns {self.overruns}, ' \
+               f'skipped {self.skipped}, max lateness ' \
+               f'{self.max_lateness_ns / 1e6:.2f} ms'
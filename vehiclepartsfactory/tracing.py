@@ -0,0 +1,124 @@
+"""
+Timeline tracing of a driving session.
+When enabled, the parts record a span for every read_from_bus, operate and
+write_to_bus and the data bus records every write with its key, into a
+bounded in-memory ring. The ring is written as Chrome Trace Event JSON when
+the vehicle stops or when the process gets SIGUSR1, open it in
+chrome://tracing or https://ui.perfetto.dev to follow a camera frame through
+AI_Pilot, AiLaunch and DriveMode to the actuator on one timeline.
+Time stamps are time.monotonic_ns(), which is system wide, so the traces of
+parts running in their own process line up with the vehicle's trace.
+"""
+
+import os
+import json
+import time
+import signal
+import logging
+import threading
+import collections
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer(object):
+    def __init__(self):
+        self.enabled = False
+        self.events = collections.deque()
+        self.thread_names = {}
+        self.path = None
+
+    def start(self, path, capacity=200000):
+        """ Record up to capacity events, the oldest are dropped first """
+        self.events = collections.deque(maxlen=capacity)
+        self.path = path
+        self.enabled = True
+
+    def _tid(self):
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            self.thread_names[tid] = threading.current_thread().name
+        return tid
+
+    def span(self, name, category, start_ns, end_ns, args=None):
+        """ Record a complete event from start_ns to end_ns (monotonic) """
+        # deque.append is atomic, no lock needed
+        self.events.append(('X', name, category, start_ns, end_ns - start_ns,
+                            self._tid(), args))
+
+    def instant(self, name, category, time_ns, args=None):
+        self.events.append(('i', name, category, time_ns, 0, self._tid(), args))
+
+    def trace_events(self):
+        pid = os.getpid()
+        events = [{'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': tid,
+                   'args': {'name': name}}
+                  for tid, name in list(self.thread_names.items())]
+        for phase, name, category, time_ns, duration_ns, tid, args in list(self.events):
+            event = {'ph': phase, 'name': name, 'cat': category, 'pid': pid,
+                     'tid': tid, 'ts': time_ns / 1000.}
+            if phase == 'X':
+                event['dur'] = duration_ns / 1000.
+            else:
+                event['s'] = 't'    # instant on the thread's track
+            if args:
+                event['args'] = args
+            events.append(event)
+        return events
+
+    def write(self, path=None):
+        """ Write the recorded events as Chrome Trace Event JSON """
+        path = path or self.path
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': self.trace_events(),
+                       'displayTimeUnit': 'ms'}, file)
+        logger.info(f'{len(self.events)} trace events written to {path}')
+
+    def flush_on_signal(self, signum=signal.SIGUSR1):
+        """ Write the trace whenever the process gets signum """
+        signal.signal(signum, lambda *args: self.write())
+
+
+# one tracer per process, shared by the parts and the data bus
+tracer = Tracer()
+
+
+def start_tracing(cfg, path=None):
+    """ Start the tracer if cfg.TRACE_PATH is set, returns whether it runs """
+    if not cfg.TRACE_PATH:
+        return False
+    tracer.start(path or cfg.TRACE_PATH, cfg.TRACE_CAPACITY)
+    if threading.current_thread() is threading.main_thread():
+        tracer.flush_on_signal()
+    logger.info(f'Tracing to {tracer.path}, kill -USR1 {os.getpid()} writes it')
+    return True
+
+
+class TracedPart(object):
+    """
+    Wrapper for a Method 1 part (driver.py) recording a span for every run
+    and the keys of its outputs
+    """
+    def __init__(self, part):
+        self.part = part
+        self.name = type(part).__name__
+
+    def __getattr__(self, attr):
+        # inputs, outputs, threaded, update, shutdown, ... of the part
+        return getattr(self.part, attr)
+
+    def _traced(self, method, args):
+        start = time.monotonic_ns()
+        result = method(*args)
+        end = time.monotonic_ns()
+        tracer.span(self.name + ' run', 'part', start, end)
+        # the vehicle writes the outputs to its memory right after the run
+        for key in self.part.outputs:
+            tracer.instant(key, 'bus', end)
+        return result
+
+    def run(self, *args):
+        return self._traced(self.part.run, args)
+
+    def run_threaded(self, *args):
+        return self._traced(self.part.run_threaded, args)
@@ -0,0 +1,369 @@
+"""
+Columnar tub storage.
+Instead of a json line per record and a jpeg file per image, a ColumnarTub
+keeps every input in its own append-only file:
+    - scalars (float, int, boolean, str) and fixed length vectors (nparray,
+      list, vector) as fixed width typed arrays, one row per record
+    - images in one frame file per key, either raw uint8 frames of fixed size
+      or jpeg frames with an (offset, length) index next to it
+The reader maps the files with np.memmap, so reading a tub of 100k records
+opens a handful of files instead of 100k images. It has the interface of Tub
+(write_record, encode_record/commit_record for the TubPipeline, delete,
+restore, len and iteration), records are returned with the image arrays
+instead of file names.
+"""
+
+import io
+import os
+import json
+import time
+import uuid
+
+import numpy as np
+from PIL import Image
+
+from donkeycar.vehiclepartsfactory.tubindex import DeletedRuns
+
+# dtypes of the fixed width columns, strings are cut to str_len bytes
+SCALAR_DTYPES = {'float': '<f8', 'int': '<i8', 'boolean': '?'}
+VECTOR_TYPES = ('nparray', 'list', 'vector')
+FRAME_FORMATS = ('raw', 'jpeg')
+
+
+def encode_jpeg(value):
+    """ Image array to jpeg bytes, module level so process pools can run it """
+    image = Image.fromarray(np.uint8(value))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class ColumnarTub(object):
+    META = 'columns.json'
+
+    def __init__(self, base_path, inputs=[], types=[], metadata=[],
+                 max_catalog_len=1000, read_only=False, frame_format='jpeg',
+                 str_len=32):
+        """
+        :param base_path: directory of the tub, created if needed
+        :param max_catalog_len: the row count is saved every max_catalog_len
+                                records, rows after it are lost in a crash
+        :param frame_format: raw|jpeg, raw frames are larger on disk but
+                             are read without decoding
+        :param str_len: width of str columns in bytes
+        """
+        assert frame_format in FRAME_FORMATS, \
+            f'Unknown frame format {frame_format}, use {"|".join(FRAME_FORMATS)}'
+        self.base_path = base_path
+        self.read_only = read_only
+        meta_path = os.path.join(base_path, self.META)
+        if os.path.exists(meta_path):
+            # continue an existing tub, its schema wins
+            with open(meta_path) as file:
+                self.meta = json.load(file)
+        else:
+            if read_only:
+                raise FileNotFoundError(f'No columnar tub in {base_path}')
+            os.makedirs(base_path, exist_ok=True)
+            self.meta = {'inputs': list(inputs), 'types': list(types),
+                         'metadata': metadata, 'frame_format': frame_format,
+                         'str_len': str_len, 'shapes': {}, 'count': 0,
+                         'deleted_runs': []}
+        self.inputs = self.meta['inputs']
+        self.types = self.meta['types']
+        self.metadata = self.meta['metadata']
+        self.input_types = dict(zip(self.inputs, self.types))
+        self.frame_format = self.meta['frame_format']
+        self.shapes = self.meta['shapes']
+        self.current_index = self.meta['count']
+        self.deleted_indexes = DeletedRuns()
+        for start, end in self.meta['deleted_runs']:
+            self.deleted_indexes.add_range(start, end)
+        self.save_every = max_catalog_len
+        self.session_id = uuid.uuid4().hex[:8]
+        self.files = {}
+        self.maps = {}
+        # FrameCaches of this tub, cleared on delete and restore
+        self.caches = []
+        if not read_only:
+            self._truncate()
+            self._save_meta()
+
+    # ---------------------------------------------------------------- layout
+
+    def _path(self, key, extension):
+        return os.path.join(self.base_path, key.replace('/', '_') + extension)
+
+    def _dtype(self, key):
+        input_type = self.input_types.get(key, 'int')
+        if input_type == 'str':
+            return np.dtype(f'S{self.meta["str_len"]}')
+        if input_type in VECTOR_TYPES:
+            return np.dtype('<f8')
+        return np.dtype(SCALAR_DTYPES[input_type])
+
+    def _shape(self, key):
+        """ Shape of a row of a column, vectors and frames have a fixed shape """
+        if self.input_types.get(key) in VECTOR_TYPES + ('image_array',):
+            return self.shapes.get(key, [0])
+        return []
+
+    def _columns(self):
+        """ Inputs stored in column files, plus the time stamps """
+        keys = [key for key in self.inputs
+                if self.input_types[key] != 'image_array']
+        return keys + ['_timestamp_ms']
+
+    def _frames(self):
+        return [key for key in self.inputs
+                if self.input_types[key] == 'image_array']
+
+    def _save_meta(self):
+        self.meta['count'] = self.current_index
+        self.meta['deleted_runs'] = list(zip(self.deleted_indexes.starts,
+                                             self.deleted_indexes.ends))
+        path = os.path.join(self.base_path, self.META)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.meta, file)
+        os.replace(path + '.tmp', path)
+
+    def _truncate(self):
+        """ Cut rows written after the last saved count, e.g. by a crash """
+        count = self.current_index
+        for key in self._columns():
+            size = self._dtype(key).itemsize * int(np.prod(self._shape(key)))
+            self._truncate_file(self._path(key, '.bin'), count * size)
+        for key in self._frames():
+            if self.frame_format == 'raw':
+                size = int(np.prod(self._shape(key)))
+                self._truncate_file(self._path(key, '.frames'), count * size)
+                continue
+            index_path = self._path(key, '.index')
+            self._truncate_file(index_path, count * 16)
+            end = 0
+            if count and os.path.exists(index_path):
+                offset, length = np.fromfile(index_path, dtype='<i8',
+                                             offset=(count - 1) * 16, count=2)
+                end = int(offset + length)
+            self._truncate_file(self._path(key, '.frames'), end)
+
+    @staticmethod
+    def _truncate_file(path, size):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+    # ----------------------------------------------------------------- write
+
+    def _file(self, key, extension):
+        name = key + extension
+        if name not in self.files:
+            # big buffers, the data goes to disk in chunks
+            self.files[name] = open(self._path(key, extension), 'ab',
+                                    buffering=1 << 20)
+        return self.files[name]
+
+    def write_record(self, record=None):
+        self.commit_record(*self.encode_record(record))
+
+    def encode_record(self, record, timestamp_ms=None, encode=None):
+        """
+        Convert a record into column values and encoded frames, see
+        Tub.encode_record. encode turns an image array into jpeg bytes.
+        """
+        contents = dict()
+        images = dict()
+        for key, value in record.items():
+            if value is None or key not in self.input_types:
+                continue
+            input_type = self.input_types[key]
+            if input_type == 'image_array':
+                value = np.asarray(value, dtype=np.uint8)
+                if self.frame_format == 'raw':
+                    images[key] = np.ascontiguousarray(value)
+                else:
+                    images[key] = (encode or encode_jpeg)(value)
+                    # keep the shape for the reader
+                    contents[key] = value.shape
+            elif input_type == 'str':
+                contents[key] = str(value).encode()
+            elif input_type in VECTOR_TYPES:
+                contents[key] = np.asarray(value, dtype=np.float64).ravel()
+            else:
+                contents[key] = value
+        if timestamp_ms is None:
+            timestamp_ms = int(round(time.time() * 1000))
+        contents['_timestamp_ms'] = timestamp_ms
+        return contents, images
+
+    def _fix_shape(self, key, extension, shape, itemsize):
+        """
+        Set the row shape of a vector column or raw frame file from its first
+        value, records before it get zero rows
+        """
+        self.shapes[key] = list(shape)
+        file = self._file(key, extension)
+        row_size = itemsize * int(np.prod(shape))
+        for _ in range(self.current_index):
+            file.write(bytes(row_size))
+        self.flush()
+
+    def commit_record(self, contents, images):
+        """ Append one row to every column and frame file """
+        if self.read_only:
+            raise RuntimeError('Tub is read only')
+        if self.frame_format == 'raw':
+            # check before writing anything, the files stay aligned
+            for key in self._frames():
+                data = images.get(key)
+                if data is not None and key in self.shapes \
+                        and list(data.shape) != self.shapes[key]:
+                    raise ValueError(f'Frame {key} of shape {data.shape} does not '
+                                     f'match the tub frame shape {self.shapes[key]}')
+        for key in self._columns():
+            value = contents.get(key)
+            dtype = self._dtype(key)
+            if self.input_types.get(key) in VECTOR_TYPES:
+                # the first value fixes the length of the rows, until then
+                # nothing is written
+                if key not in self.shapes:
+                    if value is None:
+                        continue
+                    self._fix_shape(key, '.bin', [len(value)], dtype.itemsize)
+                row = np.zeros(self.shapes[key], dtype=dtype)
+                if value is not None:
+                    row[:len(value)] = value[:len(row)]
+            else:
+                # a missing value is stored as 0, False or ''
+                row = np.array(value if value is not None else 0, dtype=dtype)
+            self._file(key, '.bin').write(row.tobytes())
+
+        for key in self._frames():
+            data = images.get(key)
+            if self.frame_format == 'raw':
+                # the first frame fixes the frame size
+                if key not in self.shapes:
+                    if data is None:
+                        continue
+                    self._fix_shape(key, '.frames', data.shape, 1)
+                if data is None:
+                    data = np.zeros(self.shapes[key], dtype=np.uint8)
+                self._file(key, '.frames').write(data.tobytes())
+            else:
+                if key not in self.shapes and data is not None:
+                    self.shapes[key] = list(contents[key])
+                    self.flush()
+                frames = self._file(key, '.frames')
+                offset = frames.tell()
+                if data is not None:
+                    frames.write(data)
+                length = len(data) if data is not None else 0
+                self._file(key, '.index').write(
+                    np.array([offset, length], dtype='<i8').tobytes())
+        self.current_index += 1
+        if self.current_index % self.save_every == 0:
+            self.flush()
+
+    def flush(self):
+        for file in self.files.values():
+            file.flush()
+        if not self.read_only:
+            self._save_meta()
+
+    def close(self):
+        self.flush()
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+        self.maps = {}
+
+    # ------------------------------------------------------------------ read
+
+    def _map(self, key, extension, dtype, shape):
+        """ np.memmap of the first current_index rows of a file """
+        name = key + extension
+        count = self.current_index
+        cached_count, cached = self.maps.get(name, (None, None))
+        if cached_count == count:
+            return cached
+        if name in self.files:
+            self.files[name].flush()
+        path = self._path(key, extension)
+        if count == 0 or not os.path.exists(path) or os.path.getsize(path) == 0:
+            array = np.zeros((0,) + tuple(shape), dtype=dtype)
+        elif extension == '.frames' and self.frame_format == 'jpeg':
+            # bytes of variable length frames, the index has the rows
+            array = np.memmap(path, dtype=np.uint8, mode='r')
+        else:
+            array = np.memmap(path, dtype=dtype, mode='r',
+                              shape=(count,) + tuple(shape))
+        self.maps[name] = count, array
+        return array
+
+    def column(self, key):
+        """ Read only memmap of a column, one row per record (deleted included) """
+        return self._map(key, '.bin', self._dtype(key), self._shape(key))
+
+    def frames(self, key):
+        """ Read only memmap of raw frames, shape (records, height, width, depth) """
+        assert self.frame_format == 'raw', 'jpeg frames need read_frame()'
+        return self._map(key, '.frames', np.uint8, self._shape(key))
+
+    def read_frame(self, key, index):
+        if self.frame_format == 'raw':
+            return self.frames(key)[index]
+        offset, length = self._map(key, '.index', np.dtype('<i8'), [2])[index]
+        if length == 0:
+            return None
+        data = self._map(key, '.frames', np.uint8, [])[offset:offset + length]
+        return np.asarray(Image.open(io.BytesIO(data.tobytes())))
+
+    def read_record(self, index):
+        record = {}
+        for key in self.inputs:
+            input_type = self.input_types[key]
+            if input_type == 'image_array':
+                record[key] = self.read_frame(key, index)
+                continue
+            value = self.column(key)[index]
+            if input_type == 'str':
+                record[key] = value.decode()
+            elif input_type in VECTOR_TYPES:
+                record[key] = np.array(value)
+            else:
+                record[key] = value.item()
+        record['_timestamp_ms'] = int(self.column('_timestamp_ms')[index])
+        record['_index'] = index
+        return record
+
+    def alive_indexes(self):
+        return list(self.deleted_indexes.alive(self.current_index))
+
+    def __iter__(self):
+        return (self.read_record(i) for i in self.alive_indexes())
+
+    def __len__(self):
+        return self.current_index - len(self.deleted_indexes)
+
+    # ---------------------------------------------------------------- delete
+
+    def delete_records(self, record_indexes):
+        if isinstance(record_indexes, int):
+            record_indexes = [record_indexes]
+        record_indexes = [i for i in record_indexes if 0 <= i < self.current_index]
+        self.deleted_indexes.add(record_indexes)
+        # the meta count must never be ahead of the rows on disk
+        self.flush()
+        for cache in self.caches:
+            cache.invalidate(record_indexes)
+
+    def delete_last_n_records(self, n):
+        self.delete_records(self.deleted_indexes.last_alive(n, self.current_index))
+
+    def restore_records(self, record_indexes):
+        if isinstance(record_indexes, int):
+            record_indexes = [record_indexes]
+        self.deleted_indexes.remove(record_indexes)
+        self.flush()
+        for cache in self.caches:
+            cache.invalidate(record_indexes)
+
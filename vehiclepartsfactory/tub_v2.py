@@ -1,6 +1,10 @@
 import atexit
 import os
 import time
+import logging
+import threading
+import collections
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 import json
 
@@ -9,6 +13,12 @@ from PIL import Image
 
 from donkeycar.parts.datastore_v2 import Manifest, ManifestIterator
 import donkeycar.vehiclepartsfactory.partfactory as factory
+from donkeycar.vehiclepartsfactory.databus import mp_context
+from donkeycar.vehiclepartsfactory.tub_columnar import ColumnarTub, encode_jpeg
+from donkeycar.vehiclepartsfactory.tubindex import DeletedRuns
+
+logger = logging.getLogger(__name__)
+
 
 class Tub(object):
     """
@@ -27,6 +37,10 @@ class Tub(object):
                                  metadata=metadata, max_len=max_catalog_len,
                                  read_only=read_only)
         self.input_types = dict(zip(self.inputs, self.types))
+        # deleted records as runs, the manifest keeps its own set
+        self.deleted = DeletedRuns(self.manifest.deleted_indexes)
+        # FrameCaches of this tub, cleared on delete and restore
+        self.caches = []
         # Create images folder if necessary
         if not os.path.exists(self.images_base_path):
             os.makedirs(self.images_base_path, exist_ok=True)
@@ -35,7 +49,17 @@ class Tub(object):
         """
         Can handle various data types including images.
         """
+        self.commit_record(*self.encode_record(record))
+
+    def encode_record(self, record, timestamp_ms=None, encode=encode_jpeg):
+        """
+        Convert the values of a record for the manifest, images are encoded
+        to jpeg bytes. Does not touch the manifest, TubPipeline runs it in
+        its encoder workers.
+        :return: contents and {key: jpeg bytes} for commit_record()
+        """
         contents = dict()
+        images = dict()
         for key, value in record.items():
             if value is None:
                 continue
@@ -57,32 +81,54 @@ class Tub(object):
                 elif input_type == 'list' or input_type == 'vector':
                     contents[key] = list(value)
                 elif input_type == 'image_array':
-                    # Handle image array
-                    image = Image.fromarray(np.uint8(value))
-                    name = Tub._image_file_name(self.manifest.current_index, key)
-                    image_path = os.path.join(self.images_base_path, name)
-                    image.save(image_path)
-                    contents[key] = name
+                    # Handle image array, the file name needs the index
+                    # which is only known in commit_record()
+                    images[key] = encode(value)
+                    contents[key] = None
 
         # Private properties
-        contents['_timestamp_ms'] = int(round(time.time() * 1000))
-        contents['_index'] = self.manifest.current_index
+        if timestamp_ms is None:
+            timestamp_ms = int(round(time.time() * 1000))
+        contents['_timestamp_ms'] = timestamp_ms
+        return contents, images
+
+    def commit_record(self, contents, images):
+        """ Save the images of an encoded record and append it to the manifest """
+        index = self.manifest.current_index
+        for key, data in images.items():
+            name = Tub._image_file_name(index, key)
+            with open(os.path.join(self.images_base_path, name), 'wb') as file:
+                file.write(data)
+            contents[key] = name
+        contents['_index'] = index
         contents['_session_id'] = self.manifest.session_id
 
         self.manifest.write_record(contents)
 
+    @property
+    def current_index(self):
+        return self.manifest.current_index
+
     def delete_records(self, record_indexes):
+        if isinstance(record_indexes, int):
+            record_indexes = [record_indexes]
+        self.deleted.add(record_indexes)
         self.manifest.delete_records(record_indexes)
+        for cache in self.caches:
+            cache.invalidate(record_indexes)
 
     def delete_last_n_records(self, n):
-        # build ordered list of non-deleted indexes
-        all_alive_indexes = sorted(set(range(self.manifest.current_index))
-                                   - self.manifest.deleted_indexes)
-        to_delete_indexes = all_alive_indexes[-n:]
-        self.manifest.delete_records(to_delete_indexes)
+        # walk back over the deleted runs, no need to look at the whole tub
+        to_delete_indexes = self.deleted.last_alive(n, self.manifest.current_index)
+        self.delete_records(to_delete_indexes)
 
     def restore_records(self, record_indexes):
+        if isinstance(record_indexes, int):
+            record_indexes = [record_indexes]
+        self.deleted.remove(record_indexes)
         self.manifest.restore_records(record_indexes)
+        for cache in self.caches:
+            cache.invalidate(record_indexes)
 
     def close(self):
         self.manifest.close()
@@ -91,7 +137,7 @@ class Tub(object):
         return ManifestIterator(self.manifest)
 
     def __len__(self):
-        return self.manifest.__len__()
+        return self.manifest.current_index - len(self.deleted)
 
     @classmethod
     def images(cls):
@@ -105,6 +151,171 @@ class Tub(object):
         return name
 
 
+class TubPipeline(object):
+    """
+    Writes records to a tub in the background. put() queues a record and
+    returns, encoder workers turn the images into jpeg bytes in parallel and
+    a single committer saves them and appends the records to the manifest in
+    the order they were put. At most queue_size records are in flight, when
+    the pipeline is full the policy decides:
+        block        - put() waits until a record is committed
+        drop_oldest  - the oldest record not being encoded yet is dropped
+        drop_newest  - the record being put is dropped
+    """
+    POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+    def __init__(self, tub, queue_size=16, workers=2, policy='block',
+                 executor='thread'):
+        """
+        :param tub: Tub to write to
+        :param queue_size: records in flight, queued, encoding or encoded
+        :param workers: number of encoder workers
+        :param policy: block|drop_oldest|drop_newest
+        :param executor: thread|process, processes encode without the GIL
+        """
+        assert policy in self.POLICIES, \
+            f'Unknown tub writer policy {policy}, use {"|".join(self.POLICIES)}'
+        self.tub = tub
+        self.queue_size = queue_size
+        self.policy = policy
+        self.condition = threading.Condition()
+        self.waiting = collections.deque()  # (seq, record) not yet encoding
+        self.encoded = {}                   # seq: (contents, images) or None if dropped
+        self.next_seq = 0                   # seq of the next record put
+        self.commit_seq = 0                 # seq of the next record to commit
+        self.pending = 0                    # records put and not yet committed or dropped
+        # records in the tub once the pending ones are written
+        self.num_records = tub.current_index
+        self.on = True
+        # counters
+        self.put_count = 0
+        self.committed = 0
+        self.dropped_oldest = 0
+        self.dropped_newest = 0
+        self.failed = 0
+        self.blocked = 0
+        self.blocked_ns = 0
+        self.max_in_flight = 0
+
+        # spawned, a forked worker could inherit locks held by part threads
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context) \
+            if executor == 'process' else None
+        self.threads = [threading.Thread(target=self.encode_loop, daemon=True,
+                                         name=f'tub-encoder-{i}')
+                        for i in range(workers)]
+        self.threads.append(threading.Thread(target=self.commit_loop, daemon=True,
+                                             name='tub-committer'))
+        for t in self.threads:
+            t.start()
+
+    def encode(self, value):
+        if self.pool is None:
+            return encode_jpeg(value)
+        # the worker thread waits for the process doing the work
+        return self.pool.submit(encode_jpeg, value).result()
+
+    def put(self, record, timestamp_ms=None):
+        """ Queue a record, returns False if it was dropped """
+        if timestamp_ms is None:
+            timestamp_ms = int(round(time.time() * 1000))
+        # the bus hands out views into its frame ring which are overwritten
+        # by later frames, the record needs its own copy
+        record = {key: value.copy() if isinstance(value, np.ndarray) else value
+                  for key, value in record.items()}
+        with self.condition:
+            self.put_count += 1
+            if self.pending >= self.queue_size:
+                if self.policy == 'drop_newest':
+                    self.dropped_newest += 1
+                    return False
+                if self.policy == 'drop_oldest' and self.waiting:
+                    seq, _ = self.waiting.popleft()
+                    self.encoded[seq] = None
+                    self.dropped_oldest += 1
+                    self.pending -= 1
+                    self.num_records -= 1
+                    self.condition.notify_all()
+                else:
+                    # block, or nothing left to drop as all are encoding
+                    self.blocked += 1
+                    start = time.monotonic_ns()
+                    while self.pending >= self.queue_size and self.on:
+                        self.condition.wait()
+                    self.blocked_ns += time.monotonic_ns() - start
+            self.waiting.append((self.next_seq, (record, timestamp_ms)))
+            self.next_seq += 1
+            self.pending += 1
+            self.num_records += 1
+            self.max_in_flight = max(self.max_in_flight, self.pending)
+            self.condition.notify_all()
+        return True
+
+    def encode_loop(self):
+        while True:
+            with self.condition:
+                while not self.waiting and self.on:
+                    self.condition.wait()
+                if not self.waiting:
+                    return
+                seq, (record, timestamp_ms) = self.waiting.popleft()
+            try:
+                result = self.tub.encode_record(record, timestamp_ms, self.encode)
+            except Exception:
+                logger.exception('Failed to encode tub record')
+                self.failed += 1
+                result = None
+            with self.condition:
+                self.encoded[seq] = result
+                if result is None:
+                    self.pending -= 1
+                    self.num_records -= 1
+                self.condition.notify_all()
+
+    def commit_loop(self):
+        while True:
+            with self.condition:
+                while self.commit_seq not in self.encoded and \
+                        (self.on or self.commit_seq < self.next_seq):
+                    self.condition.wait()
+                if self.commit_seq not in self.encoded:
+                    return
+                result = self.encoded.pop(self.commit_seq)
+            # the manifest is only written by this thread
+            written = False
+            if result is not None:
+                try:
+                    self.tub.commit_record(*result)
+                    self.committed += 1
+                    written = True
+                except Exception:
+                    logger.exception('Failed to write tub record')
+                    self.failed += 1
+            with self.condition:
+                self.commit_seq += 1
+                if result is not None:
+                    self.pending -= 1
+                    if not written:
+                        self.num_records -= 1
+                self.condition.notify_all()
+
+    def close(self):
+        """ Write the queued records and stop the workers """
+        with self.condition:
+            self.on = False
+            self.condition.notify_all()
+        for t in self.threads:
+            t.join()
+        if self.pool is not None:
+            self.pool.shutdown()
+
+    def report(self):
+        return f'{self.committed} of {self.put_count} records written, ' \
+               f'dropped oldest {self.dropped_oldest}, dropped newest ' \
+               f'{self.dropped_newest}, failed {self.failed}, blocked ' \
+               f'{self.blocked} times for {self.blocked_ns / 1e6:.1f} ms, ' \
+               f'max in flight {self.max_in_flight}'
+
+
 # class TubWriter_Original(object):
 #     def __init__(self, base_path, inputs=[], types=[], metadata=[],
 #                  max_catalog_len=1000):
@@ -113,14 +324,30 @@ class TubWriter(factory.Part):
     """
     A Donkey part, which can write records to the datastore.
     """
+    blocking = True
+    sink = True     # writes the tub to disk
+
     def __init__(self, cfg):
         super().__init__(loop_time = 1/cfg.DRIVE_LOOP_HZ)
-        self.tub = Tub(cfg.DATA_PATH, cfg.DATATUB_INPUTS, cfg.DATATUB_TYPES, cfg.DATATUB_METADATA, cfg.DATATUB_MAX_CATALOG_LEN)
+        if cfg.TUB_FORMAT == 'columnar':
+            self.tub = ColumnarTub(cfg.DATA_PATH, cfg.DATATUB_INPUTS, cfg.DATATUB_TYPES, cfg.DATATUB_METADATA, cfg.DATATUB_MAX_CATALOG_LEN,
+                                   frame_format=cfg.TUB_FRAME_FORMAT)
+        else:
+            self.tub = Tub(cfg.DATA_PATH, cfg.DATATUB_INPUTS, cfg.DATATUB_TYPES, cfg.DATATUB_METADATA, cfg.DATATUB_MAX_CATALOG_LEN)
         self.inputs = cfg.DATATUB_INPUTS
+        self.outputs = ['tub/num_records']
+        self.run_condition = 'recording'    # read in read_from_bus
 
         self.run_part = False   # run if database recording value is True      
         self.datalist = []
         self.current_index = 0
+        # encode and write in the background, 0 workers writes in operate()
+        self.pipeline = None
+        if cfg.TUB_WRITER_WORKERS > 0:
+            self.pipeline = TubPipeline(self.tub, queue_size=cfg.TUB_WRITER_QUEUE_SIZE,
+                                        workers=cfg.TUB_WRITER_WORKERS,
+                                        policy=cfg.TUB_WRITER_POLICY,
+                                        executor=cfg.TUB_WRITER_EXECUTOR)
 
     def __iter__(self):
         return self.tub.__iter__()
@@ -137,12 +364,21 @@ class TubWriter(factory.Part):
     def operate(self):
         if self.datalist is not None:
             record = dict(zip(self.tub.inputs, self.datalist))
-            self.tub.write_record(record)
-            self.current_index = self.tub.manifest.current_index
+            if self.pipeline is not None:
+                self.pipeline.put(record)
+                # counts the queued records, written or not yet
+                self.current_index = self.pipeline.num_records
+            else:
+                self.tub.write_record(record)
+                self.current_index = self.tub.current_index
         
     def stop(self):
-        self.tub.close()
+        # wait for the part loop, a record put after close() is never written
         super().stop()
+        if self.pipeline is not None:
+            self.pipeline.close()
+            print('Tub writer:', self.pipeline.report())
+        self.tub.close()
 
 
 
@@ -0,0 +1,112 @@
+"""
+Index of the deleted records of a tub.
+Deleted records come in runs, the joystick deletes the last n records at a
+time, so DeletedRuns keeps sorted, disjoint [start, end) runs instead of a
+set of indexes. Finding the last n alive records walks the runs from the end
+and costs O(n + runs skipped) instead of sorting all indexes of the tub.
+"""
+
+from bisect import bisect_left, bisect_right
+
+
+class DeletedRuns(object):
+    def __init__(self, indexes=()):
+        self.starts = []
+        self.ends = []
+        self.count = 0
+        self.add(indexes)
+
+    @staticmethod
+    def _ranges(indexes):
+        """ Sorted indexes (or a single index) as contiguous [lo, hi) ranges """
+        if isinstance(indexes, int):
+            indexes = [indexes]
+        lo = hi = None
+        for index in sorted(set(indexes)):
+            if index == hi:
+                hi += 1
+                continue
+            if lo is not None:
+                yield lo, hi
+            lo, hi = index, index + 1
+        if lo is not None:
+            yield lo, hi
+
+    def add(self, indexes):
+        for lo, hi in self._ranges(indexes):
+            self.add_range(lo, hi)
+
+    def add_range(self, lo, hi):
+        """ Mark [lo, hi) deleted, merging with touching runs """
+        j = bisect_left(self.ends, lo)
+        k = bisect_right(self.starts, hi)
+        if j < k:
+            merged = sum(self.ends[i] - self.starts[i] for i in range(j, k))
+            lo, hi = min(lo, self.starts[j]), max(hi, self.ends[k - 1])
+        else:
+            merged = 0
+        self.starts[j:k] = [lo]
+        self.ends[j:k] = [hi]
+        self.count += hi - lo - merged
+
+    def remove(self, indexes):
+        for lo, hi in self._ranges(indexes):
+            self.remove_range(lo, hi)
+
+    def remove_range(self, lo, hi):
+        """ Mark [lo, hi) alive again """
+        j = bisect_right(self.ends, lo)
+        k = bisect_left(self.starts, hi)
+        if j >= k:
+            return
+        starts, ends = [], []
+        for i in range(j, k):
+            start, end = self.starts[i], self.ends[i]
+            self.count -= min(end, hi) - max(start, lo)
+            if start < lo:
+                starts.append(start)
+                ends.append(lo)
+            if end > hi:
+                starts.append(hi)
+                ends.append(end)
+        self.starts[j:k] = starts
+        self.ends[j:k] = ends
+
+    def last_alive(self, n, limit):
+        """ Up to n alive indexes below limit, highest first """
+        result = []
+        hi = limit
+        i = bisect_left(self.starts, hi) - 1
+        while hi > 0 and len(result) < n:
+            if i >= 0 and self.ends[i] >= hi:
+                # hi - 1 is deleted, jump over the run
+                hi = self.starts[i]
+                i -= 1
+                continue
+            lo = self.ends[i] if i >= 0 else 0
+            take = min(n - len(result), hi - lo)
+            result.extend(range(hi - 1, hi - 1 - take, -1))
+            hi -= take
+        return result
+
+    def alive(self, limit):
+        """ Alive indexes below limit in order """
+        lo = 0
+        for start, end in zip(self.starts, self.ends):
+            if start >= limit:
+                break
+            yield from range(lo, start)
+            lo = end
+        yield from range(lo, limit)
+
+    def __contains__(self, index):
+        i = bisect_right(self.starts, index) - 1
+        return i >= 0 and index < self.ends[i]
+
+    def __iter__(self):
+        """ Deleted indexes in order """
+        for start, end in zip(self.starts, self.ends):
+            yield from range(start, end)
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,162 @@
+"""
+Batched, prefetching reader for tubs.
+TubReader yields batches as a dictionary of numpy arrays, the images of the
+batch stacked into one (batch, height, width, depth) uint8 array plus one
+array per scalar column. The jpeg images are decoded by a pool of worker
+threads (PIL releases the GIL while decoding) into preallocated batch
+buffers, while the consumer works on the previous batch the next prefetch
+batches are already being decoded. Works on Tub (json manifest and image
+files) and ColumnarTub.
+"""
+
+import os
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from donkeycar.vehiclepartsfactory.tub_columnar import ColumnarTub
+
+
+class TubReader(object):
+    def __init__(self, tub, batch_size=64, image_key='cam/image_array',
+                 columns=None, workers=4, prefetch=2, shuffle=False, seed=None,
+                 reuse_buffers=True, cache=None):
+        """
+        :param tub: Tub or ColumnarTub to read
+        :param batch_size: records per batch, the last batch may be smaller
+        :param image_key: image input to decode, None to read columns only
+        :param columns: scalar inputs to read, default all other inputs
+        :param workers: decoder threads
+        :param prefetch: batches decoded ahead of the one being consumed
+        :param shuffle: read the records in a new random order every epoch
+        :param seed: seed of the shuffle
+        :param reuse_buffers: decode into a ring of prefetch + 2 preallocated
+                              image buffers. The images of a batch are valid
+                              until the batch after the next one is
+                              requested, copy them to keep them longer
+        :param cache: FrameCache of image_key, images come from it instead
+                      of being decoded every epoch
+        """
+        self.tub = tub
+        self.batch_size = batch_size
+        self.image_key = image_key
+        if columns is None:
+            columns = [key for key, input_type in zip(tub.inputs, tub.types)
+                       if input_type != 'image_array']
+        self.columns = columns
+        self.workers = workers
+        self.prefetch = prefetch
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.reuse_buffers = reuse_buffers
+        self.cache = cache
+        self.executor = ThreadPoolExecutor(max_workers=workers,
+                                           thread_name_prefix='tub-decoder')
+        self.columnar = isinstance(tub, ColumnarTub)
+        if self.columnar:
+            # positions are record indexes, columns are memmaps
+            self.indexes = np.array(tub.alive_indexes(), dtype=np.int64)
+            self.records = None
+        else:
+            # the manifest is json, read it once and keep the records
+            self.records = list(tub)
+            self.indexes = np.array([record['_index'] for record in self.records],
+                                    dtype=np.int64)
+        self.image_shape = self._probe_shape() if image_key else None
+        self.buffers = None
+
+    def __len__(self):
+        """ Number of batches per epoch """
+        return (len(self.indexes) + self.batch_size - 1) // self.batch_size
+
+    def _probe_shape(self):
+        if not len(self.indexes):
+            return None
+        image = self._decode(0)
+        return image.shape if image is not None else None
+
+    def _decode(self, position):
+        """ Image of the record at position as an array """
+        if self.cache is not None:
+            return self.cache.get(self.indexes[position])
+        if self.columnar:
+            return self.tub.read_frame(self.image_key, self.indexes[position])
+        name = self.records[position].get(self.image_key)
+        if name is None:
+            return None
+        return np.asarray(Image.open(os.path.join(self.tub.images_base_path, name)))
+
+    def _decode_into(self, positions, out):
+        for position, row in zip(positions, out):
+            image = self._decode(position)
+            if image is None:
+                row[...] = 0
+            else:
+                np.copyto(row, image)
+
+    def _column(self, key, positions):
+        if self.columnar:
+            values = self.tub.column(key)[self.indexes[positions]]
+            if values.dtype.kind == 'S':
+                return np.char.decode(values)
+            return np.asarray(values)
+        return np.array([self.records[p].get(key) for p in positions])
+
+    def _submit(self, positions, buffer):
+        """ Start decoding one batch, returns its futures """
+        if self.image_key is None or self.image_shape is None:
+            return []
+        images = buffer[:len(positions)]
+        if self.columnar and self.tub.frame_format == 'raw' and self.cache is None:
+            # raw frames are copied straight out of the memmap
+            frames = self.tub.frames(self.image_key)
+            return [self.executor.submit(np.take, frames, self.indexes[positions],
+                                         axis=0, out=images)]
+        # one task per worker and batch, a task per image costs more than
+        # decoding a small jpeg
+        chunk = -(-len(positions) // self.workers)
+        return [self.executor.submit(self._decode_into, positions[i:i + chunk],
+                                     images[i:i + chunk])
+                for i in range(0, len(positions), chunk)]
+
+    def _batch(self, positions, buffer, futures):
+        for future in futures:
+            future.result()
+        batch = {'_index': self.indexes[positions]}
+        if futures:
+            batch[self.image_key] = buffer[:len(positions)]
+        for key in self.columns:
+            batch[key] = self._column(key, positions)
+        return batch
+
+    def _buffer(self):
+        shape = (self.batch_size,) + tuple(self.image_shape or (0,))
+        if not self.reuse_buffers:
+            return np.empty(shape, dtype=np.uint8)
+        if self.buffers is None:
+            self.buffers = collections.deque(
+                np.empty(shape, dtype=np.uint8) for _ in range(self.prefetch + 2))
+        buffer = self.buffers[0]
+        self.buffers.rotate(-1)
+        return buffer
+
+    def __iter__(self):
+        """ One epoch of batches """
+        order = np.arange(len(self.indexes))
+        if self.shuffle:
+            self.rng.shuffle(order)
+        batches = (order[start:start + self.batch_size]
+                   for start in range(0, len(order), self.batch_size))
+        pending = collections.deque()
+        for positions in batches:
+            buffer = self._buffer()
+            pending.append((positions, buffer, self._submit(positions, buffer)))
+            if len(pending) > self.prefetch:
+                yield self._batch(*pending.popleft())
+        while pending:
+            yield self._batch(*pending.popleft())
+
+    def close(self):
+        self.executor.shutdown()